@@ -8,7 +8,8 @@ from pprint import pprint
 
 import logging
 
-from gdf import GDF
+from gdf import GDF, get_shared_gdf
+from _expressions import compile_expression
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG) # Logging level for this module
@@ -37,13 +38,23 @@ class Analytics(object):
 
 	OPERATORS_REDUCTION = \
 	{
-		'median': 'median(array1)'
+		'median': 'median(array1)',
+		'p10': 'percentile(array1, 10)',
+		'p25': 'percentile(array1, 25)',
+		'p75': 'percentile(array1, 75)',
+		'p90': 'percentile(array1, 90)'
 	}
 
-	def __init__(self):
+	def __init__(self, gdf=None):
+		'''
+		Parameter:
+			gdf: Optional GDF object to use. Defaults to the process-wide shared GDF instance
+		'''
 		logger.debug('Initialise Analytics Module.')
-		self.gdf = GDF()
-		self.gdf.debug = False
+		if gdf is None:
+			self.gdf = get_shared_gdf()
+		else:
+			self.gdf = gdf
 		self.plan = []
 		self.planDict = {}
 
@@ -144,10 +155,8 @@ class Analytics(object):
 
 			orig_function = function
 			logger.debug('function before = %s', function)
-			count = 1
-			for variable in variables:
-				function = function.replace('array'+str(count), variable)
-				count += 1
+			expression = compile_expression(function, variables, self.getVariableTypes(arrays.keys()[0], arrays.values()[0]))
+			function = expression.function
 			logger.debug('function after = %s', function)
 
 			task = {}
@@ -158,20 +167,24 @@ class Analytics(object):
 			task['function'] = function
 			task['array_output'] = copy.deepcopy(arrays.values()[0]['array_output'])
 			task['array_output']['variable'] = name
+			task['array_output']['data_type'] = expression.result_type
+			task['cost'] = expression.get_cost(task['array_output']['shape'])
+			logger.debug('cost = %s', task['cost'])
 
 			return self.add_to_plan(name, task)
 
 		else: # multi-dependencies
 			pprint(arrays)
+			types = {}
 			for array in arrays:
 				variables.append(array.keys()[0])
+				types.update(self.getVariableTypes(array.keys()[0], array.values()[0]))
+				types.setdefault(array.keys()[0], array.values()[0]['array_output'].get('data_type'))
 
 			orig_function = function
 			logger.debug('function before = %s', function)
-			count = 1
-			for variable in variables:
-				function = function.replace('array'+str(count), variable)
-				count += 1
+			expression = compile_expression(function, variables, types)
+			function = expression.function
 			logger.debug('function after = %s', function)
 
 			task = {}
@@ -185,6 +198,9 @@ class Analytics(object):
 			task['function'] = function
 			task['array_output'] = copy.deepcopy(arrays[0].values()[0]['array_output'])
 			task['array_output']['variable'] = name
+			task['array_output']['data_type'] = expression.result_type
+			task['cost'] = expression.get_cost(task['array_output']['shape'])
+			logger.debug('cost = %s', task['cost'])
 
 			return self.add_to_plan(name, task)
 
@@ -198,8 +214,9 @@ class Analytics(object):
 
 	def applyReduction(self, array1, dimensions, function, name):
 
-		function = self.OPERATORS_REDUCTION.get(function)
-		return self.applyGenericReductionFunction(array1, dimensions, function, name)
+		if function not in self.OPERATORS_REDUCTION:
+			raise AssertionError("Unknown reduction %s" % function)
+		return self.applyGenericReduction(array1, dimensions, self.OPERATORS_REDUCTION[function], name)
 
 	def applyGenericReduction(self, arrays, dimensions, function, name):
 		
@@ -266,6 +283,14 @@ class Analytics(object):
 
 			return self.add_to_plan(name, task)
 
+	def getVariableTypes(self, name, task):
+		'''
+		Return dict of the data types of the arrays in the result of a task keyed by the names band math uses for them
+		'''
+		if task['function'] == 'get_data':
+			return dict((array_input.keys()[0], array_input.values()[0].get('data_type')) for array_input in task['array_input'])
+		return {name: task['array_output'].get('data_type')}
+
 	def diffList(self, list1, list2):
 		list2 = set(list2)
 		return [result for result in list1 if result not in list2]
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+import ast
+
+import numpy as np
+import numexpr as ne
+from numexpr.necompiler import getType
+
+import logging
+
+'''
+Band math expressions for Analytics:
+- expressions are parsed once into an AST, which is checked to contain only operations numexpr supports
+- the placeholders array1, array2, ... are replaced by the variable names they refer to by the positions of the names 
+  in the AST, so that array1 never matches part of array10
+- every other name must be a variable of the inputs in the plan
+- the numexpr program is compiled for the types of the inputs, which gives the result type, and cached
+- the cost of a task (floating point operations and bytes read and written) is estimated from the AST
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG) # Logging level for this module
+
+PLACEHOLDER_PREFIX = 'array'
+DEFAULT_DATA_TYPE = 'float64' # Assumed type of inputs whose type is unknown
+
+NUMEXPR_FUNCTIONS = set(['where', 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'sinh', 'cosh', 'tanh', 
+						 'arcsinh', 'arccosh', 'arctanh', 'log', 'log10', 'log1p', 'exp', 'expm1', 'sqrt', 'abs', 
+						 'conj', 'real', 'imag', 'complex', 'floor', 'ceil'])
+NUMEXPR_CONSTANTS = set(['True', 'False'])
+NUMEXPR_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Num, ast.Load,
+				 ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow, ast.LShift, ast.RShift, ast.BitAnd, ast.BitOr, 
+				 ast.BitXor, ast.USub, ast.UAdd, ast.Invert, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+_RESULT_TYPES = {'b': 'bool', 'i': 'int32', 'l': 'int64', 'f': 'float32', 'd': 'float64', 'c': 'complex128'} # Keyed by numexpr type code
+
+_compiled_expressions = {} # CompiledExpression objects keyed by function, variables and types
+
+class CompiledExpression(object):
+	'''
+	Band math expression with its placeholders replaced by variable names and compiled by numexpr
+	'''
+
+	def __init__(self, function, variables, types=None):
+		'''
+		Parameters:
+			function: expression using the placeholders array1, array2, ... and/or the variable names
+			variables: list of variable names referred to by array1, array2, ...
+			types: optional dict of numpy type names (None if unknown) keyed by the names of all variables of the inputs, 
+				which can also be used directly. Types default to DEFAULT_DATA_TYPE
+		'''
+		self.orig_function = function
+		types = types or {}
+		function = function.strip()
+		try:
+			tree = ast.parse(function, mode='eval')
+		except SyntaxError as error:
+			raise AssertionError('Invalid expression %r: %s' % (self.orig_function, error.msg))
+
+		line_offsets = [0]
+		for line in function.split('\n'):
+			line_offsets.append(line_offsets[-1] + len(line) + 1)
+
+		function_names = set(id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call))
+		replacements = []
+		self.variables = []
+		self.operations = 0
+		for node in ast.walk(tree):
+			if not isinstance(node, NUMEXPR_NODES):
+				raise AssertionError('Unsupported %s in expression %r' % (node.__class__.__name__, self.orig_function))
+
+			if isinstance(node, ast.Call):
+				if not isinstance(node.func, ast.Name) or node.func.id not in NUMEXPR_FUNCTIONS:
+					raise AssertionError('Unsupported function in expression %r' % self.orig_function)
+				if node.keywords or node.starargs or node.kwargs:
+					raise AssertionError('Unsupported arguments in expression %r' % self.orig_function)
+				self.operations += 1
+			elif isinstance(node, ast.Compare):
+				if len(node.ops) > 1:
+					raise AssertionError('Chained comparison in expression %r' % self.orig_function)
+				self.operations += 1
+			elif isinstance(node, (ast.BinOp, ast.UnaryOp)):
+				self.operations += 1
+			elif isinstance(node, ast.Name) and id(node) not in function_names and node.id not in NUMEXPR_CONSTANTS:
+				variable = self.get_variable(node.id, variables, types)
+				if variable != node.id:
+					replacements.append((line_offsets[node.lineno - 1] + node.col_offset, node.id, variable))
+				if variable not in self.variables:
+					self.variables.append(variable)
+
+		for offset, name, variable in sorted(replacements, reverse=True):
+			function = function[:offset] + variable + function[offset + len(name):]
+		self.function = function
+
+		self.types = dict((variable, types.get(variable) or DEFAULT_DATA_TYPE) for variable in self.variables)
+		signature = [(variable, getType(np.empty(0, dtype=self.types[variable]))) for variable in sorted(self.variables)]
+		try:
+			self.program = ne.NumExpr(self.function, signature)
+		except (NotImplementedError, TypeError, ValueError, KeyError) as error:
+			raise AssertionError('Unable to compile expression %r: %s' % (self.function, error))
+		self.result_type = _RESULT_TYPES.get(self.program.fullsig[0], DEFAULT_DATA_TYPE)
+
+	def get_variable(self, name, variables, types):
+		'''
+		Return variable name referred to by a name in the expression
+		'''
+		if name.startswith(PLACEHOLDER_PREFIX) and name[len(PLACEHOLDER_PREFIX):].isdigit():
+			index = int(name[len(PLACEHOLDER_PREFIX):])
+			if not 1 <= index <= len(variables):
+				raise AssertionError('%s in expression %r refers to none of the %d inputs' % (name, self.orig_function, len(variables)))
+			return variables[index - 1]
+		if name not in variables and name not in types:
+			raise AssertionError('Unknown variable %s in expression %r' % (name, self.orig_function))
+		return name
+
+	def get_cost(self, shape):
+		'''
+		Return dict of the estimated number of floating point operations ('flops') and of bytes read and written 
+		('bytes') evaluating the expression for a result of the given shape
+		'''
+		size = int(np.prod(shape))
+		item_bytes = sum(np.dtype(data_type).itemsize for data_type in self.types.values()) + np.dtype(self.result_type).itemsize
+		return {'flops': self.operations * size, 'bytes': item_bytes * size}
+
+def compile_expression(function, variables, types=None):
+	'''
+	Return CompiledExpression of function, compiling it only the first time it is used with the same variables and types
+	Parameters:
+		function: expression using the placeholders array1, array2, ... and/or the variable names
+		variables: list of variable names referred to by array1, array2, ...
+		types: optional dict of numpy type names (None if unknown) keyed by the names of all variables of the inputs
+	'''
+	key = (function, tuple(variables), tuple(sorted((types or {}).items())))
+	expression = _compiled_expressions.get(key)
+	if expression is None:
+		expression = CompiledExpression(function, variables, types)
+		_compiled_expressions[key] = expression
+	return expression
@@ -4,6 +4,9 @@
 # https://github.com/GeoscienceAustralia/agdc/blob/master/src/stacker.py
 
 import math
+import copy
+import json
+from multiprocessing.pool import ThreadPool
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy import ndimage
@@ -281,48 +284,193 @@ def writeToCSV(array_result, filename):
 			else:
 				writer.writerow(data)
 
-def get_pqa_mask(pqa_ndarray, good_pixel_masks=[32767,16383,2457], dilation=3):
+# Bit flags of the Landsat pixel quality (PQA) product keyed by flag name. A set bit means the pixel passed the test
+LANDSAT_PQA_FLAGS = {
+	'flags': {'band_1_unsaturated': 0, 'band_2_unsaturated': 1, 'band_3_unsaturated': 2, 'band_4_unsaturated': 3,
+			  'band_5_unsaturated': 4, 'band_61_unsaturated': 5, 'band_62_unsaturated': 6, 'band_7_unsaturated': 7,
+			  'contiguous': 8, 'land': 9, 'no_cloud_acca': 10, 'no_cloud_fmask': 11, 'no_cloud_shadow_acca': 12,
+			  'no_cloud_shadow_fmask': 13, 'no_topographic_shadow': 14, 'spare': 15},
+	# Good pixels pass all tests except band 62 saturation (always 0 for Landsat 5) and topographic shadow
+	'good': [{'band_1_unsaturated': 1, 'band_2_unsaturated': 1, 'band_3_unsaturated': 1, 'band_4_unsaturated': 1,
+			  'band_5_unsaturated': 1, 'band_61_unsaturated': 1, 'band_7_unsaturated': 1, 'contiguous': 1, 'land': 1,
+			  'no_cloud_acca': 1, 'no_cloud_fmask': 1, 'no_cloud_shadow_acca': 1, 'no_cloud_shadow_fmask': 1, 'spare': 0}],
+	# Pixels near clouds and cloud shadows are not good either
+	'dilate': [{'flag': 'no_cloud_acca', 'value': 0, 'pixels': 3},
+			   {'flag': 'no_cloud_fmask', 'value': 0, 'pixels': 3},
+			   {'flag': 'no_cloud_shadow_acca', 'value': 0, 'pixels': 3},
+			   {'flag': 'no_cloud_shadow_fmask', 'value': 0, 'pixels': 3}],
+	# As in stacker.py, each dilation in turn adds its bit to the flags of the pixels it reaches, and the carry into the 
+	# flags above extends their dilation: 12 pixels around ACCA clouds down to 3 pixels around Fmask cloud shadows
+	'carry': True
+}
+
+_flag_lookup_tables = {} # Lookup tables of flag codes keyed by flag definition and dtype
+
+def get_pqa_mask(pqa_ndarray, good_pixel_masks=None, dilation=3, num_threads=1):
 	'''
-	create pqa_mask from a ndarray
+	create pqa_mask from a T x Y x X ndarray of Landsat PQA flags. See get_flag_mask
 
 	Parameters:
 		pqa_ndarray: input pqa array
-		good_pixel_masks: known good pixel values
-		dilation: amount of dilation to apply
-	'''
-
-	pqa_mask = np.zeros(pqa_ndarray.shape, dtype=np.bool)
-	for i in range(len(pqa_ndarray)):
-		pqa_array = pqa_ndarray[i]
-		# Ignore bit 6 (saturation for band 62) - always 0 for Landsat 5
-		pqa_array = pqa_array | 64
-
-		# Dilating both the cloud and cloud shadow masks 
-		s = [[1,1,1],[1,1,1],[1,1,1]]
-		acca = (pqa_array & 1024) >> 10
-		erode = ndimage.binary_erosion(acca, s, iterations=dilation, border_value=1)
-		dif = erode - acca
-		dif[dif < 0] = 1
-		pqa_array += (dif << 10)
-		del acca
-		fmask = (pqa_array & 2048) >> 11
-		erode = ndimage.binary_erosion(fmask, s, iterations=dilation, border_value=1)
-		dif = erode - fmask
-		dif[dif < 0] = 1
-		pqa_array += (dif << 11)
-		del fmask
-		acca_shad = (pqa_array & 4096) >> 12
-		erode = ndimage.binary_erosion(acca_shad, s, iterations=dilation, border_value=1)
-		dif = erode - acca_shad
-		dif[dif < 0] = 1
-		pqa_array += (dif << 12)
-		del acca_shad
-		fmask_shad = (pqa_array & 8192) >> 13
-		erode = ndimage.binary_erosion(fmask_shad, s, iterations=dilation, border_value=1)
-		dif = erode - fmask_shad
-		dif[dif < 0] = 1
-		pqa_array += (dif << 13)
-
-		for good_pixel_mask in good_pixel_masks:
-			pqa_mask[i][pqa_array == good_pixel_mask] = True
-	return pqa_mask
+		good_pixel_masks: optional list of known good pixel values. Bit 6 (saturation for band 62) is ignored.
+			Defaults to the good pixels of LANDSAT_PQA_FLAGS
+		dilation: number of pixels by which cloud and cloud shadow flags are dilated. Must be at least 1
+		num_threads: number of threads to use
+	'''
+	return get_flag_mask(pqa_ndarray, get_pqa_flag_definition(good_pixel_masks, dilation), num_threads)
+
+def get_pqa_flag_definition(good_pixel_masks=None, dilation=3):
+	'''
+	Return copy of LANDSAT_PQA_FLAGS with optional good pixel values and dilation. Bit 6 is set in all flags before 
+	they are compared with the good pixel values, so values without bit 6 match nothing.
+	Dilations of less than 1 pixel raise ValueError. The original binary_erosion(iterations=0) eroded until nothing 
+	changed, which has no equivalent here
+	'''
+	if dilation < 1:
+		raise ValueError('PQA dilation must be at least 1 pixel, not %s' % dilation)
+	flag_definition = copy.deepcopy(LANDSAT_PQA_FLAGS)
+	if good_pixel_masks is not None:
+		flag_definition['good'] = [dict((flag, (value >> bit) & 1) for flag, bit in LANDSAT_PQA_FLAGS['flags'].items() if bit != 6) 
+								   for value in good_pixel_masks if value & 64]
+	for dilate in flag_definition['dilate']:
+		dilate['pixels'] = dilation
+	return flag_definition
+
+def get_flag_mask(flag_ndarray, flag_definition, num_threads=1):
+	'''
+	create boolean mask of good pixels from a T x Y x X ndarray of bit flags. All time slices are processed at once, 
+	optionally split into blocks of time slices processed by a pool of threads. The flags of 8 and 16 bit arrays are 
+	evaluated in one pass through a lookup table of all possible values
+
+	Parameters:
+		flag_ndarray: input array of bit flags
+		flag_definition: dict containing:
+			'flags': bit (or [first bit, number of bits]) of each flag keyed by flag name
+			'good': optional list of dicts of flag values (or lists of values) keyed by flag name. A pixel is good if 
+				its flags match any of them. All pixels are good if not specified
+			'dilate': optional list of dicts containing a flag name, value (or list of values) and number of pixels. 
+				Pixels within that number of pixels of a pixel with that flag value in the same time slice are not good
+			'carry': optional boolean. If true, the dilations are applied in order by adding the bit of each (single bit) 
+				flag to the flags of the pixels it reaches, as the original Landsat PQA masking did. The carry into 
+				the flags above dilates them as well
+		num_threads: number of threads to use
+	'''
+
+	if num_threads > 1 and len(flag_ndarray) > 1:
+		blocks = np.array_split(np.arange(len(flag_ndarray)), min(num_threads, len(flag_ndarray)))
+		pool = ThreadPool(len(blocks))
+		try:
+			block_masks = pool.map(lambda block: _get_flag_block_mask(flag_ndarray[block[0]:block[-1] + 1], flag_definition), blocks)
+		finally:
+			pool.close()
+			pool.join()
+		return np.concatenate(block_masks)
+
+	return _get_flag_block_mask(flag_ndarray, flag_definition)
+
+def get_flag_overlap(flag_definition):
+	'''
+	Return number of pixels around a pixel whose flags can affect its mask
+	'''
+	pixels = [dilate['pixels'] for dilate in flag_definition.get('dilate', [])]
+	if flag_definition.get('carry'): # Dilations can follow each other
+		return sum(pixels)
+	return max([0] + pixels)
+
+def _get_flag_block_mask(flag_ndarray, flag_definition):
+	'''
+	create flag mask for a block of time slices
+	'''
+	if flag_definition.get('carry'):
+		flag_ndarray = _carry_dilations(flag_ndarray, flag_definition)
+		dilations = []
+	else:
+		dilations = _get_dilations(flag_definition)
+	codes = _get_flag_codes(flag_ndarray, flag_definition, dilations)
+	mask = (codes & 1).view(np.bool)
+
+	# A (2 * pixels + 1) square dilation is separable
+	for index, pixels in enumerate(dilations):
+		flagged = (codes >> (index + 1)) & 1
+		if flagged.any():
+			mask &= ~ndimage.maximum_filter(flagged, size=(1, 2 * pixels + 1, 2 * pixels + 1), mode='constant', cval=0).view(np.bool)
+		del flagged
+
+	return mask
+
+def _carry_dilations(flag_ndarray, flag_definition):
+	'''
+	Return copy of flag array with the bit of each dilated flag added in turn to the flags of the pixels within the 
+	dilation of pixels with the flag value, which have a different value
+	'''
+	flag_array = flag_ndarray.copy()
+	for dilate in flag_definition.get('dilate', []):
+		bit = flag_definition['flags'][dilate['flag']]
+		assert isinstance(bit, (int, long)), 'Carried dilation of multiple bit flag %s' % dilate['flag']
+		if dilate['pixels'] <= 0:
+			continue
+		flagged = _match_flags(flag_array, flag_definition, {dilate['flag']: dilate['value']})
+		size = 2 * dilate['pixels'] + 1
+		reached = ndimage.maximum_filter(flagged, size=(1, size, size), mode='constant', cval=0) & ~flagged
+		del flagged
+		flag_array += reached.astype(flag_array.dtype) << bit
+	return flag_array
+
+def _get_dilations(flag_definition):
+	'''
+	Return sorted list of distinct numbers of pixels by which flags are dilated
+	'''
+	return sorted(set(dilate['pixels'] for dilate in flag_definition.get('dilate', []) if dilate['pixels'] > 0))
+
+def _get_flag_codes(flag_array, flag_definition, dilations):
+	'''
+	Return uint8 array with bit 0 set for pixels whose flags are good and bit i set for pixels with flags to be 
+	dilated by dilations[i - 1] pixels. 8 and 16 bit arrays are looked up in a table of the codes of all values
+	'''
+	if flag_array.dtype.itemsize > 2:
+		return _evaluate_flags(flag_array, flag_definition, dilations)
+
+	unsigned_dtype = np.dtype('u%d' % flag_array.dtype.itemsize)
+	key = (json.dumps(flag_definition, sort_keys=True), unsigned_dtype.str)
+	lookup_table = _flag_lookup_tables.get(key)
+	if lookup_table is None:
+		lookup_table = _evaluate_flags(np.arange(1 << (8 * unsigned_dtype.itemsize), dtype=unsigned_dtype), flag_definition, dilations)
+		_flag_lookup_tables[key] = lookup_table
+	return lookup_table[flag_array.view(unsigned_dtype)]
+
+def _evaluate_flags(flag_array, flag_definition, dilations):
+	'''
+	Return uint8 array of flag codes as described for _get_flag_codes by evaluating the flag definition
+	'''
+	codes = np.zeros(flag_array.shape, dtype=np.uint8)
+	for condition in flag_definition.get('good', [{}]):
+		codes |= _match_flags(flag_array, flag_definition, condition)
+
+	for index, pixels in enumerate(dilations):
+		for dilate in flag_definition['dilate']:
+			if dilate['pixels'] == pixels:
+				codes |= _match_flags(flag_array, flag_definition, {dilate['flag']: dilate['value']}).view(np.uint8) << (index + 1)
+
+	return codes
+
+def _match_flags(flag_array, flag_definition, condition):
+	'''
+	Return boolean array of pixels whose flags have the values in a condition dict. Flags with single values are
+	compared in one bitwise expression
+	'''
+	bit_mask = 0
+	bit_value = 0
+	value_lists = []
+	for flag, value in condition.items():
+		field = flag_definition['flags'][flag]
+		first_bit, bit_count = (field, 1) if isinstance(field, (int, long)) else field
+		if isinstance(value, (list, tuple)):
+			value_lists.append((first_bit, (1 << bit_count) - 1, value))
+		else:
+			bit_mask |= ((1 << bit_count) - 1) << first_bit
+			bit_value |= value << first_bit
+
+	match = (flag_array & bit_mask) == bit_value
+	for first_bit, field_mask, values in value_lists:
+		match &= np.in1d((flag_array >> first_bit) & field_mask, values).reshape(flag_array.shape)
+	return match
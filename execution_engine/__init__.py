@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
 import sys
+import threading
 import numpy as np
-import numexpr as ne
 import copy
 from pprint import pprint
 import gdal
@@ -10,38 +10,335 @@ import osr
 
 import logging
 
-from gdf import GDF
-from analytics_utils import get_pqa_mask
+from gdf import GDF, get_shared_gdf, directory_writable
+from _scheduler import PlanScheduler, get_plan_graph
+from _tiling import MASK_OVERLAP, can_tile, crop_result, get_plan_extent, get_tiles, tile_plan, stitch_results
+from _reductions import get_kernel, parse_reduction, reduce_array, to_nan_array
+from _online import TIME_DIMENSION, get_reducer, get_streaming_plan, get_time_chunks, set_time_range
+from _cache import ResultCache
+from _masks import MaskStore, compute_pqa_mask, get_flag_definition
+from _evaluate import evaluate, get_no_data_expression, get_result_shape, get_result_type
+from _optimiser import FUSED_FUNCTION, optimise_plan, prune_plan, push_down_ranges
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG) # Logging level for this module
 
+class NoDataError(Exception):
+	'''
+	Raised when a get_data task finds no data in its range
+	'''
+	pass
+
 class ExecutionEngine(object):
 
 	SUPPORTED_REDUCTION_OPERATORS = [ 'min', 'max', 'amin', 'amax', 'nanmin', 'nanmax', 'ptp',
 									  'median', 'average', 'mean', 'std', 'var', 'nanmean', 'nanstd', 'nanvar',
-									  'argmax', 'argmin', 'sum', 'prod', 'all', 'any' 
+									  'argmax', 'argmin', 'sum', 'prod', 'all', 'any', 'percentile', 'quantile'
 									]
 
-	def __init__(self):
+	def __init__(self, gdf=None, memory_limit=None, temp_dir=None):
+		'''
+		Parameter:
+			gdf: Optional GDF object to use. Defaults to the process-wide shared GDF instance
+			memory_limit: Optional maximum number of bytes of results to hold in memory. Results beyond this are 
+				spilled to memory-mapped files
+			temp_dir: Optional directory for spilled results. Defaults to the GDF temp_dir
+		'''
 		logger.debug('Initialise Execution Module.')
-		self.gdf = GDF()
-		self.gdf.debug = False
-		self.cache = {}
-
-	def executePlan(self, plan):
-
+		if gdf is None:
+			self.gdf = get_shared_gdf()
+		else:
+			self.gdf = gdf
+
+		if temp_dir is None:
+			temp_dir = getattr(self.gdf, 'temp_dir', None)
+			if temp_dir and not directory_writable(temp_dir):
+				logger.warning('Unable to access temporary directory %s. Using system default instead.', temp_dir)
+				temp_dir = None
+
+		self.cache = ResultCache(memory_limit, temp_dir)
+		self.num_workers = None # Number of concurrent tasks. Defaults to number of CPUs
+		self.num_threads = None # Number of numexpr threads evaluating each band math expression. Defaults to the numexpr setting
+		self.read_lock = threading.Lock() # netCDF reads are not thread-safe
+		self.check_aliasing = False # Debug mode: check that cached results don't share memory and make them read-only
+		self.optimise = False # Optimise plans before execution. Results of removed and fused intermediates are not cached
+		self.consumers = {} # Lists of consumer task names keyed by task name for the plan being executed
+		self.free_intermediates = False
+		self.shared_reads = {} # get_data responses shared by several tasks keyed by shared read key
+		self.mask_store = MaskStore(self.gdf) # Stored PQA masks. Masks are computed for every plan if None
+
+	def executePlan(self, plan, num_workers=None, free_intermediates=False, outputs=None, ranges=None):
+		'''
+		Execute plan, running independent tasks concurrently once their inputs are available
+		Parameters:
+			plan: list of tasks as produced by Analytics
+			num_workers: maximum number of tasks to run concurrently. Defaults to self.num_workers
+			free_intermediates: remove intermediate results from the cache as soon as their last consumer finishes. 
+				Results of tasks which are not used by other tasks are always kept. Otherwise finished intermediates 
+				are kept but are the first to be spilled if the cache exceeds its memory limit
+			outputs: optional list of names of the tasks whose results are required. Tasks which don't contribute 
+				to them are not executed
+			ranges: optional dict of (min, max) ranges keyed by dimension to which the results of tasks without 
+				consumers are cropped. Where possible get_data tasks only read these ranges
+		'''
+		if outputs is not None:
+			plan = prune_plan(plan, outputs)
+		if ranges:
+			plan = push_down_ranges(plan, ranges)
+		if self.optimise:
+			plan = optimise_plan(plan, self.getReduction)
+
+		self.consumers = get_plan_graph(plan)[1]
+		self.free_intermediates = free_intermediates
+		if free_intermediates:
+			release_function = self.releaseResult
+		else:
+			release_function = self.cache.release
+
+		scheduler = PlanScheduler(plan, self.executeTask, num_workers or self.num_workers, release_function)
+		scheduler.run()
+
+		if ranges:
+			for key in [key for key in self.consumers.keys() if not self.consumers[key]]:
+				self.cacheResult(key, crop_result(self.cache[key], ranges))
+
+	def executePlanTiled(self, plan, tile_size=1000, overlap=None, num_workers=None):
+		'''
+		Execute plan separately for X/Y tiles and stitch together the results of the plan outputs (tasks whose results
+		are not used by other tasks). Only the intermediates of one tile are held in memory at a time and intermediates 
+		are not kept in the cache. Falls back to executePlan if any task reduces over X or Y
+		Parameters:
+			plan: list of tasks as produced by Analytics
+			tile_size: number of pixels in X and Y for each tile
+			overlap: number of extra pixels read around each tile. Defaults to the cloud mask dilation for plans 
+				containing cloud masks, otherwise 0
+			num_workers: maximum number of tasks to run concurrently within each tile. Defaults to self.num_workers
+		'''
+		if not can_tile(plan):
+			logger.warning('Plan reduces over X or Y. Executing without tiling')
+			return self.executePlan(plan, num_workers)
+
+		if overlap is None:
+			overlap = 0
+			if [task for task in plan if task.values()[0]['orig_function'] == 'apply_cloud_mask']:
+				overlap = MASK_OVERLAP
+
+		consumers = get_plan_graph(plan)[1]
+		output_keys = [task.keys()[0] for task in plan if not consumers[task.keys()[0]]]
+
+		tiles = get_tiles(get_plan_extent(plan), tile_size, overlap)
+		tile_results = dict((key, []) for key in output_keys)
+		for tile_index in range(len(tiles)):
+			tile = tiles[tile_index]
+			logger.debug('Executing tile %d of %d: %s', tile_index + 1, len(tiles), tile)
+
+			tile_engine = self.createChildEngine()
+			try:
+				tile_engine.executePlan(tile_plan(plan, tile), num_workers or self.num_workers, free_intermediates=True)
+			except NoDataError, e:
+				logger.warning('Skipping tile %d: %s', tile_index + 1, e)
+				continue
+
+			for key in output_keys:
+				tile_results[key].append((tile, tile_engine.cache[key]))
+			del tile_engine
+
+		for key in output_keys:
+			if not tile_results[key]:
+				raise NoDataError('No data found for %s' % key)
+			self.cacheResult(key, stitch_results(tile_results[key]))
+
+	def executePlanStreaming(self, plan, units_per_chunk=1, approximate=False, num_workers=None):
+		'''
+		Execute plan reading chunks of whole storage units along T and accumulating reductions over T incrementally, 
+		so that only one chunk of the inputs to the reductions is in memory at a time. The inputs are not kept in the cache. 
+		Remaining tasks using the reduction results are executed normally afterwards. 
+		Falls back to executePlan if the plan has no reductions over T which can be streamed
+		Parameters:
+			plan: list of tasks as produced by Analytics
+			units_per_chunk: number of storage units along T to read at once
+			approximate: allow approximate streaming reductions (median, percentile and quantile)
+			num_workers: maximum number of tasks to run concurrently. Defaults to self.num_workers
+		'''
+		streaming_plan = get_streaming_plan(plan, self.getReduction, approximate)
+		time_chunks = streaming_plan and self.getTimeChunks(streaming_plan[0], units_per_chunk)
+		if not time_chunks:
+			logger.warning('Plan has no reductions over T which can be streamed. Executing without streaming')
+			return self.executePlan(plan, num_workers)
+		input_plan, reduction_plan, output_plan = streaming_plan
+
+		reducers = {}
+		for task in reduction_plan:
+			function_name, arguments = self.getReduction(task)
+			reducers[task.keys()[0]] = get_reducer(function_name, approximate, arguments)
+		input_results = {} # Metadata of input results for each reduction without arrays
+		for chunk_index in range(len(time_chunks)):
+			logger.debug('Executing T chunk %d of %d: %s', chunk_index + 1, len(time_chunks), time_chunks[chunk_index])
+
+			chunk_engine = self.createChildEngine()
+			try:
+				chunk_engine.executePlan(set_time_range(input_plan, time_chunks[chunk_index]), num_workers or self.num_workers, free_intermediates=True)
+			except NoDataError, e:
+				logger.warning('Skipping T chunk %d: %s', chunk_index + 1, e)
+				continue
+
+			for task in reduction_plan:
+				key = task.keys()[0]
+				input_result = chunk_engine.cache[task.values()[0]['array_input'][0]]
+				dimensions = input_result['array_dimensions']
+				time_axis = [dimension.upper() for dimension in dimensions].index(TIME_DIMENSION)
+
+				# Reducers need every chunk to cover the same elements
+				frame_indices = dict((dimension, input_result['array_indices'][dimension]) for dimension in dimensions if dimension != dimensions[time_axis])
+				if key not in input_results:
+					input_results[key] = {'array_indices': frame_indices}
+				elif [dimension for dimension in frame_indices.keys() if not np.array_equal(frame_indices[dimension], input_results[key]['array_indices'][dimension])]:
+					logger.warning('T chunks of %s cover different extents. Executing without streaming', key)
+					return self.executePlan(plan, num_workers)
+
+				reducers[key].update(to_nan_array(input_result['array_result'].values()[0], task.values()[0]['array_output']['no_data_value']), time_axis)
+			del chunk_engine
+
+		for task in reduction_plan:
+			key = task.keys()[0]
+			if key not in input_results:
+				raise NoDataError('No data found for %s' % key)
+
+			arrayResult = {}
+			arrayResult['array_result'] = {}
+			arrayResult['array_result'][key] = reducers[key].result()
+			arrayResult['array_output'] = copy.deepcopy(task.values()[0]['array_output'])
+			arrayResult['array_indices'] = input_results[key]['array_indices']
+			arrayResult['array_dimensions'] = list(arrayResult['array_output']['dimensions_order'])
+			self.cacheResult(key, arrayResult)
+
+		if output_plan:
+			self.executePlan(output_plan, num_workers)
+
+	def getTimeChunks(self, plan, units_per_chunk=1):
+		'''
+		Return list of (min, max) T ranges splitting the T range of the get_data tasks in plan on storage unit boundaries, 
+		or None if the get_data tasks have no common T range
+		'''
+		time_range = None
 		for task in plan:
-			function = task.values()[0]['orig_function']
-			print 'function =', function
-			if function == 'get_data': # get data
-				self.executeGetData(task)
-			elif function == 'apply_cloud_mask': # apply cloud mask
-				self.executeCloudMask(task)
-			elif len([s for s in self.SUPPORTED_REDUCTION_OPERATORS if s in function]) > 0: # reduction operator
-				self.executeReduction(task)
-			else: # bandmath
-				self.executeBandmath(task)
+			if task.values()[0]['orig_function'] != 'get_data':
+				continue
+			for array_input in task.values()[0]['array_input']:
+				dimensions = array_input.values()[0]['dimensions']
+				input_range = [dimensions[dimension].get('range') for dimension in dimensions.keys() if dimension.upper() == TIME_DIMENSION]
+				if not input_range or not input_range[0] or (time_range and tuple(input_range[0]) != time_range):
+					return None
+				time_range = tuple(input_range[0])
+				storage_type = array_input.values()[0]['storage_type']
+
+		if time_range is None:
+			return None
+
+		dimension_config = self.gdf.storage_config[storage_type]['dimensions'][TIME_DIMENSION]
+		return get_time_chunks(time_range, dimension_config['dimension_origin'], dimension_config['dimension_extent'], units_per_chunk)
+
+	def getReduction(self, task):
+		'''
+		Return (operator name, arguments) tuple of task, or None if task is not a reduction. 
+		The whole function must be a call of a supported operator, e.g. "percentile(array1, 10)", 
+		so that band math expressions containing operator names aren't mistaken for reductions
+		'''
+		if 'dimension' not in task.values()[0]:
+			return None
+		reduction = parse_reduction(task.values()[0]['orig_function'])
+		if reduction is None or reduction[0] not in self.SUPPORTED_REDUCTION_OPERATORS:
+			return None
+		return reduction
+
+	def executeTask(self, task):
+
+		function = task.values()[0]['orig_function']
+		print 'function =', function
+		if function == 'get_data': # get data
+			self.executeGetData(task)
+		elif function == 'apply_cloud_mask': # apply cloud mask
+			self.executeCloudMask(task)
+		elif function == FUSED_FUNCTION: # fused elementwise tasks
+			self.executeFused(task)
+		elif self.getReduction(task) is not None: # reduction operator
+			self.executeReduction(task)
+		else: # bandmath
+			self.executeBandmath(task)
+
+	@property
+	def check_aliasing(self):
+		'''
+		Debug mode: check that cached results don't share memory and make them read-only, including spilled results
+		'''
+		return self.cache.read_only
+
+	@check_aliasing.setter
+	def check_aliasing(self, check_aliasing):
+		self.cache.read_only = check_aliasing
+
+	def createChildEngine(self):
+		'''
+		Return new engine with an empty cache for executing part of a plan, sharing the GDF, read lock and 
+		cache settings of this engine
+		'''
+		child_engine = self.__class__(gdf=self.gdf, memory_limit=self.cache.memory_limit, temp_dir=self.cache.temp_dir)
+		child_engine.read_lock = self.read_lock
+		child_engine.num_workers = self.num_workers
+		child_engine.num_threads = self.num_threads
+		child_engine.check_aliasing = self.check_aliasing
+		child_engine.optimise = self.optimise
+		child_engine.mask_store = self.mask_store
+		return child_engine
+
+	def cacheResult(self, key, arrayResult):
+		'''
+		Cache and return result of task. Results share index arrays but never result arrays. 
+		In check_aliasing mode this is verified and all arrays are made read-only, so that modifying a cached 
+		array in place (rather than one handed over by getWritableArray) raises an exception
+		'''
+		if self.check_aliasing:
+			for other_key in self.cache.keys():
+				if other_key == key:
+					continue
+				for array in arrayResult['array_result'].values():
+					for other_array in self.cache[other_key]['array_result'].values():
+						assert not np.may_share_memory(array, other_array), 'Result %s shares memory with result %s' % (key, other_key)
+
+			for array in arrayResult['array_result'].values() + arrayResult['array_indices'].values():
+				if isinstance(array, np.ndarray):
+					array.flags.writeable = False
+
+		self.cache[key] = arrayResult
+		return arrayResult
+
+	def getWritableArray(self, key, variable, consumer):
+		'''
+		Return array of a cached result for a task to modify in place. If the task is the only consumer of the result 
+		and intermediates are being freed, the cached array itself is handed over and the result is removed from the 
+		cache. Otherwise a copy is returned
+		Parameters:
+			key: name of task whose result contains the array
+			variable: name of array in result
+			consumer: name of task which will modify the array
+		'''
+		if self.isHandedOver(key, consumer):
+			logger.debug('Handing over %s[%s] to %s', key, variable, consumer)
+			array = self.cache.pop(key)['array_result'][variable]
+			array.flags.writeable = True # Cached arrays are read-only in check_aliasing mode
+			return array
+		return self.cache[key]['array_result'][variable].copy()
+
+	def isHandedOver(self, key, consumer):
+		'''
+		Return True if the arrays of a cached result can be handed over to a task to modify in place
+		'''
+		return self.free_intermediates and self.consumers.get(key) == [consumer]
+
+	def releaseResult(self, key):
+
+		logger.debug('Releasing intermediate result %s', key)
+		self.cache.pop(key, None)
 
 	def executeGetData(self, task):
 		
@@ -53,19 +350,66 @@ class ExecutionEngine(object):
 		for array in task.values()[0]['array_input']:
 			data_request_param['variables'] += (array.values()[0]['variable'],)
 		
-		data_response = self.gdf.get_data(data_request_param)
+		if 'shared_read' in task.values()[0]:
+			data_response = self.getSharedRead(task)
+		else:
+			with self.read_lock:
+				data_response = self.gdf.get_data(data_request_param)
 
 		key = task.keys()[0]
-		self.cache[key] = {}
-		self.cache[key]['array_result'] = copy.deepcopy(data_response['arrays'])
-		self.cache[key]['array_indices'] = copy.deepcopy(data_response['indices'])
-		self.cache[key]['array_dimensions'] = copy.deepcopy(data_response['dimensions'])
-		self.cache[key]['array_output'] = copy.deepcopy(task.values()[0]['array_output'])
+		if data_response is None:
+			raise NoDataError('No data found for %s' % key)
+		# Results are complete before they are cached so that the cache can account for their size.
+		# The arrays returned by get_data aren't referenced anywhere else, so they are cached without copying
+		arrayResult = {}
+		arrayResult['array_result'] = data_response['arrays']
+		arrayResult['array_indices'] = data_response['indices']
+		arrayResult['array_dimensions'] = data_response['dimensions']
+		arrayResult['array_output'] = copy.deepcopy(task.values()[0]['array_output'])
 
 		del data_request_param
 		del data_response
 
-		return self.cache[key]		
+		return self.cacheResult(key, arrayResult)
+
+	def getSharedRead(self, task):
+		'''
+		Return get_data response for a get_data task whose data is read once for a group of tasks with the same storage 
+		type and dimensions. Arrays also used by other tasks of the group are copied, except for the last task to use them
+		'''
+		task_dict = task.values()[0]
+		shared_read = task_dict['shared_read']
+
+		with self.read_lock:
+			if shared_read['key'] not in self.shared_reads:
+				data_request_param = {}
+				data_request_param['dimensions'] = task_dict['array_input'][0].values()[0]['dimensions']
+				data_request_param['storage_type'] = task_dict['array_input'][0].values()[0]['storage_type']
+				data_request_param['variables'] = tuple(shared_read['variables'])
+				self.shared_reads[shared_read['key']] = {'response': self.gdf.get_data(data_request_param),
+														 'users': dict(shared_read['users']),
+														 'tasks': shared_read['tasks']}
+
+			shared_response = self.shared_reads[shared_read['key']]
+			shared_response['tasks'] -= 1
+			if not shared_response['tasks']:
+				del self.shared_reads[shared_read['key']]
+
+			data_response = shared_response['response']
+			if data_response is None:
+				return None
+
+			# Copy while holding the lock so that the last user can't modify an array before it has been copied
+			arrays = {}
+			for array in task_dict['array_input']:
+				variable = array.values()[0]['variable']
+				shared_response['users'][variable] -= 1
+				if shared_response['users'][variable]:
+					arrays[variable] = data_response['arrays'][variable].copy()
+				else:
+					arrays[variable] = data_response['arrays'][variable]
+
+		return {'arrays': arrays, 'indices': dict(data_response['indices']), 'dimensions': list(data_response['dimensions'])}
 
 	def executeCloudMask(self, task):
 
@@ -80,20 +424,30 @@ class ExecutionEngine(object):
 		
 		array_desc = self.cache[task.values()[0]['array_input'][0]]
 
-		data_array = self.cache[data_key]['array_result'].values()[0]
-		mask_array = self.cache[mask_key]['array_result'].values()[0]
+		pqa_mask = self.getPqaMask(mask_key)
 
-		pqa_mask = get_pqa_mask(mask_array)
+		masked_array = self.getWritableArray(data_key, array_desc['array_result'].keys()[0], key)
+		pqa_mask.fill(masked_array, no_data_value, where=False)
 
-		masked_array = copy.deepcopy(data_array)
-		masked_array[~pqa_mask] = no_data_value
-		self.cache[key] = {}
-		
-		self.cache[key]['array_result'] = {}
-		self.cache[key]['array_result'][key] = masked_array
-		self.cache[key]['array_indices'] = copy.deepcopy(array_desc['array_indices'])
-		self.cache[key]['array_dimensions'] = copy.deepcopy(array_desc['array_dimensions'])
-		self.cache[key]['array_output'] = copy.deepcopy(task.values()[0]['array_output'])
+		arrayResult = {}
+		arrayResult['array_result'] = {}
+		arrayResult['array_result'][key] = masked_array
+		arrayResult['array_indices'] = dict(array_desc['array_indices'])
+		arrayResult['array_dimensions'] = list(array_desc['array_dimensions'])
+		arrayResult['array_output'] = copy.deepcopy(task.values()[0]['array_output'])
+		return self.cacheResult(key, arrayResult)
+
+	def getPqaMask(self, mask_key):
+		'''
+		Return PQA BitMask for the cached result of a get_data task reading PQ data. Masks are read from the mask store 
+		where possible, so that they are computed once per storage unit rather than for every plan
+		'''
+		mask_result = self.cache[mask_key]
+		if self.mask_store is None:
+			variable, pqa_array = mask_result['array_result'].items()[0]
+			flag_definition = get_flag_definition(self.gdf, mask_result['array_output'].get('storage_type'), variable)
+			return compute_pqa_mask(pqa_array, flag_definition)
+		return self.mask_store.get_mask(mask_result, self.read_lock)
 
 	def executeBandmath(self, task):
 
@@ -101,58 +455,122 @@ class ExecutionEngine(object):
 		
 		# TODO: check all input arrays are the same shape and parameters
 
-		arrays = {}
-		for task_name in task.values()[0]['array_input']:
-			arrays.update(self.cache[task_name]['array_result'])
+		array_desc = self.cache[task.values()[0]['array_input'][0]]
+
+		# No data values of every array of the first input are propagated by the expression itself
+		function, no_data_arrays = get_no_data_expression(task.values()[0]['function'], array_desc['array_result'], 
+															task.values()[0]['array_output']['no_data_value'])
 
 		arrayResult = {}
 		arrayResult['array_result'] = {}
-		arrayResult['array_result'][key] = ne.evaluate(task.values()[0]['function'],  arrays)
+		arrayResult['array_result'][key] = self.evaluateExpression(key, task.values()[0]['function'], function, 
+																	task.values()[0]['array_input'], no_data_arrays)
+		arrayResult['array_indices'] = dict(array_desc['array_indices'])
+		arrayResult['array_dimensions'] = list(array_desc['array_dimensions'])
+		arrayResult['array_output'] = copy.deepcopy(task.values()[0]['array_output'])
 
-		no_data_value = task.values()[0]['array_output']['no_data_value']
+		return self.cacheResult(key, arrayResult)
 
-		array_desc = self.cache[task.values()[0]['array_input'][0]]
+	def executeFused(self, task):
 
-		for array in array_desc['array_result'].values():
-			arrayResult['array_result'][key][array == no_data_value] = no_data_value
+		key = task.keys()[0]
+		task_dict = task.values()[0]
+		logger.debug('Executing fused tasks %s as %s', task_dict['fused_tasks'], key)
 
-		arrayResult['array_indices'] = copy.deepcopy(array_desc['array_indices'])
-		arrayResult['array_dimensions'] = copy.deepcopy(array_desc['array_dimensions'])
-		arrayResult['array_output'] = copy.deepcopy(task.values()[0]['array_output'])
+		masks = dict((mask_name, self.getPqaMask(mask_key)) for mask_name, mask_key in task_dict['masks'].items())
 
-		self.cache[key] = arrayResult
-		return self.cache[key]
+		array_desc = self.cache[task_dict['index_input']]
+
+		arrayResult = {}
+		arrayResult['array_result'] = {}
+		arrayResult['array_result'][task_dict['fused_variable']] = self.evaluateExpression(key, task_dict['function'], 
+																	task_dict['function'], task_dict['array_input'], masks=masks)
+		arrayResult['array_indices'] = dict(array_desc['array_indices'])
+		arrayResult['array_dimensions'] = list(array_desc['array_dimensions'])
+
+		if 'reduction' in task_dict: # Reduce the fused result directly without caching it
+			return self.reduceResult({key: task_dict['reduction']}, arrayResult, overwrite_input=True)
+
+		arrayResult['array_output'] = copy.deepcopy(task_dict['array_output'])
+		return self.cacheResult(key, arrayResult)
+
+	def evaluateExpression(self, key, function, expression, input_names, arrays=None, masks=None):
+		'''
+		Return array of a numexpr expression evaluated a chunk at a time over the arrays of cached results, 
+		using self.num_threads numexpr threads. The result has the type of function. If an input result is handed 
+		over to the task, an array of it with the shape and type of the result is overwritten rather than a new 
+		array allocated
+		Parameters:
+			key: name of task evaluating the expression
+			function: numexpr expression giving the type of the result
+			expression: numexpr expression to evaluate, i.e. function with any no data propagation
+			input_names: names of the tasks whose result arrays are used
+			arrays: optional dict of further arrays keyed by name
+			masks: optional dict of BitMasks keyed by name
+		'''
+		expression_arrays = {}
+		for task_name in input_names:
+			expression_arrays.update(self.cache[task_name]['array_result'])
+		expression_arrays.update(arrays or {})
+
+		shape = get_result_shape(expression, expression_arrays, masks)
+		result_type = get_result_type(function, expression_arrays, masks)
+
+		out = None
+		for task_name in [task_name for task_name in input_names if self.isHandedOver(task_name, key)]:
+			for variable, array in self.cache[task_name]['array_result'].items():
+				if array.shape == shape and array.dtype == result_type and array.flags.c_contiguous:
+					out = self.getWritableArray(task_name, variable, key)
+					break
+			if out is not None:
+				break
+
+		if out is None:
+			out = np.empty(shape, dtype=result_type)
+		return evaluate(expression, expression_arrays, masks, out=out, num_threads=self.num_threads)
 
 	def executeReduction(self, task):
 
-		function_name = task.values()[0]['orig_function'].replace(")"," ").replace("("," ").split()[0]
-		func = getattr(np, function_name)
+		return self.reduceResult(task, self.cache[task.values()[0]['array_input'][0]])
+
+	def reduceResult(self, task, array_desc, overwrite_input=False):
+		'''
+		Reduce the array of a result as specified by a reduction task. Returns the reduced result, which is cached
+		Parameters:
+			task: reduction task
+			array_desc: result to reduce
+			overwrite_input: allow the array of array_desc to be modified (if it isn't cached)
+		'''
+		function_name, arguments = self.getReduction(task)
+		kernel = get_kernel(function_name, arguments)
+		func = getattr(np, function_name) if kernel is None else None
 
 		key = key = task.keys()[0]
 		data_key = task.values()[0]['array_input'][0]
 		print 'key =', key
 		print 'data key =', data_key
 
-		data = self.cache[data_key]['array_dimensions']
+		data = array_desc['array_dimensions']
 
 		no_data_value = task.values()[0]['array_output']['no_data_value']
 
-		array_data = self.cache[data_key]['array_result'].values()[0]
-
-		array_desc = self.cache[task.values()[0]['array_input'][0]]
+		array_data = array_desc['array_result'].values()[0]
 	
 		arrayResult = {}
 		arrayResult['array_result'] = {}
 		arrayResult['array_output'] = copy.deepcopy(task.values()[0]['array_output'])
 
 		if len(task.values()[0]['dimension']) == 1: # 3D -> 2D reduction
-			pprint(self.cache[data_key]['array_dimensions'])
-			dim = self.cache[data_key]['array_dimensions'].index(task.values()[0]['dimension'][0])
+			pprint(array_desc['array_dimensions'])
+			dim = array_desc['array_dimensions'].index(task.values()[0]['dimension'][0])
 
-			arrayResult['array_result'][key]=np.apply_along_axis(lambda x: func(x[x!=no_data_value]), dim, array_data)
+			if kernel is not None:
+				arrayResult['array_result'][key] = reduce_array(array_data, [dim], function_name, no_data_value, arguments, overwrite_input)
+			else: # No vectorised kernel - apply function to valid values of each element
+				arrayResult['array_result'][key]=np.apply_along_axis(lambda x: func(x[x!=no_data_value]), dim, array_data)
 		
-			arrayResult['array_indices'] = copy.deepcopy(array_desc['array_indices'])
-			arrayResult['array_dimensions'] = copy.deepcopy(arrayResult['array_output']['dimensions_order'])
+			arrayResult['array_indices'] = dict(array_desc['array_indices'])
+			arrayResult['array_dimensions'] = list(arrayResult['array_output']['dimensions_order'])
 
 			for index in array_desc['array_indices']:
 				if index not in arrayResult['array_dimensions'] and index in arrayResult['array_indices']:
@@ -161,33 +579,36 @@ class ExecutionEngine(object):
 			size = task.values()[0]['array_output']['shape'][0]
 			print 'size =', size
 			out = np.empty([size])
-			dim = self.cache[data_key]['array_dimensions'].index(task.values()[0]['array_output']['dimensions_order'][0])
+			dim = array_desc['array_dimensions'].index(task.values()[0]['array_output']['dimensions_order'][0])
 			print 'dim =', dim
 			
 			#to fix bug in gdf
-			#size = self.cache[data_key]['array_result'].values()[0].shape[dim]
+			#size = array_desc['array_result'].values()[0].shape[dim]
 			#print 'size =', size
 			#out = np.empty([size])
 
-			for i in range(size):
-				if dim == 0:
-					out[i] = func(array_data[i,:,:][array_data[i,:,:] != no_data_value])
-				elif dim == 1:
-					out[i] = func(array_data[:,i,:][array_data[:,i,:] != no_data_value])
-				elif dim == 2:
-					out[i] = func(array_data[:,:,i][array_data[:,:,i] != no_data_value])
-
-				if np.isnan(out[i]):
-					out[i] = no_data_value
+			if kernel is not None:
+				out[:] = reduce_array(array_data, [axis for axis in range(array_data.ndim) if axis != dim], function_name, no_data_value, arguments, overwrite_input)
+				out[np.isnan(out)] = no_data_value
+			else: # No vectorised kernel - apply function to valid values of each slice
+				for i in range(size):
+					if dim == 0:
+						out[i] = func(array_data[i,:,:][array_data[i,:,:] != no_data_value])
+					elif dim == 1:
+						out[i] = func(array_data[:,i,:][array_data[:,i,:] != no_data_value])
+					elif dim == 2:
+						out[i] = func(array_data[:,:,i][array_data[:,:,i] != no_data_value])
+
+					if np.isnan(out[i]):
+						out[i] = no_data_value
 
 			arrayResult['array_result'][key] = out
-			arrayResult['array_indices'] = copy.deepcopy(array_desc['array_indices'])
-			arrayResult['array_dimensions'] = copy.deepcopy(arrayResult['array_output']['dimensions_order'])
+			arrayResult['array_indices'] = dict(array_desc['array_indices'])
+			arrayResult['array_dimensions'] = list(arrayResult['array_output']['dimensions_order'])
 		
 			for index in array_desc['array_indices']:
 				if index not in arrayResult['array_dimensions'] and index in arrayResult['array_indices']:
 					del arrayResult['array_indices'][index]
 
-		self.cache[key] = arrayResult
-		return self.cache[key]
+		return self.cacheResult(key, arrayResult)
 
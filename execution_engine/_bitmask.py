@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+import logging
+
+'''
+Compact boolean masks for the ExecutionEngine:
+- masks are stored as bits (np.packbits), 8 elements per byte instead of 1 byte per element for np.bool arrays
+- each row along the first axis is packed separately, so that blocks of rows can be unpacked on their own
+- masks are combined with &, | and ~ without unpacking, and applied to arrays a block of rows at a time so that no
+  full-size boolean array (or its inverse) is allocated
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG) # Logging level for this module
+
+CHUNK_SIZE = 16777216 # Approximate number of mask elements unpacked at a time
+
+_BIT_COUNTS = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8) # Number of set bits in each byte value
+
+class BitMask(object):
+	'''
+	Boolean array of a given shape stored as packed bits
+	'''
+
+	def __init__(self, shape, bits=None):
+		'''
+		Parameters:
+			shape: shape of the boolean array
+			bits: optional packed rows as returned by the bits property of a mask of this shape. Defaults to all False
+		'''
+		self.shape = tuple(int(size) for size in shape)
+		self._rows = self.shape[0] if len(self.shape) > 1 else 1
+		self._row_size = int(np.prod(self.shape[1:] if len(self.shape) > 1 else self.shape))
+		bits_shape = (self._rows, (self._row_size + 7) // 8)
+
+		if bits is None:
+			bits = np.zeros(bits_shape, dtype=np.uint8)
+		else:
+			bits = np.asarray(bits, dtype=np.uint8).reshape(bits_shape)
+		self._bits = bits
+
+	@classmethod
+	def from_array(cls, array):
+		'''
+		Return mask packed from a boolean array
+		'''
+		array = np.asarray(array, dtype=np.bool)
+		mask = cls(array.shape)
+		mask._bits[...] = np.packbits(array.reshape(mask._rows, mask._row_size), axis=-1)
+		return mask
+
+	@classmethod
+	def equal(cls, array, value):
+		'''
+		Return mask of the elements of array equal to value, compared a block of rows at a time
+		'''
+		if array.ndim < 2:
+			return cls.from_array(array == value)
+
+		mask = cls(array.shape)
+		for rows in mask.get_chunks():
+			mask[rows] = array[rows] == value
+		return mask
+
+	@property
+	def bits(self):
+		return self._bits
+
+	@property
+	def nbytes(self):
+		return self._bits.nbytes
+
+	def _unpack(self, bits):
+		'''
+		Return boolean rows unpacked from packed rows
+		'''
+		return np.unpackbits(bits, axis=-1)[:, :self._row_size].view(np.bool)
+
+	def _check_shape(self, other):
+		if self.shape != other.shape:
+			raise ValueError('Mask shapes %s and %s differ' % (self.shape, other.shape))
+
+	def get_chunks(self, chunk_size=CHUNK_SIZE):
+		'''
+		Generator yielding slices of blocks of rows along the first axis with about chunk_size elements each
+		'''
+		step = max(chunk_size // max(self._row_size, 1), 1)
+		for start in xrange(0, self._rows, step):
+			yield slice(start, min(start + step, self._rows))
+
+	def __getitem__(self, index):
+		'''
+		Return boolean array of the rows selected by an integer or slice along the first axis
+		'''
+		rows = self._bits[index]
+		if rows.ndim == 1:
+			return self._unpack(rows[np.newaxis]).reshape(self.shape[1:])
+		return self._unpack(rows).reshape((len(rows),) + self.shape[1:])
+
+	def __setitem__(self, index, value):
+		'''
+		Set the rows selected by an integer or slice along the first axis from a boolean array
+		'''
+		value = np.asarray(value, dtype=np.bool)
+		rows = int(np.prod(value.shape[:value.ndim - len(self.shape) + 1]))
+		self._bits[index] = np.packbits(value.reshape(rows, self._row_size), axis=-1)
+
+	def to_array(self):
+		'''
+		Return mask unpacked to a boolean array
+		'''
+		return self._unpack(self._bits).reshape(self.shape)
+
+	def count(self):
+		'''
+		Return number of True elements
+		'''
+		return int(_BIT_COUNTS[self._bits].sum(dtype=np.int64))
+
+	def __and__(self, other):
+		self._check_shape(other)
+		return BitMask(self.shape, self._bits & other._bits)
+
+	def __or__(self, other):
+		self._check_shape(other)
+		return BitMask(self.shape, self._bits | other._bits)
+
+	def __iand__(self, other):
+		self._check_shape(other)
+		np.bitwise_and(self._bits, other._bits, out=self._bits)
+		return self
+
+	def __ior__(self, other):
+		self._check_shape(other)
+		np.bitwise_or(self._bits, other._bits, out=self._bits)
+		return self
+
+	def __invert__(self):
+		bits = ~self._bits
+		# Keep the padding at the end of each row clear so that count() is correct
+		if self._row_size % 8:
+			bits[:, -1] &= (0xFF << (8 - self._row_size % 8)) & 0xFF
+		return BitMask(self.shape, bits)
+
+	def fill(self, array, value, where=True):
+		'''
+		Set the elements of array to value where the mask is True, or where it is False if where is False.
+		The mask is unpacked a block of rows at a time
+		'''
+		if array.shape != self.shape:
+			raise ValueError('Mask shape %s differs from array shape %s' % (self.shape, array.shape))
+
+		for rows in self.get_chunks():
+			bits = self._bits[rows] if where else ~self._bits[rows]
+			target = array[rows] if array.ndim > 1 else array
+			np.copyto(target, value, casting='unsafe', where=self._unpack(bits).reshape(target.shape))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import threading
+import collections
+import numpy as np
+
+import logging
+
+'''
+Memory-aware cache of task results for the ExecutionEngine:
+- tracks the number of bytes of result arrays held in memory
+- spills results to memory-mapped .npy files in a temporary directory when a memory limit is exceeded
+- results whose consumers have all finished are spilled first, then the least recently used ones
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG) # Logging level for this module
+
+MIN_SPILL_SIZE = 1048576 # Arrays smaller than this many bytes are never spilled
+
+def get_array_size(array):
+	'''
+	Return number of bytes of array held in memory. Memory-mapped arrays are not counted
+	'''
+	if not isinstance(array, np.ndarray) or isinstance(array, np.memmap):
+		return 0
+	return array.nbytes
+
+def get_result_size(result):
+	'''
+	Return number of bytes held in memory by the arrays of a task result
+	'''
+	return sum(get_array_size(array) for array in result.get('array_result', {}).values())
+
+class ResultCache(collections.MutableMapping):
+	'''
+	Dict of task results keyed by task name which keeps the result arrays held in memory within a memory limit
+	'''
+
+	def __init__(self, memory_limit=None, temp_dir=None, min_spill_size=MIN_SPILL_SIZE, read_only=False):
+		'''
+		Parameters:
+			memory_limit: maximum number of bytes of result arrays to hold in memory. Unlimited if None
+			temp_dir: directory for spilled arrays. Defaults to the system temporary directory
+			min_spill_size: arrays smaller than this many bytes are never spilled
+			read_only: make reloaded spilled arrays read-only, as cached arrays are in check_aliasing mode
+		'''
+		self.memory_limit = memory_limit
+		self.temp_dir = temp_dir
+		self.min_spill_size = min_spill_size
+		self.read_only = read_only
+		self.memory_used = 0 # Number of bytes of result arrays held in memory
+
+		self._lock = threading.RLock()
+		self._results = collections.OrderedDict() # Least recently used first
+		self._sizes = {} # Number of bytes held in memory keyed by task name
+		self._released = set() # Names of results whose consumers have all finished
+		self._spill_files = {} # Lists of spill file paths keyed by task name
+
+	def __getitem__(self, key):
+		with self._lock:
+			result = self._results.pop(key)
+			self._results[key] = result
+			return result
+
+	def __setitem__(self, key, result):
+		with self._lock:
+			if key in self._results:
+				del self[key]
+			self._results[key] = result
+			self._sizes[key] = get_result_size(result)
+			self.memory_used += self._sizes[key]
+			self._enforce_limit()
+
+	def __delitem__(self, key):
+		with self._lock:
+			del self._results[key]
+			self.memory_used -= self._sizes.pop(key)
+			self._released.discard(key)
+			self._remove_spill_files(key)
+
+	def __iter__(self):
+		return iter(self._results.keys())
+
+	def __len__(self):
+		return len(self._results)
+
+	def __contains__(self, key):
+		return key in self._results
+
+	def __del__(self):
+		for key in self._spill_files.keys():
+			self._remove_spill_files(key)
+
+	def release(self, key):
+		'''
+		Mark result as no longer needed by the plan, so that it is spilled before any other result. 
+		The result remains available
+		'''
+		with self._lock:
+			if key in self._results:
+				self._released.add(key)
+
+	def spill(self, key):
+		'''
+		Write the arrays of a result to .npy files and replace them with copy-on-write memory-mapped copies. 
+		Writing to a spilled array only changes the copy in memory. The copies are read-only if read_only is set
+		'''
+		with self._lock:
+			array_result = self._results[key].get('array_result', {})
+			for name in array_result.keys():
+				array = array_result[name]
+				size = get_array_size(array)
+				# Subclasses (e.g. masked arrays) can't be saved as .npy files
+				if size < self.min_spill_size or type(array) is not np.ndarray:
+					continue
+
+				spill_file, spill_path = tempfile.mkstemp(suffix='.npy', prefix='%s_' % key, dir=self.temp_dir)
+				with os.fdopen(spill_file, 'wb') as spill_file:
+					np.save(spill_file, array)
+				self._spill_files.setdefault(key, []).append(spill_path)
+				logger.debug('Spilled %s[%s] (%d bytes) to %s', key, name, size, spill_path)
+
+				array_result[name] = np.load(spill_path, mmap_mode='c')
+				if self.read_only:
+					array_result[name].flags.writeable = False
+				self._sizes[key] -= size
+				self.memory_used -= size
+
+	def _enforce_limit(self):
+		'''
+		Spill results until the memory limit is met: released results first, then least recently used
+		'''
+		if self.memory_limit is None or self.memory_used <= self.memory_limit:
+			return
+
+		keys = self._results.keys()
+		for key in [key for key in keys if key in self._released] + [key for key in keys if key not in self._released]:
+			if self._sizes[key]:
+				self.spill(key)
+			if self.memory_used <= self.memory_limit:
+				return
+		logger.warning('Unable to reduce memory used by cached results (%d bytes) to %d bytes', self.memory_used, self.memory_limit)
+
+	def _remove_spill_files(self, key):
+		# Memory-mapped arrays remain valid after their files are removed
+		for spill_path in self._spill_files.pop(key, []):
+			try:
+				os.remove(spill_path)
+			except OSError, e:
+				logger.warning('Unable to remove spill file %s: %s', spill_path, e)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import threading
+
+import numpy as np
+import numexpr as ne
+
+import logging
+
+from _bitmask import CHUNK_SIZE, BitMask
+from _optimiser import IDENTIFIER_PATTERN, _literal
+
+'''
+Chunked numexpr evaluation for the ExecutionEngine:
+- expressions are evaluated a block of rows along the first axis at a time into a preallocated output array, so that 
+  temporary copies (cast inputs, unpacked masks) are bounded by the chunk size rather than the array size
+- the output array can be supplied (out=), e.g. an input array which is no longer needed
+- no data values of the inputs are propagated by the expression itself (where(...)) rather than by rescanning the inputs
+- the number of numexpr threads is set explicitly for each evaluation
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG) # Logging level for this module
+
+_evaluate_lock = threading.Lock() # The number of numexpr threads is process-wide
+
+def get_no_data_expression(function, arrays, no_data_value):
+	'''
+	Return numexpr expression evaluating to no_data_value where any of arrays equals no_data_value and to function 
+	elsewhere, and dict of the arrays keyed by their names in the expression
+	Parameters:
+		function: numexpr expression
+		arrays: dict of arrays keyed by variable name whose no data values are propagated
+		no_data_value: no data value of the arrays and of the result. Nothing is propagated if None or NaN
+	'''
+	if no_data_value is None or no_data_value != no_data_value or not arrays:
+		return function, {}
+
+	condition_arrays = {}
+	conditions = []
+	for index, (variable, array) in enumerate(sorted(arrays.items())):
+		# Arrays are renamed so that they can't be confused with arrays of other inputs with the same variable names
+		name = '_no_data_%d' % index
+		condition_arrays[name] = array
+		conditions.append('(%s == %s)' % (name, _literal(no_data_value)))
+	return 'where(%s, %s, %s)' % (' | '.join(conditions), _literal(no_data_value), function), condition_arrays
+
+def _get_names(expression, arrays):
+	'''
+	Return sorted list of the names of arrays used by expression
+	'''
+	return sorted(set(name for name in IDENTIFIER_PATTERN.findall(expression) if name in arrays))
+
+def get_result_shape(expression, arrays, masks=None):
+	'''
+	Return shape of the result of expression over arrays and BitMasks
+	'''
+	masks = masks or {}
+	shapes = [np.shape(arrays[name]) for name in _get_names(expression, arrays)]
+	shapes += [masks[name].shape for name in _get_names(expression, masks)]
+	shape = ()
+	for other_shape in shapes:
+		shape = np.broadcast(np.broadcast_to(False, shape), np.broadcast_to(False, other_shape)).shape
+	return shape
+
+def get_result_type(expression, arrays, masks=None):
+	'''
+	Return dtype of the result of expression over arrays and BitMasks, found by evaluating it for one element
+	'''
+	local_dict = {}
+	for name in _get_names(expression, arrays):
+		array = np.asarray(arrays[name])
+		local_dict[name] = array[(slice(0, 1),) * array.ndim]
+	for name in _get_names(expression, masks or {}):
+		local_dict[name] = np.zeros((1,) * len(masks[name].shape), dtype=np.bool)
+	return ne.evaluate(expression, local_dict=local_dict).dtype
+
+def evaluate(expression, arrays, masks=None, out=None, num_threads=None, chunk_size=CHUNK_SIZE):
+	'''
+	Return result of numexpr expression evaluated a block of rows along the first axis at a time
+	Parameters:
+		expression: numexpr expression
+		arrays: dict of arrays keyed by name
+		masks: optional dict of BitMasks keyed by name, unpacked a block of rows at a time
+		out: optional array of the result shape to write the result to. Its dtype may differ from the result type. 
+			Allocated if None
+		num_threads: number of numexpr threads. Defaults to the current numexpr setting
+		chunk_size: approximate number of elements evaluated at a time
+	'''
+	masks = masks or {}
+	array_names = _get_names(expression, arrays)
+	mask_names = _get_names(expression, masks)
+
+	shape = get_result_shape(expression, arrays, masks)
+	if out is None:
+		out = np.empty(shape, dtype=get_result_type(expression, arrays, masks))
+	elif out.shape != shape:
+		raise ValueError('Output shape %s differs from result shape %s' % (out.shape, shape))
+
+	if out.ndim and out.size:
+		row_size = out.size // out.shape[0]
+		step = max(chunk_size // row_size, 1)
+		chunks = [slice(start, min(start + step, out.shape[0])) for start in xrange(0, out.shape[0], step)]
+	else:
+		chunks = [Ellipsis]
+
+	def get_rows(array, rows):
+		# Arrays and masks broadcast along the first axis are used whole
+		if rows is Ellipsis or len(array.shape) != out.ndim or array.shape[0] != out.shape[0]:
+			return array.to_array() if isinstance(array, BitMask) else array
+		return array[rows]
+
+	with _evaluate_lock:
+		previous_threads = ne.set_num_threads(num_threads) if num_threads else None
+		try:
+			for rows in chunks:
+				local_dict = dict((name, get_rows(arrays[name], rows)) for name in array_names)
+				local_dict.update((name, get_rows(masks[name], rows)) for name in mask_names)
+				ne.evaluate(expression, local_dict=local_dict, out=out[rows], casting='unsafe')
+		finally:
+			if previous_threads is not None:
+				ne.set_num_threads(previous_threads)
+
+	return out
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+import logging
+
+from gdf import GDF, directory_writable, make_dir
+from analytics_utils import LANDSAT_PQA_FLAGS, get_flag_mask, get_flag_overlap
+from _tiling import TILE_DIMENSIONS, _get_dimension
+from _bitmask import BitMask
+
+'''
+PQA cloud masks stored as a derived product, so that the dilation in get_flag_mask is computed once per storage unit:
+- one bit-packed, compressed .npz file per storage unit and time slice in a directory under the GDF cache directory
+- masks are computed from the PQ data of the whole storage unit plus the pixels of its neighbours affected by the
+  dilation, so a stored mask doesn't depend on the range of the request which created it
+- masks of each flag definition are stored separately, so changing the definition of a storage type doesn't
+  invalidate its stored masks
+- PQ data never changes after ingestion, so stored masks are never invalidated. Use clear() after re-ingesting data
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG) # Logging level for this module
+
+SECONDS_PER_DAY = 86400
+
+def get_flag_definition(gdf, storage_type, variable):
+	'''
+	Return flag definition of a PQ variable from the storage configuration, defaulting to LANDSAT_PQA_FLAGS
+	'''
+	try:
+		flag_definition = gdf.storage_config[storage_type]['measurement_types'][variable].get('flag_definition')
+	except (KeyError, AttributeError):
+		flag_definition = None
+	return flag_definition or LANDSAT_PQA_FLAGS
+
+def compute_pqa_mask(pqa_array, flag_definition=LANDSAT_PQA_FLAGS):
+	'''
+	Return BitMask equal to get_flag_mask of a T x Y x X array of PQ data. Time slices are independent, so the mask is
+	computed a block of time slices at a time
+	'''
+	mask = BitMask(pqa_array.shape)
+	for rows in mask.get_chunks():
+		mask[rows] = get_flag_mask(pqa_array[rows], flag_definition)
+	return mask
+
+class MaskStore(object):
+	'''
+	Store of PQA masks keyed by storage type, PQ variable, storage unit and time slice
+	'''
+
+	def __init__(self, gdf, mask_dir=None):
+		'''
+		Parameters:
+			gdf: GDF object used to read PQ data and storage unit layouts
+			mask_dir: Optional directory in which to store masks. Defaults to a pqa_masks directory in the GDF cache
+				directory. Masks are computed without being stored if no writable directory is available
+		'''
+		self.gdf = gdf
+
+		if mask_dir is None and getattr(gdf, 'cache_dir', None):
+			mask_dir = os.path.join(gdf.cache_dir, 'pqa_masks')
+		if mask_dir:
+			try:
+				make_dir(mask_dir)
+			except OSError:
+				pass
+			if not directory_writable(mask_dir):
+				logger.warning('Unable to write to PQA mask directory %s. Masks will not be stored.', mask_dir)
+				mask_dir = None
+		self.mask_dir = mask_dir
+
+	def get_mask(self, mask_result, read_lock=None):
+		'''
+		Return PQA BitMask for the result of a get_data task reading PQ data, equal to get_flag_mask of its array
+		except at the edges of the request range, where flags from pixels outside it are dilated into it.
+		Masks of storage units and time slices which aren't stored yet are computed and stored
+		Parameters:
+			mask_result: cached result of a get_data task with a single PQ variable
+			read_lock: optional lock to hold while reading PQ data of storage units
+		'''
+		variable, pqa_array = mask_result['array_result'].items()[0]
+		dimensions = [dimension.upper() for dimension in mask_result['array_dimensions']]
+		request_dimensions = mask_result['array_output'].get('dimensions') or {}
+		t_key = _get_dimension(request_dimensions, 'T')
+		storage_type = mask_result['array_output'].get('storage_type')
+		flag_definition = get_flag_definition(self.gdf, storage_type, variable)
+
+		# Time slices are only identified by solar day if the default grouping function is used
+		if (not self.mask_dir or sorted(dimensions) != ['T', 'X', 'Y'] or storage_type is None
+			or (t_key is not None and request_dimensions[t_key].get('grouping_function'))):
+			return compute_pqa_mask(pqa_array, flag_definition)
+
+		axes = [dimensions.index(dimension) for dimension in ['T', 'Y', 'X']]
+		pqa_array = pqa_array.transpose(axes)
+		indices = dict((dimension, mask_result['array_indices'][name]) for dimension, name in zip(dimensions, mask_result['array_dimensions']))
+		x_values = np.around(indices['X'], GDF.DECIMAL_PLACES)
+		y_values = np.around(indices['Y'], GDF.DECIMAL_PLACES)
+		t_values = indices['T']
+		x_units = self.get_unit_indices(storage_type, 'X', x_values)
+		y_units = self.get_unit_indices(storage_type, 'Y', y_values)
+
+		units = [(x_unit, y_unit) for x_unit in np.unique(x_units) for y_unit in np.unique(y_units)]
+		entries = {} # Entries keyed by storage unit and time slice
+		for unit in units:
+			missing = []
+			for t_value in t_values:
+				entry = self.read_entry(storage_type, variable, flag_definition, unit, t_value)
+				if entry is None:
+					missing.append(t_value)
+				else:
+					entries[(unit, t_value)] = entry
+			if missing:
+				for t_value, entry in self.create_entries(storage_type, variable, flag_definition, unit, missing, read_lock).items():
+					entries[(unit, t_value)] = entry
+
+		# Assemble the mask a time slice at a time
+		mask = BitMask(pqa_array.shape)
+		incomplete = [] # Indices of time slices without masks for every storage unit
+		for t_index, t_value in enumerate(t_values):
+			slice_mask = np.zeros(pqa_array.shape[1:], dtype=np.bool)
+			for unit in units:
+				if not ((unit, t_value) in entries and self.set_mask(slice_mask, entries[(unit, t_value)], x_values, x_units == unit[0],
+																	 y_values, y_units == unit[1])):
+					incomplete.append(t_index)
+					break
+			else:
+				mask[t_index] = slice_mask
+
+		# Compute masks of time slices with data missing from storage units directly from the request
+		if incomplete:
+			logger.debug('Computing PQA mask for %d time slices without stored masks', len(incomplete))
+			mask.bits[incomplete] = compute_pqa_mask(pqa_array[incomplete], flag_definition).bits
+
+		if axes != range(len(axes)):
+			return BitMask.from_array(mask.to_array().transpose(np.argsort(axes)))
+		return mask
+
+	def get_unit_indices(self, storage_type, dimension_tag, values):
+		'''
+		Return array of storage unit indices for an array of X or Y ordinates
+		'''
+		dimension_config = self.gdf.storage_config[storage_type]['dimensions'][dimension_tag]
+		return np.floor(np.around((values - dimension_config['dimension_origin']) / dimension_config['dimension_extent'],
+								  GDF.DECIMAL_PLACES)).astype(np.int64)
+
+	def get_entry_path(self, storage_type, variable, flag_definition, unit, t_value):
+		'''
+		Return path of the file holding the mask of a storage unit and time slice
+		'''
+		definition_key = hashlib.md5(json.dumps(flag_definition, sort_keys=True)).hexdigest()[:12]
+		return os.path.join(self.mask_dir, storage_type, '%s_%s' % (variable, definition_key),
+							'%d_%d_%d.npz' % (unit[0], unit[1], t_value))
+
+	def read_entry(self, storage_type, variable, flag_definition, unit, t_value):
+		'''
+		Return dict containing the BitMask and X and Y ordinates of a storage unit and time slice, or None if
+		the mask isn't stored
+		'''
+		entry_path = self.get_entry_path(storage_type, variable, flag_definition, unit, t_value)
+		if not os.path.exists(entry_path):
+			return None
+
+		try:
+			entry_file = np.load(entry_path)
+			try:
+				mask = BitMask(entry_file['shape'], entry_file['mask'])
+				return {'mask': mask, 'X': entry_file['X'], 'Y': entry_file['Y']}
+			finally:
+				entry_file.close()
+		except Exception, e:
+			logger.warning('Unable to read PQA mask %s: %s', entry_path, e)
+			return None
+
+	def write_entry(self, storage_type, variable, flag_definition, unit, t_value, entry):
+		'''
+		Atomically write the mask of a storage unit and time slice, so that concurrent readers never see partial files
+		'''
+		entry_path = self.get_entry_path(storage_type, variable, flag_definition, unit, t_value)
+		entry_dir = os.path.dirname(entry_path)
+		make_dir(entry_dir)
+
+		# Temporary file must be in the same directory (and filesystem) for rename to be atomic
+		temp_fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(entry_path) + '.', dir=entry_dir)
+		try:
+			os.chmod(temp_path, 0644) # mkstemp creates files readable only by owner
+			temp_file = os.fdopen(temp_fd, 'wb')
+			try:
+				np.savez_compressed(temp_file, mask=entry['mask'].bits, shape=np.array(entry['mask'].shape),
+									X=entry['X'], Y=entry['Y'])
+			finally:
+				temp_file.close()
+			os.rename(temp_path, entry_path)
+		except:
+			try:
+				os.remove(temp_path)
+			except OSError:
+				pass
+			raise
+
+	def create_entries(self, storage_type, variable, flag_definition, unit, t_values, read_lock=None):
+		'''
+		Compute and store masks of a storage unit for the time slices in t_values and any other time slices read with
+		them. Returns dict of entries keyed by time slice
+		'''
+		dimensions = {}
+		for dimension_tag, unit_index in zip(TILE_DIMENSIONS, unit):
+			dimension_config = self.gdf.storage_config[storage_type]['dimensions'][dimension_tag]
+			unit_min = dimension_config['dimension_origin'] + unit_index * dimension_config['dimension_extent']
+			overlap = get_flag_overlap(flag_definition) * dimension_config['dimension_element_size']
+			dimensions[dimension_tag] = {'range': (unit_min - overlap, unit_min + dimension_config['dimension_extent'] + overlap)}
+
+		# Time slices are solar days, which begin up to half a day either side of the UTC day
+		dimensions['T'] = {'range': ((min(t_values) - 1) * SECONDS_PER_DAY, (max(t_values) + 2) * SECONDS_PER_DAY)}
+
+		data_request = {'storage_type': storage_type, 'variables': (variable,), 'dimensions': dimensions}
+		logger.debug('Computing PQA masks for %s storage unit %s', storage_type, unit)
+		if read_lock is None:
+			data_response = self.gdf.get_data(data_request)
+		else:
+			with read_lock:
+				data_response = self.gdf.get_data(data_request)
+		if data_response is None:
+			return {}
+
+		response_dimensions = [dimension.upper() for dimension in data_response['dimensions']]
+		indices = dict((dimension, data_response['indices'][name]) for dimension, name in zip(response_dimensions, data_response['dimensions']))
+		axes = [response_dimensions.index(dimension) for dimension in ['T', 'Y', 'X']]
+		pqa_mask = compute_pqa_mask(data_response['arrays'][variable].transpose(axes), flag_definition)
+
+		# Crop the overlap with neighbouring storage units
+		x_values = np.around(indices['X'], GDF.DECIMAL_PLACES)
+		y_values = np.around(indices['Y'], GDF.DECIMAL_PLACES)
+		x_selection = self.get_unit_indices(storage_type, 'X', x_values) == unit[0]
+		y_selection = self.get_unit_indices(storage_type, 'Y', y_values) == unit[1]
+		crop = np.ix_(y_selection, x_selection)
+
+		entries = {}
+		for t_index, t_value in enumerate(indices['T']):
+			entries[t_value] = {'mask': BitMask.from_array(pqa_mask[t_index][crop]), 'X': x_values[x_selection], 'Y': y_values[y_selection]}
+			try:
+				self.write_entry(storage_type, variable, flag_definition, unit, t_value, entries[t_value])
+			except (IOError, OSError), e:
+				logger.warning('Unable to store PQA mask for %s storage unit %s: %s', storage_type, unit, e)
+		return entries
+
+	def set_mask(self, mask, entry, x_values, x_selection, y_values, y_selection):
+		'''
+		Copy the mask of an entry to the selected pixels of a Y x X mask.
+		Returns False if the entry doesn't cover the selected pixels
+		'''
+		entry_x_selection = np.in1d(entry['X'], x_values[x_selection])
+		entry_y_selection = np.in1d(entry['Y'], y_values[y_selection])
+		if not (np.array_equal(entry['X'][entry_x_selection], x_values[x_selection]) and
+				np.array_equal(entry['Y'][entry_y_selection], y_values[y_selection])):
+			return False
+
+		mask[np.ix_(y_selection, x_selection)] = entry['mask'].to_array()[np.ix_(entry_y_selection, entry_x_selection)]
+		return True
+
+	def clear(self, storage_type=None):
+		'''
+		Remove stored masks of one or all storage types
+		'''
+		if not self.mask_dir:
+			return
+		clear_dir = os.path.join(self.mask_dir, storage_type) if storage_type else self.mask_dir
+		for dir_path, _dir_names, filenames in os.walk(clear_dir):
+			for filename in filenames:
+				if filename.endswith('.npz'):
+					os.remove(os.path.join(dir_path, filename))
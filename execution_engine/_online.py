@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+
+import copy
+import numpy as np
+
+import logging
+
+from _scheduler import get_plan_graph
+
+'''
+Online reductions over T for plans which would otherwise need the whole T x Y x X cube in memory:
+- reducers accumulate results from successive chunks of time slices
+- exact reducers for count, sum, mean, variance (Welford/Chan), extrema, arg-extrema, product, all and any
+- approximate streaming quantiles (P-square algorithm) for median
+- splitting of plans and T ranges into chunks aligned with storage unit boundaries
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG) # Logging level for this module
+
+TIME_DIMENSION = 'T'
+TIME_EPSILON = 0.000001 # Subtracted from upper bound of T chunks so that slices on boundaries are only read once
+
+class OnlineReducer(object):
+	'''
+	Base class for reducers which consume NaN-filled chunks of an array along one axis
+	'''
+
+	def __init__(self):
+		self.shape = None # Shape of result, set from first chunk
+
+	def update(self, chunk, axis):
+		'''
+		Accumulate a chunk of values along axis. NaN values are ignored
+		'''
+		if self.shape is None:
+			self.shape = tuple(size for dimension_index, size in enumerate(chunk.shape) if dimension_index != axis)
+			self.initialise()
+		self.accumulate(chunk, axis)
+
+	def initialise(self):
+		pass
+
+	def accumulate(self, chunk, axis):
+		raise NotImplementedError
+
+	def result(self):
+		'''
+		Return reduced array. Elements without valid values are NaN (except for sum, prod, all and any)
+		'''
+		raise NotImplementedError
+
+class CountReducer(OnlineReducer):
+
+	def initialise(self):
+		self.count = np.zeros(self.shape, dtype=np.int64)
+
+	def accumulate(self, chunk, axis):
+		self.count += np.sum(~np.isnan(chunk), axis=axis)
+
+	def result(self):
+		return self.count
+
+class SumReducer(OnlineReducer):
+
+	def initialise(self):
+		self.total = np.zeros(self.shape, dtype=np.float64)
+
+	def accumulate(self, chunk, axis):
+		self.total += np.nansum(chunk, axis=axis, dtype=np.float64)
+
+	def result(self):
+		return self.total
+
+class ProdReducer(OnlineReducer):
+
+	def initialise(self):
+		self.product = np.ones(self.shape, dtype=np.float64)
+
+	def accumulate(self, chunk, axis):
+		self.product *= np.nanprod(chunk, axis=axis, dtype=np.float64)
+
+	def result(self):
+		return self.product
+
+class AllReducer(OnlineReducer):
+
+	def initialise(self):
+		self.value = np.ones(self.shape, dtype=np.bool)
+
+	def accumulate(self, chunk, axis):
+		self.value &= np.all(np.where(np.isnan(chunk), True, chunk != 0), axis=axis)
+
+	def result(self):
+		return self.value
+
+class AnyReducer(OnlineReducer):
+
+	def initialise(self):
+		self.value = np.zeros(self.shape, dtype=np.bool)
+
+	def accumulate(self, chunk, axis):
+		self.value |= np.any(np.where(np.isnan(chunk), False, chunk != 0), axis=axis)
+
+	def result(self):
+		return self.value
+
+class ExtremaReducer(OnlineReducer):
+	'''
+	Running minimum and maximum. result() returns min, max or ptp according to statistic
+	'''
+
+	def __init__(self, statistic):
+		OnlineReducer.__init__(self)
+		self.statistic = statistic
+
+	def initialise(self):
+		self.minimum = np.empty(self.shape, dtype=np.float64)
+		self.minimum.fill(np.nan)
+		self.maximum = self.minimum.copy()
+
+	def accumulate(self, chunk, axis):
+		# fmin/fmax ignore NaN unless both values are NaN
+		self.minimum = np.fmin(self.minimum, np.fmin.reduce(chunk, axis=axis))
+		self.maximum = np.fmax(self.maximum, np.fmax.reduce(chunk, axis=axis))
+
+	def result(self):
+		if self.statistic == 'min':
+			return self.minimum
+		elif self.statistic == 'max':
+			return self.maximum
+		return self.maximum - self.minimum
+
+class ArgExtremumReducer(OnlineReducer):
+	'''
+	Running position of first minimum or maximum along the reduced axis
+	'''
+
+	def __init__(self, statistic):
+		OnlineReducer.__init__(self)
+		self.statistic = statistic
+		self.offset = 0 # Number of slices already consumed
+
+	def initialise(self):
+		self.value = np.empty(self.shape, dtype=np.float64)
+		self.value.fill(np.nan)
+		self.position = self.value.copy()
+
+	def accumulate(self, chunk, axis):
+		nan_mask = np.isnan(chunk)
+		if self.statistic == 'max':
+			chunk_position = np.argmax(np.where(nan_mask, -np.inf, chunk), axis=axis)
+		else:
+			chunk_position = np.argmin(np.where(nan_mask, np.inf, chunk), axis=axis)
+		element_count = chunk_position.size
+		chunk_value = np.rollaxis(chunk, axis).reshape((chunk.shape[axis], element_count))[chunk_position.ravel(), np.arange(element_count)].reshape(chunk_position.shape)
+
+		# Keep earlier position for equal values, as numpy does
+		with np.errstate(invalid='ignore'):
+			if self.statistic == 'max':
+				better = ~np.isnan(chunk_value) & (np.isnan(self.value) | (chunk_value > self.value))
+			else:
+				better = ~np.isnan(chunk_value) & (np.isnan(self.value) | (chunk_value < self.value))
+		self.value[better] = chunk_value[better]
+		self.position[better] = chunk_position[better] + self.offset
+		self.offset += chunk.shape[axis]
+
+	def result(self):
+		return self.position
+
+class MomentReducer(OnlineReducer):
+	'''
+	Running count, mean and sum of squared differences from the mean, combined per chunk using the parallel form 
+	of Welford's algorithm (Chan et al.). result() returns mean, var or std (ddof=0) according to statistic
+	'''
+
+	def __init__(self, statistic):
+		OnlineReducer.__init__(self)
+		self.statistic = statistic
+
+	def initialise(self):
+		self.count = np.zeros(self.shape, dtype=np.float64)
+		self.mean = np.zeros(self.shape, dtype=np.float64)
+		self.m2 = np.zeros(self.shape, dtype=np.float64)
+
+	def accumulate(self, chunk, axis):
+		chunk_count = np.sum(~np.isnan(chunk), axis=axis).astype(np.float64)
+		with np.errstate(invalid='ignore', divide='ignore'):
+			chunk_mean = np.nansum(chunk, axis=axis, dtype=np.float64) / chunk_count
+			chunk_m2 = np.nansum((chunk - np.expand_dims(chunk_mean, axis)) ** 2, axis=axis, dtype=np.float64)
+
+			total_count = self.count + chunk_count
+			delta = chunk_mean - self.mean
+			update = chunk_count > 0
+			self.mean[update] += (delta * chunk_count / total_count)[update]
+			self.m2[update] += (chunk_m2 + delta ** 2 * self.count * chunk_count / total_count)[update]
+		self.count = total_count
+
+	def result(self):
+		with np.errstate(invalid='ignore', divide='ignore'):
+			if self.statistic == 'mean':
+				result = self.mean.copy()
+			else:
+				result = self.m2 / self.count
+				if self.statistic == 'std':
+					result = np.sqrt(result)
+		result[self.count == 0] = np.nan
+		return result
+
+class P2QuantileReducer(OnlineReducer):
+	'''
+	Approximate streaming quantile using the P-square algorithm (Jain & Chlamtac, 1985), vectorised over all elements.
+	Needs five marker heights and positions per element regardless of the number of values consumed. 
+	Elements with fewer than five values return the exact quantile
+	'''
+	MARKER_COUNT = 5
+
+	def __init__(self, quantile):
+		OnlineReducer.__init__(self)
+		self.quantile = quantile
+		# Desired marker positions after five values and their increments per value
+		self.initial_positions = np.array([1, 1 + 2 * quantile, 1 + 4 * quantile, 3 + 2 * quantile, 5])[:, np.newaxis]
+		self.position_increments = np.array([0, quantile / 2.0, quantile, (1 + quantile) / 2.0, 1])[:, np.newaxis]
+
+	def initialise(self):
+		size = int(np.prod(self.shape))
+		self.count = np.zeros(size, dtype=np.int64)
+		self.heights = np.empty((self.MARKER_COUNT, size), dtype=np.float64) # Also holds first values before sorting
+		self.heights.fill(np.nan)
+		self.positions = np.empty((self.MARKER_COUNT, size), dtype=np.float64)
+
+	def accumulate(self, chunk, axis):
+		for slice_index in range(chunk.shape[axis]):
+			self.add(np.take(chunk, slice_index, axis=axis).ravel())
+
+	def add(self, values):
+		'''
+		Add one value (possibly NaN) for every element
+		'''
+		valid = ~np.isnan(values)
+		filling = valid & (self.count < self.MARKER_COUNT)
+		active = valid & ~filling
+
+		if filling.any():
+			element_indices = np.where(filling)[0]
+			self.heights[self.count[filling], element_indices] = values[filling]
+			self.count[filling] += 1
+			full = element_indices[self.count[filling] == self.MARKER_COUNT]
+			if len(full):
+				self.heights[:, full] = np.sort(self.heights[:, full], axis=0)
+				self.positions[:, full] = np.arange(1, self.MARKER_COUNT + 1)[:, np.newaxis]
+
+		if not active.any():
+			return
+
+		values = values[active]
+		heights = self.heights[:, active]
+		positions = self.positions[:, active]
+
+		# Extend extreme markers and find cell k containing each value
+		heights[0] = np.minimum(heights[0], values)
+		heights[4] = np.maximum(heights[4], values)
+		cell = (values >= heights[1]).astype(np.int64) + (values >= heights[2]) + (values >= heights[3])
+		for marker_index in range(1, self.MARKER_COUNT):
+			positions[marker_index] += (cell < marker_index)
+
+		count = self.count[active] + 1
+		desired_positions = self.initial_positions + (count - self.MARKER_COUNT) * self.position_increments
+
+		# Adjust heights of middle markers if they are off their desired positions
+		for marker_index in range(1, self.MARKER_COUNT - 1):
+			offset = desired_positions[marker_index] - positions[marker_index]
+			move = (((offset >= 1) & (positions[marker_index + 1] - positions[marker_index] > 1)) |
+					((offset <= -1) & (positions[marker_index - 1] - positions[marker_index] < -1)))
+			if not move.any():
+				continue
+
+			step = np.sign(offset[move])
+			height, lower_height, upper_height = heights[marker_index, move], heights[marker_index - 1, move], heights[marker_index + 1, move]
+			position, lower_position, upper_position = positions[marker_index, move], positions[marker_index - 1, move], positions[marker_index + 1, move]
+
+			# Piecewise parabolic prediction, falling back to linear if it isn't between neighbouring heights
+			parabolic = height + step / (upper_position - lower_position) * (
+				(position - lower_position + step) * (upper_height - height) / (upper_position - position) +
+				(upper_position - position - step) * (height - lower_height) / (position - lower_position))
+			neighbour_height = np.where(step > 0, upper_height, lower_height)
+			neighbour_position = np.where(step > 0, upper_position, lower_position)
+			linear = height + step * (neighbour_height - height) / (neighbour_position - position)
+
+			heights[marker_index, move] = np.where((lower_height < parabolic) & (parabolic < upper_height), parabolic, linear)
+			positions[marker_index, move] = position + step
+
+		self.heights[:, active] = heights
+		self.positions[:, active] = positions
+		self.count[active] = count
+
+	def result(self):
+		result = self.heights[2].copy()
+
+		# Exact quantiles for elements with too few values for the markers (unused heights are NaN)
+		partial = (self.count > 0) & (self.count < self.MARKER_COUNT)
+		if partial.any():
+			result[partial] = np.nanpercentile(self.heights[:, partial], self.quantile * 100.0, axis=0)
+		result[self.count == 0] = np.nan
+
+		return result.reshape(self.shape)
+
+# Reducer factories keyed by operator name
+ONLINE_REDUCERS = {
+	'min': lambda: ExtremaReducer('min'),
+	'amin': lambda: ExtremaReducer('min'),
+	'nanmin': lambda: ExtremaReducer('min'),
+	'max': lambda: ExtremaReducer('max'),
+	'amax': lambda: ExtremaReducer('max'),
+	'nanmax': lambda: ExtremaReducer('max'),
+	'ptp': lambda: ExtremaReducer('ptp'),
+	'average': lambda: MomentReducer('mean'),
+	'mean': lambda: MomentReducer('mean'),
+	'nanmean': lambda: MomentReducer('mean'),
+	'std': lambda: MomentReducer('std'),
+	'nanstd': lambda: MomentReducer('std'),
+	'var': lambda: MomentReducer('var'),
+	'nanvar': lambda: MomentReducer('var'),
+	'argmax': lambda: ArgExtremumReducer('max'),
+	'argmin': lambda: ArgExtremumReducer('min'),
+	'sum': SumReducer,
+	'prod': ProdReducer,
+	'all': AllReducer,
+	'any': AnyReducer,
+	'count': CountReducer
+	}
+
+# Approximate reducer factories keyed by operator name. Each takes the operator arguments
+APPROXIMATE_REDUCERS = {
+	'median': lambda: P2QuantileReducer(0.5),
+	'percentile': lambda percentile: P2QuantileReducer(float(percentile) / 100.0),
+	'quantile': lambda quantile: P2QuantileReducer(float(quantile))
+	}
+
+def get_reducer(function_name, approximate=False, arguments=()):
+	'''
+	Return new online reducer for the named operator, or None if there isn't one
+	Parameters:
+		function_name: name of reduction operator
+		approximate: allow approximate reducers
+		arguments: operator arguments, e.g. (10,) for the 10th percentile
+	'''
+	reducer_factory = ONLINE_REDUCERS.get(function_name) if not arguments else None
+	if reducer_factory is None and approximate:
+		reducer_factory = APPROXIMATE_REDUCERS.get(function_name)
+	if reducer_factory is None:
+		return None
+	try:
+		return reducer_factory(*arguments)
+	except TypeError: # Wrong number of arguments
+		return None
+
+def get_streaming_plan(plan, get_reduction, approximate=False):
+	'''
+	Return (input_plan, reduction_plan, output_plan) tuple splitting a plan into the tasks feeding reductions over T,
+	the reductions themselves and all remaining tasks. Returns None if the plan can't be streamed, i.e. if there are 
+	no online reductions over T, any input task reduces, or any remaining task needs the full result of an input task
+	Parameters:
+		plan: list of tasks as produced by Analytics
+		get_reduction: function returning the (operator name, arguments) tuple for a reduction task, or None for other tasks
+		approximate: allow approximate reducers
+	'''
+	dependencies, consumers = get_plan_graph(plan)
+
+	reduction_names = []
+	for task in plan:
+		name = task.keys()[0]
+		reduction = get_reduction(task)
+		if (reduction and [dimension.upper() for dimension in task.values()[0].get('dimension') or []] == [TIME_DIMENSION]
+			and get_reducer(reduction[0], approximate, reduction[1]) is not None):
+			reduction_names.append(name)
+	if not reduction_names:
+		return None
+
+	# All ancestors of the streamed reductions are read in chunks
+	input_names = set()
+	pending_names = list(reduction_names)
+	while pending_names:
+		for dependency in dependencies[pending_names.pop()]:
+			if dependency not in input_names:
+				input_names.add(dependency)
+				pending_names.append(dependency)
+	if input_names & set(reduction_names):
+		return None
+
+	for task in plan:
+		name = task.keys()[0]
+		if name not in input_names:
+			continue
+		if get_reduction(task) is not None: # Any other reduction needs the whole cube
+			return None
+		if not consumers[name] or [consumer for consumer in consumers[name] if consumer not in input_names and consumer not in reduction_names]:
+			return None # Full result of input task is needed
+
+	return ([task for task in plan if task.keys()[0] in input_names],
+			[task for task in plan if task.keys()[0] in reduction_names],
+			[task for task in plan if task.keys()[0] not in input_names and task.keys()[0] not in reduction_names])
+
+def get_time_chunks(time_range, origin, extent, units_per_chunk=1):
+	'''
+	Return list of (min, max) T ranges covering time_range, split on storage unit boundaries. 
+	Upper bounds of all but the last chunk exclude the boundary
+	Parameters:
+		time_range: (min, max) tuple
+		origin: T origin of storage units
+		extent: T extent of each storage unit
+		units_per_chunk: number of storage units in each chunk
+	'''
+	range_min, range_max = time_range
+	chunk_extent = extent * units_per_chunk
+
+	boundaries = [range_min]
+	boundary = origin + (np.floor((range_min - origin) / chunk_extent) + 1) * chunk_extent
+	while boundary < range_max:
+		boundaries.append(boundary)
+		boundary += chunk_extent
+	boundaries.append(range_max)
+
+	return [(boundaries[chunk_index], boundaries[chunk_index + 1] - (TIME_EPSILON if chunk_index < len(boundaries) - 2 else 0))
+			for chunk_index in range(len(boundaries) - 1)]
+
+def set_time_range(plan, time_range):
+	'''
+	Return a copy of a plan with the T ranges of all get_data tasks set to time_range
+	'''
+	plan = copy.deepcopy(plan)
+	for task in plan:
+		if task.values()[0]['orig_function'] != 'get_data':
+			continue
+		for array_input in task.values()[0]['array_input']:
+			dimensions = array_input.values()[0]['dimensions']
+			for dimension in dimensions.keys():
+				if dimension.upper() == TIME_DIMENSION:
+					dimensions[dimension]['range'] = time_range
+	return plan
@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+
+import re
+import copy
+import collections
+
+import logging
+
+from _scheduler import get_plan_graph
+from _tiling import MASK_OVERLAP, TILE_DIMENSIONS, get_plan_extent, _get_dimension
+
+'''
+Plan optimisation for the ExecutionEngine:
+- prunes tasks which don't contribute to the required outputs
+- restricts the ranges and variables read by get_data tasks to those the plan outputs need
+- eliminates tasks duplicating earlier tasks
+- reads the data of get_data tasks with the same storage type and dimensions once
+- fuses chains of elementwise tasks (cloud masks and band math) into a single numexpr expression, 
+  so that the intermediate arrays and their no data scans are never materialised
+- fuses the reduction consuming such a chain, so that the fused result is reduced without being cached
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG) # Logging level for this module
+
+FUSED_FUNCTION = 'fused'
+IDENTIFIER_PATTERN = re.compile(r'\b[A-Za-z_]\w*\b')
+MAX_EXPRESSION_LENGTH = 4096 # Longer fused expressions are split into separate tasks
+
+def _literal(value):
+	'''
+	Return numexpr literal for a no data value
+	'''
+	if hasattr(value, 'item'): # NumPy scalar
+		value = value.item()
+	return repr(value)
+
+def _replace_name(expression, name, replacement):
+	'''
+	Return expression with every occurrence of the identifier name replaced
+	'''
+	return re.sub(r'\b%s\b' % re.escape(name), lambda match: replacement, expression)
+
+def _canonical(value):
+	'''
+	Return hashable representation of a task description which doesn't depend on dict ordering
+	'''
+	if isinstance(value, dict):
+		return tuple(sorted((key, _canonical(item)) for key, item in value.items()))
+	if isinstance(value, (list, tuple)):
+		return tuple(_canonical(item) for item in value)
+	if hasattr(value, 'tolist'): # NumPy arrays and scalars
+		return _canonical(value.tolist())
+	return value
+
+def _get_variables(task_dict):
+	'''
+	Return list of variable names read by a get_data task
+	'''
+	return [array_input.values()[0]['variable'] for array_input in task_dict['array_input']]
+
+def prune_plan(plan, outputs):
+	'''
+	Return plan without the tasks which aren't needed to compute the named outputs
+	'''
+	dependencies = get_plan_graph(plan)[0]
+	required_names = set()
+	pending_names = [name for name in outputs if name in dependencies]
+	while pending_names:
+		name = pending_names.pop()
+		if name not in required_names:
+			required_names.add(name)
+			pending_names += dependencies[name]
+
+	pruned_names = [task.keys()[0] for task in plan if task.keys()[0] not in required_names]
+	if pruned_names:
+		logger.debug('Pruned tasks %s', pruned_names)
+	return [task for task in plan if task.keys()[0] in required_names]
+
+def push_down_ranges(plan, ranges):
+	'''
+	Return copy of plan with the ranges read by its get_data tasks restricted to the ranges required of the plan outputs.
+	Dimensions reduced by any task, or read with different ranges by different get_data tasks, aren't restricted. 
+	X and Y reads are widened by the overlap needed by cloud masks, so outputs may extend beyond the ranges
+	Parameters:
+		plan: list of tasks as produced by Analytics
+		ranges: dict of (min, max) ranges required of the plan outputs keyed by dimension
+	'''
+	plan = copy.deepcopy(plan)
+	array_inputs = [array_input.values()[0] for task in plan if task.values()[0]['orig_function'] == 'get_data' 
+					for array_input in task.values()[0]['array_input']]
+	reduced_dimensions = set(dimension.upper() for task in plan for dimension in task.values()[0].get('dimension') or [])
+	has_cloud_mask = bool([task for task in plan if task.values()[0]['orig_function'] == 'apply_cloud_mask'])
+
+	for dimension, required_range in ranges.items():
+		dimension_tag = dimension.upper()
+		if not array_inputs or dimension_tag in reduced_dimensions:
+			continue
+
+		keys = [_get_dimension(array_input['dimensions'], dimension_tag) for array_input in array_inputs]
+		if None in keys:
+			continue
+		read_ranges = set(tuple(array_input['dimensions'][key].get('range') or ()) for array_input, key in zip(array_inputs, keys))
+		if len(read_ranges) != 1:
+			continue
+		read_range = read_ranges.pop()
+		if len(read_range) != 2:
+			continue
+		read_min, read_max = sorted(read_range)
+
+		range_min, range_max = sorted(required_range)
+		if has_cloud_mask and dimension_tag in TILE_DIMENSIONS:
+			element_size = get_plan_extent(plan)[dimension_tag][2]
+			range_min -= MASK_OVERLAP * element_size
+			range_max += MASK_OVERLAP * element_size
+		range_min = max(range_min, read_min)
+		range_max = min(range_max, read_max)
+		if (range_min, range_max) == (read_min, read_max):
+			continue
+
+		logger.debug('Restricted %s range read from %s to %s', dimension, (read_min, read_max), (range_min, range_max))
+		for array_input, key in zip(array_inputs, keys):
+			array_input['dimensions'][key]['range'] = (range_min, range_max)
+
+	return plan
+
+def push_down_variables(plan):
+	'''
+	Return copy of plan without the variables of get_data tasks which no consumer uses. Only band math tasks using
+	a get_data result other than as their first input ignore some of its arrays: the no data values of every array
+	of the first input are propagated, and other tasks use whole results
+	'''
+	plan = copy.deepcopy(plan)
+	consumers = get_plan_graph(plan)[1]
+	tasks = dict((task.keys()[0], task.values()[0]) for task in plan)
+
+	for task in plan:
+		name = task.keys()[0]
+		task_dict = task.values()[0]
+		if task_dict['orig_function'] != 'get_data' or not consumers[name]:
+			continue
+
+		variables = _get_variables(task_dict)
+		required_variables = set()
+		for consumer in consumers[name]:
+			consumer_dict = tasks[consumer]
+			if (consumer_dict['orig_function'] in ['get_data', 'apply_cloud_mask', FUSED_FUNCTION] or 'dimension' in consumer_dict
+				or consumer_dict['array_input'][0] == name):
+				required_variables.update(variables)
+			else:
+				required_variables.update(IDENTIFIER_PATTERN.findall(consumer_dict['function']))
+
+		if required_variables and not set(variables) <= required_variables:
+			logger.debug('Restricted variables read by %s to %s', name, [variable for variable in variables if variable in required_variables])
+			task_dict['array_input'] = [array_input for array_input in task_dict['array_input'] 
+										if array_input.values()[0]['variable'] in required_variables]
+
+	return plan
+
+def eliminate_common_tasks(plan):
+	'''
+	Return copy of plan in which each task duplicating an earlier task is removed and its consumers use the earlier 
+	task instead. Plan outputs are always kept. Tasks are duplicates if they have the same inputs, function and output 
+	apart from their names
+	'''
+	plan = copy.deepcopy(plan)
+	consumers = get_plan_graph(plan)[1]
+
+	replacements = {} # Names of remaining tasks keyed by names of removed duplicates
+	task_names = {} # Task names keyed by canonical task descriptions
+	optimised_plan = []
+	for task in plan:
+		name = task.keys()[0]
+		task_dict = task.values()[0]
+
+		if task_dict['orig_function'] != 'get_data':
+			task_dict['array_input'] = [replacements.get(input_name, input_name) for input_name in task_dict['array_input']]
+			if task_dict.get('array_mask') in replacements:
+				task_dict['array_mask'] = replacements[task_dict['array_mask']]
+			for removed_name, replacement_name in replacements.items():
+				task_dict['function'] = _replace_name(task_dict['function'], removed_name, replacement_name)
+
+		# Results other than get_data results are keyed by task name, so the function refers to its inputs by name
+		description = dict((key, value) for key, value in task_dict.items() if key != 'array_output')
+		description['array_output'] = dict((key, value) for key, value in task_dict['array_output'].items() if key != 'variable')
+		description = _canonical(description)
+
+		if description in task_names and consumers[name]:
+			logger.debug('Replaced task %s with identical task %s', name, task_names[description])
+			replacements[name] = task_names[description]
+			continue
+
+		task_names.setdefault(description, name)
+		optimised_plan.append(task)
+
+	return optimised_plan
+
+def share_reads(plan):
+	'''
+	Return copy of plan in which get_data tasks with the same storage type and dimensions are marked to share a 
+	single read of all the variables they need
+	'''
+	plan = copy.deepcopy(plan)
+
+	groups = collections.OrderedDict() # Lists of get_data task dicts keyed by canonical storage type and dimensions
+	for task in plan:
+		task_dict = task.values()[0]
+		if task_dict['orig_function'] == 'get_data':
+			array_input = task_dict['array_input'][0].values()[0]
+			groups.setdefault(_canonical((array_input['storage_type'], array_input['dimensions'])), []).append(task)
+
+	for group in groups.values():
+		if len(group) < 2:
+			continue
+
+		shared_read = {'key': group[0].keys()[0], 'variables': [], 'users': {}, 'tasks': len(group)}
+		for task in group:
+			for variable in _get_variables(task.values()[0]):
+				if variable not in shared_read['variables']:
+					shared_read['variables'].append(variable)
+				shared_read['users'][variable] = shared_read['users'].get(variable, 0) + 1
+
+		logger.debug('Tasks %s share a single read of %s', [task.keys()[0] for task in group], shared_read['variables'])
+		for task in group:
+			task.values()[0]['shared_read'] = shared_read
+
+	return plan
+
+class PlanFuser(object):
+	'''
+	Rewrites a plan replacing each group of fusable tasks with a single fused task named after the last task of the group.
+	Results of fused tasks other than the last one are not available after execution
+	'''
+
+	def __init__(self, plan, get_reduction):
+		'''
+		Parameters:
+			plan: list of tasks as produced by Analytics
+			get_reduction: function returning the (operator name, arguments) tuple for a reduction task, or None for other tasks
+		'''
+		self.plan = plan
+		self.get_reduction = get_reduction
+		self.tasks = collections.OrderedDict((task.keys()[0], task.values()[0]) for task in plan)
+		self.consumers = get_plan_graph(plan)[1]
+		self.fused_into = {} # Name of consuming task keyed by name of task fused into it
+
+	def get_result_variables(self, name):
+		'''
+		Return list of names of arrays in the result of a task
+		'''
+		task_dict = self.tasks[name]
+		if task_dict['orig_function'] == 'get_data':
+			return [array_input.keys()[0] for array_input in task_dict['array_input']]
+		return [name]
+
+	def is_elementwise(self, name):
+		'''
+		Return True if task computes each element of its result from the same element of its inputs and can be fused
+		'''
+		task_dict = self.tasks[name]
+		if task_dict['orig_function'] in ['get_data', FUSED_FUNCTION] or self.get_reduction({name: task_dict}) is not None:
+			return False
+		if task_dict['array_output'].get('no_data_value') is None:
+			return False
+		if [input_name for input_name in task_dict['array_input'] if input_name not in self.tasks]:
+			return False # Inputs already in the cache are not described by the plan
+		if task_dict['orig_function'] == 'apply_cloud_mask':
+			# The masked array is the first array of the input result, which is only known for single arrays
+			data_name = task_dict['array_input'][0]
+			return (task_dict['array_mask'] in self.tasks and task_dict['array_mask'] != data_name and 
+					len(self.get_result_variables(data_name)) == 1)
+		return True
+
+	def can_fuse_into(self, name, consumer):
+		'''
+		Return True if the result of task name can be computed within its consumer
+		'''
+		consumer_dict = self.tasks[consumer]
+		if self.get_reduction({consumer: consumer_dict}) is not None:
+			return consumer_dict['array_input'] == [name]
+		if not self.is_elementwise(consumer):
+			return False
+		if consumer_dict['orig_function'] == 'apply_cloud_mask':
+			return consumer_dict['array_input'][0] == name
+		return True
+
+	def get_value(self, name, masks):
+		'''
+		Return numexpr expression for the result array of a task. Tasks which aren't fused are referred to by their 
+		array names
+		Parameters:
+			name: task name
+			masks: dict of PQA mask array names keyed by mask task name, updated with any new masks
+		'''
+		if name not in self.fused_into:
+			return self.get_result_variables(name)[0]
+
+		task_dict = self.tasks[name]
+		no_data_value = _literal(task_dict['array_output']['no_data_value'])
+
+		if task_dict['orig_function'] == 'apply_cloud_mask':
+			mask_name = masks.setdefault(task_dict['array_mask'], 'pqa_mask_%d' % len(masks))
+			return 'where(%s, %s, %s)' % (mask_name, self.get_value(task_dict['array_input'][0], masks), no_data_value)
+
+		return 'where(%s, %s, %s)' % (self.get_band_math_condition(name, masks), no_data_value, self.get_band_math_function(name, masks))
+
+	def get_band_math_function(self, name, masks):
+		'''
+		Return numexpr expression of a fused band math task before no data values are propagated
+		'''
+		task_dict = self.tasks[name]
+		function = task_dict['function']
+		for input_name in task_dict['array_input']:
+			if input_name in self.fused_into:
+				function = _replace_name(function, input_name, '(%s)' % self.get_value(input_name, masks))
+		return function
+
+	def get_band_math_condition(self, name, masks):
+		'''
+		Return numexpr expression which is True where a fused band math task propagates no data values of its first input
+		'''
+		task_dict = self.tasks[name]
+		return self.get_no_data_condition(task_dict['array_input'][0], task_dict['array_output']['no_data_value'], masks)
+
+	def get_no_data_condition(self, name, no_data_value, masks):
+		'''
+		Return numexpr expression which is True where any array in the result of a task equals no_data_value. 
+		Fused tasks are expanded so that their whole value isn't repeated where possible
+		'''
+		if name not in self.fused_into:
+			return '(%s)' % ' | '.join('(%s == %s)' % (variable, _literal(no_data_value)) for variable in self.get_result_variables(name))
+
+		task_dict = self.tasks[name]
+		same_no_data_value = (task_dict['array_output']['no_data_value'] == no_data_value)
+
+		if task_dict['orig_function'] == 'apply_cloud_mask': # where(mask, value, task no data value)
+			mask_name = masks.setdefault(task_dict['array_mask'], 'pqa_mask_%d' % len(masks))
+			input_condition = self.get_no_data_condition(task_dict['array_input'][0], no_data_value, masks)
+			if same_no_data_value:
+				return '(~%s | %s)' % (mask_name, input_condition)
+			return '(%s & %s)' % (mask_name, input_condition)
+
+		# Band math: where(input condition, task no data value, function)
+		input_condition = self.get_band_math_condition(name, masks)
+		function_condition = '((%s) == %s)' % (self.get_band_math_function(name, masks), _literal(no_data_value))
+		if same_no_data_value:
+			return '(%s | %s)' % (input_condition, function_condition)
+		return '(~(%s) & %s)' % (input_condition, function_condition)
+
+	def get_members(self, name):
+		'''
+		Return names of tasks fused into a task, in plan order
+		'''
+		members = set([name])
+		pending_names = [name]
+		while pending_names:
+			consumer = pending_names.pop()
+			for member in [member for member in self.fused_into.keys() if self.fused_into[member] == consumer]:
+				members.add(member)
+				pending_names.append(member)
+		return [member for member in self.tasks.keys() if member in members]
+
+	def get_index_input(self, name):
+		'''
+		Return name of unfused task whose result supplies the indices of the result of a task
+		'''
+		while name in self.fused_into:
+			name = self.tasks[name]['array_input'][0]
+		return name
+
+	def fuse(self):
+		'''
+		Return optimised copy of the plan
+		'''
+		for name in self.tasks.keys():
+			if self.is_elementwise(name) and len(self.consumers[name]) == 1 and self.can_fuse_into(name, self.consumers[name][0]):
+				self.fused_into[name] = self.consumers[name][0]
+				# Each fused band math task repeats its first input in its no data condition
+				if len(self.get_value(name, {})) > MAX_EXPRESSION_LENGTH:
+					del self.fused_into[name]
+
+		sinks = set(self.fused_into.values()) - set(self.fused_into.keys())
+
+		optimised_plan = []
+		for name, task_dict in self.tasks.items():
+			if name in self.fused_into:
+				continue
+			if name not in sinks:
+				optimised_plan.append({name: task_dict})
+				continue
+
+			if self.get_reduction({name: task_dict}) is not None:
+				# The reduction input (already fused into the reduction) is computed by the expression
+				value_name = task_dict['array_input'][0]
+				fused_dict = {'reduction': copy.deepcopy(task_dict)}
+			else:
+				value_name = name
+				fused_dict = {}
+				self.fused_into[name] = None # Temporarily treat as fused so that its value is an expression
+
+			masks = {}
+			fused_dict['function'] = self.get_value(value_name, masks)
+			fused_dict['masks'] = dict((mask_name, mask_key) for mask_key, mask_name in masks.items())
+			fused_dict['fused_tasks'] = self.get_members(name)
+			fused_dict['fused_variable'] = value_name
+			fused_dict['orig_function'] = FUSED_FUNCTION
+			fused_dict['array_output'] = copy.deepcopy(task_dict['array_output'])
+
+			# Inputs are the unfused tasks used by any member, including PQA mask sources
+			fused_dict['array_input'] = []
+			for member in fused_dict['fused_tasks']:
+				member_dict = self.tasks[member]
+				for input_name in member_dict['array_input'] + [member_dict.get('array_mask')]:
+					if input_name in self.tasks and input_name not in self.fused_into and input_name not in fused_dict['array_input']:
+						fused_dict['array_input'].append(input_name)
+
+			fused_dict['index_input'] = self.get_index_input(value_name)
+			if value_name == name:
+				del self.fused_into[name]
+			logger.debug('Fused tasks %s into %s: %s', fused_dict['fused_tasks'], name, fused_dict['function'])
+			optimised_plan.append({name: fused_dict})
+
+		return optimised_plan
+
+def fuse_plan(plan, get_reduction):
+	'''
+	Return copy of plan with chains of elementwise tasks and the reductions consuming them fused into single tasks
+	Parameters:
+		plan: list of tasks as produced by Analytics
+		get_reduction: function returning the (operator name, arguments) tuple for a reduction task, or None for other tasks
+	'''
+	return PlanFuser(plan, get_reduction).fuse()
+
+def optimise_plan(plan, get_reduction):
+	'''
+	Return optimised copy of plan. Results of removed and fused tasks other than the plan outputs are not available 
+	after execution
+	Parameters:
+		plan: list of tasks as produced by Analytics
+		get_reduction: function returning the (operator name, arguments) tuple for a reduction task, or None for other tasks
+	'''
+	return fuse_plan(share_reads(eliminate_common_tasks(push_down_variables(plan))), get_reduction)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+import re
+import warnings
+import numpy as np
+
+import logging
+
+'''
+Vectorised reductions of arrays containing no data values:
+- no data values are converted to NaN once
+- the NaN-aware NumPy function is applied along all reduction axes at once
+- operators without a NaN-aware NumPy function have specialised kernels
+- quantiles use a single partial sort (np.partition) of the whole array at the ranks needed by any element, 
+  with NaN values partitioned to the end, instead of sorting each element separately
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG) # Logging level for this module
+
+def _nanptp(array, axis):
+	return np.nanmax(array, axis=axis) - np.nanmin(array, axis=axis)
+
+def _nanarg(arg_function, fill_value):
+	'''
+	Return argmin/argmax kernel which returns NaN instead of raising an exception where all values are NaN
+	'''
+	def kernel(array, axis):
+		nan_mask = np.isnan(array)
+		result = arg_function(np.where(nan_mask, fill_value, array), axis=axis).astype(np.float64)
+		result[np.all(nan_mask, axis=axis)] = np.nan
+		return result
+	return kernel
+
+def _nanall(array, axis):
+	return np.all(np.where(np.isnan(array), True, array != 0), axis=axis)
+
+def _nanany(array, axis):
+	return np.any(np.where(np.isnan(array), False, array != 0), axis=axis)
+
+def _take_along_axis(array, indices, axis):
+	'''
+	Return array values at the given index along axis for each element of the remaining axes.
+	Indices has the shape of array without axis. Only the selected values are copied
+	'''
+	index = list(np.ix_(*[np.arange(size) for size in indices.shape]))
+	index.insert(axis, indices)
+	return array[tuple(index)]
+
+def _nanquantile(quantile):
+	'''
+	Return kernel computing the quantile (0 <= quantile <= 1) of the non-NaN values along axis with linear 
+	interpolation between the closest ranks, as np.nanpercentile does. The kernel reorders the array in place
+	'''
+	if not 0.0 <= quantile <= 1.0:
+		raise ValueError('Quantile %s must be between 0 and 1' % quantile)
+
+	def kernel(array, axis):
+		# Ranks are relative to the valid values of each element
+		count = array.shape[axis] - np.sum(np.isnan(array), axis=axis)
+		rank = quantile * np.maximum(count - 1, 0)
+		lower = np.floor(rank).astype(np.intp)
+		upper = np.ceil(rank).astype(np.intp)
+
+		# NaN values compare greater than everything so the valid values of each element are partitioned first. 
+		# Elements with the same number of valid values share ranks, so there are few distinct ranks to partition at
+		array.partition(np.union1d(lower, upper), axis=axis)
+
+		lower_values = _take_along_axis(array, lower, axis)
+		upper_values = _take_along_axis(array, upper, axis)
+		result = lower_values + (upper_values - lower_values) * np.asarray(rank - lower, dtype=array.dtype)
+		return np.where(count > 0, result, np.nan).astype(array.dtype)
+	return kernel
+
+# NaN-aware kernels keyed by operator name. Each takes (array, axis)
+NAN_KERNELS = {
+	'min': np.nanmin,
+	'amin': np.nanmin,
+	'nanmin': np.nanmin,
+	'max': np.nanmax,
+	'amax': np.nanmax,
+	'nanmax': np.nanmax,
+	'ptp': _nanptp,
+	'median': _nanquantile(0.5),
+	'average': np.nanmean,
+	'mean': np.nanmean,
+	'nanmean': np.nanmean,
+	'std': np.nanstd,
+	'nanstd': np.nanstd,
+	'var': np.nanvar,
+	'nanvar': np.nanvar,
+	'argmax': _nanarg(np.argmax, -np.inf),
+	'argmin': _nanarg(np.argmin, np.inf),
+	'sum': np.nansum,
+	'prod': np.nanprod,
+	'all': _nanall,
+	'any': _nanany
+	}
+
+# Factories of NaN-aware kernels for parameterised operators keyed by operator name. 
+# Each takes the operator arguments and returns a kernel taking (array, axis)
+NAN_KERNEL_FACTORIES = {
+	'percentile': lambda percentile: _nanquantile(float(percentile) / 100.0),
+	'quantile': lambda quantile: _nanquantile(float(quantile))
+	}
+
+# Reduction function call, e.g. "median(array1)" or "percentile(array1, 10)"
+REDUCTION_PATTERN = re.compile(r'^\s*(\w+)\s*\(\s*[\w.]+\s*((?:,\s*[^,()]+)*)\)\s*$')
+
+def parse_reduction(function):
+	'''
+	Return (function_name, arguments) tuple for a reduction function call with numeric arguments after the input array, 
+	or None if function is not a single function call, e.g. "percentile(array1, 10)" gives ('percentile', (10.0,))
+	'''
+	match = REDUCTION_PATTERN.match(function)
+	if not match:
+		return None
+	try:
+		arguments = tuple(float(argument) for argument in match.group(2).split(',')[1:])
+	except ValueError:
+		return None
+	return (match.group(1), arguments)
+
+def get_kernel(function_name, arguments=()):
+	'''
+	Return NaN-aware kernel for the named operator and arguments, or None if there isn't one
+	'''
+	if function_name in NAN_KERNEL_FACTORIES:
+		if len(arguments) != 1:
+			raise ValueError('%s requires one argument' % function_name)
+		return NAN_KERNEL_FACTORIES[function_name](arguments[0])
+	if arguments:
+		return None
+	return NAN_KERNELS.get(function_name)
+
+def to_nan_array(array, no_data_value, overwrite_input=False):
+	'''
+	Return floating point copy of array with no data values replaced by NaN.
+	float32 arrays are kept as float32 to halve memory use, everything else is converted to float64.
+	If overwrite_input is True, floating point arrays are converted in place instead of being copied
+	'''
+	dtype = np.float32 if array.dtype == np.float32 else np.float64
+	if overwrite_input and array.dtype == dtype:
+		nan_array = array
+	else:
+		nan_array = array.astype(dtype)
+	if no_data_value is not None:
+		nan_array[nan_array == no_data_value] = np.nan
+	return nan_array
+
+def reduce_array(array, axes, function_name, no_data_value, arguments=(), overwrite_input=False):
+	'''
+	Return array reduced along axes by the named operator ignoring no data values.
+	Elements with no valid values are NaN (except for sum, prod, all and any which return their identity values)
+	Parameters:
+		array: array to reduce
+		axes: list of axes to reduce
+		function_name: name of operator in NAN_KERNELS or NAN_KERNEL_FACTORIES
+		no_data_value: value to ignore
+		arguments: operator arguments, e.g. (10,) for the 10th percentile
+		overwrite_input: allow array to be used as working space
+	'''
+	kernel = get_kernel(function_name, arguments)
+	axes = sorted(axes)
+
+	nan_array = to_nan_array(array, no_data_value, overwrite_input)
+
+	# Move reduced axes to the end and flatten them so that a single reduction along the last axis does everything
+	kept_axes = [axis for axis in range(array.ndim) if axis not in axes]
+	kept_shape = tuple(array.shape[axis] for axis in kept_axes)
+	if len(axes) > 1:
+		nan_array = np.transpose(nan_array, kept_axes + axes).reshape(kept_shape + (-1,))
+		axis = len(kept_axes)
+	else:
+		axis = axes[0]
+
+	with warnings.catch_warnings():
+		# All-NaN slices are expected wherever there is no valid data
+		warnings.simplefilter('ignore', RuntimeWarning)
+		return kernel(nan_array, axis=axis)
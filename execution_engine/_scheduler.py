@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import sys
+import Queue
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import logging
+
+'''
+Dependency-driven scheduling of Analytics plans:
+- derives the task graph from array_input and array_mask
+- runs tasks as soon as their inputs are available on a thread pool
+- reports intermediates whose last consumer has finished
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG) # Logging level for this module
+
+def get_task_dependencies(task):
+	'''
+	Return list of names of tasks whose results are required by a plan task
+	Parameters:
+		task: plan entry {name: task_dict}
+	'''
+	task_dict = task.values()[0]
+
+	dependencies = []
+	# get_data inputs are variable descriptors rather than task names
+	for array_input in task_dict.get('array_input', []):
+		if isinstance(array_input, basestring) and array_input not in dependencies:
+			dependencies.append(array_input)
+
+	array_mask = task_dict.get('array_mask')
+	if array_mask is not None and array_mask not in dependencies:
+		dependencies.append(array_mask)
+
+	return dependencies
+
+def get_plan_graph(plan):
+	'''
+	Return (dependencies, consumers) dicts of task name lists keyed by task name.
+	Dependencies on names not defined in the plan are ignored (e.g. results already in the cache)
+	Parameters:
+		plan: list of plan entries as produced by Analytics
+	'''
+	task_names = [task.keys()[0] for task in plan]
+
+	dependencies = {}
+	consumers = dict((name, []) for name in task_names)
+	for task in plan:
+		name = task.keys()[0]
+		dependencies[name] = [dependency for dependency in get_task_dependencies(task) if dependency in consumers]
+		for dependency in dependencies[name]:
+			consumers[dependency].append(name)
+
+	return dependencies, consumers
+
+class PlanScheduler(object):
+	'''
+	Executes the tasks of a plan concurrently, respecting the dependencies between them
+	'''
+
+	def __init__(self, plan, execute_function, num_workers=None, release_function=None):
+		'''
+		Parameters:
+			plan: list of plan entries as produced by Analytics
+			execute_function: function taking a single plan entry which computes its result
+			num_workers: number of tasks to run concurrently. Defaults to number of CPUs
+			release_function: optional function called with a task name once all consumers of its result have finished.
+				Never called for tasks without consumers (i.e. plan outputs)
+		'''
+		self.plan = plan
+		self.execute_function = execute_function
+		self.num_workers = num_workers or multiprocessing.cpu_count()
+		self.release_function = release_function
+		self.dependencies, self.consumers = get_plan_graph(plan)
+
+	def _run_task(self, task, done_queue):
+		'''
+		Worker function. Runs a single task and reports completion (and any exception) to the scheduler thread
+		'''
+		name = task.keys()[0]
+		try:
+			self.execute_function(task)
+			done_queue.put((name, None))
+		except Exception:
+			done_queue.put((name, sys.exc_info()))
+
+	def run(self):
+		'''
+		Execute all tasks in the plan. Re-raises the first exception raised by any task once running tasks have finished
+		'''
+		tasks = dict((task.keys()[0], task) for task in self.plan)
+		waiting_count = dict((name, len(self.dependencies[name])) for name in tasks.keys())
+		consumer_count = dict((name, len(self.consumers[name])) for name in tasks.keys())
+
+		done_queue = Queue.Queue()
+		pool = ThreadPool(min(self.num_workers, len(self.plan)) or 1)
+
+		def submit(name):
+			logger.debug('Submitting task %s', name)
+			pool.apply_async(self._run_task, (tasks[name], done_queue))
+
+		running_count = 0
+		completed_count = 0
+		error = None
+		try:
+			# Submit tasks without dependencies in plan order
+			for task in self.plan:
+				name = task.keys()[0]
+				if waiting_count[name] == 0:
+					submit(name)
+					running_count += 1
+
+			while running_count:
+				name, exc_info = done_queue.get()
+				running_count -= 1
+				completed_count += 1
+
+				if exc_info is not None:
+					logger.error('Task %s failed: %s', name, exc_info[1])
+					error = error or exc_info
+				if error is not None: # Don't start anything else - just wait for running tasks
+					continue
+
+				logger.debug('Task %s finished', name)
+				for consumer in self.consumers[name]:
+					waiting_count[consumer] -= 1
+					if waiting_count[consumer] == 0:
+						submit(consumer)
+						running_count += 1
+
+				for dependency in self.dependencies[name]:
+					consumer_count[dependency] -= 1
+					if consumer_count[dependency] == 0 and self.release_function is not None:
+						self.release_function(dependency)
+		finally:
+			pool.close()
+			pool.join()
+
+		if error is not None:
+			raise error[0], error[1], error[2]
+
+		if completed_count != len(self.plan):
+			raise AssertionError('Plan contains circular dependencies between tasks %s' % 
+								 [name for name in waiting_count.keys() if waiting_count[name]])
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+import copy
+import math
+import numpy as np
+
+import logging
+
+from analytics_utils import LANDSAT_PQA_FLAGS, get_flag_overlap
+
+'''
+Spatial tiling of Analytics plans:
+- splits the X/Y extent of a plan's get_data tasks into blocks with an optional overlap
+- creates a copy of the plan for each block
+- stitches block results together by their coordinate indices
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG) # Logging level for this module
+
+TILE_DIMENSIONS = ['X', 'Y']
+
+MASK_OVERLAP = get_flag_overlap(LANDSAT_PQA_FLAGS) # Pixels affected by the dilation of the default PQA flags
+
+def _get_dimension(dimensions, dimension_tag):
+	'''
+	Return the key in a dimensions dict matching dimension_tag regardless of case, or None if not present
+	'''
+	for key in dimensions.keys():
+		if key.upper() == dimension_tag:
+			return key
+	return None
+
+def get_data_inputs(plan):
+	'''
+	Return list of array_input descriptors for all get_data tasks in a plan
+	'''
+	return [array_input.values()[0] for task in plan if task.values()[0]['orig_function'] == 'get_data' 
+			for array_input in task.values()[0]['array_input']]
+
+def can_tile(plan):
+	'''
+	Return True if a plan can be executed in X/Y tiles, i.e. it reads data and no task reduces over X or Y
+	'''
+	if not get_data_inputs(plan):
+		return False
+
+	for task in plan:
+		reduction_dimensions = task.values()[0].get('dimension') or []
+		if [dimension for dimension in reduction_dimensions if dimension.upper() in TILE_DIMENSIONS]:
+			return False
+
+	return True
+
+def get_plan_extent(plan):
+	'''
+	Return dict of (min, max, element_size) tuples keyed by tile dimension for the get_data tasks in a plan.
+	Element size is estimated from the range and result shape of each input
+	'''
+	extent = {}
+	for array_input in get_data_inputs(plan):
+		for dimension_tag in TILE_DIMENSIONS:
+			key = _get_dimension(array_input['dimensions'], dimension_tag)
+			if key is None or not array_input['dimensions'][key].get('range'):
+				raise AssertionError('No %s range defined for get_data task' % dimension_tag)
+
+			range_min, range_max = sorted(array_input['dimensions'][key]['range'])
+			order_key = _get_dimension(dict((dimension, None) for dimension in array_input['dimensions_order']), dimension_tag)
+			element_size = (range_max - range_min) / float(array_input['shape'][array_input['dimensions_order'].index(order_key)])
+
+			if dimension_tag in extent:
+				previous_min, previous_max, previous_size = extent[dimension_tag]
+				extent[dimension_tag] = (min(range_min, previous_min), max(range_max, previous_max), min(element_size, previous_size))
+			else:
+				extent[dimension_tag] = (range_min, range_max, element_size)
+
+	return extent
+
+def get_tiles(extent, tile_size, overlap=0):
+	'''
+	Return list of tile dicts, each keyed by tile dimension containing:
+		'core': (min, max) range of pixels belonging to this tile. Max is inclusive only for the last tile in a dimension
+		'last': flag indicating that this is the last tile in a dimension
+		'range': (min, max) range to read including overlap
+	Parameters:
+		extent: dict of (min, max, element_size) tuples as returned by get_plan_extent
+		tile_size: number of pixels in each tile dimension
+		overlap: number of extra pixels to read around each tile
+	'''
+	dimension_tiles = []
+	for dimension_tag in TILE_DIMENSIONS:
+		range_min, range_max, element_size = extent[dimension_tag]
+		step = tile_size * element_size
+		tile_count = max(int(math.ceil((range_max - range_min) / step - 1e-6)), 1)
+
+		tiles = []
+		for tile_index in range(tile_count):
+			# Adjacent tiles must use identical boundary values
+			core_min = range_min + tile_index * step
+			core_max = range_min + (tile_index + 1) * step if tile_index < tile_count - 1 else range_max
+			tiles.append({'core': (core_min, core_max),
+						  'last': tile_index == tile_count - 1,
+						  'range': (max(core_min - overlap * element_size, range_min), 
+									min(core_max + overlap * element_size, range_max))
+						  })
+		dimension_tiles.append(tiles)
+
+	return [dict(zip(TILE_DIMENSIONS, tile)) for tile in [(x_tile, y_tile) for y_tile in dimension_tiles[1] for x_tile in dimension_tiles[0]]]
+
+def tile_plan(plan, tile):
+	'''
+	Return a copy of a plan with the ranges of all get_data tasks restricted to the tile read ranges
+	'''
+	plan = copy.deepcopy(plan)
+	for array_input in get_data_inputs(plan):
+		for dimension_tag in TILE_DIMENSIONS:
+			key = _get_dimension(array_input['dimensions'], dimension_tag)
+			array_input['dimensions'][key]['range'] = tile[dimension_tag]['range']
+
+	return plan
+
+def _get_core_selection(indices, tile_dimension):
+	'''
+	Return boolean array selecting the indices belonging to the core of a tile
+	'''
+	core_min, core_max = tile_dimension['core']
+	if tile_dimension['last']:
+		return (indices >= core_min) & (indices <= core_max)
+	return (indices >= core_min) & (indices < core_max)
+
+def crop_result(result, ranges):
+	'''
+	Return a result restricted to the elements whose indices are within ranges, with its output shape updated. 
+	Arrays are only copied if some elements are outside the ranges
+	Parameters:
+		result: task result from ExecutionEngine.cache
+		ranges: dict of (min, max) ranges keyed by dimension. Dimensions not in the result are ignored
+	'''
+	dimensions = result['array_dimensions']
+	selection = []
+	for dimension in dimensions:
+		indices = np.asarray(result['array_indices'][dimension])
+		key = _get_dimension(ranges, dimension.upper())
+		if key is None:
+			selection.append(np.arange(len(indices)))
+		else:
+			range_min, range_max = sorted(ranges[key])
+			selection.append(np.where((indices >= range_min) & (indices <= range_max))[0])
+
+	cropped_result = dict(result)
+	if not all(len(dimension_selection) == len(result['array_indices'][dimension]) for dimension_selection, dimension in zip(selection, dimensions)):
+		cropped_result['array_result'] = dict((variable, array[np.ix_(*selection)]) for variable, array in result['array_result'].items())
+		cropped_result['array_indices'] = dict(result['array_indices'])
+		for dimension, dimension_selection in zip(dimensions, selection):
+			cropped_result['array_indices'][dimension] = np.asarray(result['array_indices'][dimension])[dimension_selection]
+	cropped_result['array_output'] = copy.deepcopy(result['array_output'])
+	cropped_result['array_output']['shape'] = tuple(len(dimension_selection) for dimension_selection in selection)
+
+	return cropped_result
+
+def stitch_results(tile_results):
+	'''
+	Return a single result combining the results of one task executed for multiple tiles.
+	Pixels outside the core of each tile are discarded, and values missing from all tiles are set to no_data_value
+	Parameters:
+		tile_results: list of (tile, result) tuples where result is a task result from ExecutionEngine.cache
+	'''
+	first_result = tile_results[0][1]
+	dimensions = first_result['array_dimensions']
+	no_data_value = first_result['array_output']['no_data_value']
+
+	# Find selections of each tile and the union of all indices for each dimension
+	selections = []
+	result_indices = {}
+	for tile, result in tile_results:
+		selection = []
+		for dimension in dimensions:
+			indices = np.asarray(result['array_indices'][dimension])
+			if dimension.upper() in TILE_DIMENSIONS:
+				dimension_selection = np.where(_get_core_selection(indices, tile[dimension.upper()]))[0]
+			else:
+				dimension_selection = np.arange(len(indices))
+			selection.append(dimension_selection)
+			result_indices.setdefault(dimension, []).append(indices[dimension_selection])
+		selections.append(selection)
+
+	reverse_dimensions = []
+	for dimension in dimensions:
+		indices = np.asarray(first_result['array_indices'][dimension])
+		result_indices[dimension] = np.unique(np.concatenate(result_indices[dimension]))
+		if len(indices) > 1 and indices[0] > indices[-1]: # Preserve reversed indices
+			result_indices[dimension] = result_indices[dimension][::-1]
+			reverse_dimensions.append(dimension)
+
+	shape = tuple(len(result_indices[dimension]) for dimension in dimensions)
+
+	array_result = {}
+	for variable in first_result['array_result'].keys():
+		array_result[variable] = np.empty(shape, dtype=first_result['array_result'][variable].dtype)
+		array_result[variable].fill(no_data_value)
+
+	for (tile, result), selection in zip(tile_results, selections):
+		positions = []
+		for dimension, dimension_selection in zip(dimensions, selection):
+			indices = np.asarray(result['array_indices'][dimension])[dimension_selection]
+			if dimension in reverse_dimensions:
+				positions.append(len(result_indices[dimension]) - 1 - np.searchsorted(result_indices[dimension][::-1], indices))
+			else:
+				positions.append(np.searchsorted(result_indices[dimension], indices))
+
+		for variable in array_result.keys():
+			array_result[variable][np.ix_(*positions)] = result['array_result'][variable][np.ix_(*selection)]
+
+	stitched_result = {}
+	stitched_result['array_result'] = array_result
+	stitched_result['array_indices'] = copy.deepcopy(first_result['array_indices'])
+	stitched_result['array_indices'].update(result_indices)
+	stitched_result['array_dimensions'] = copy.deepcopy(dimensions)
+	stitched_result['array_output'] = copy.deepcopy(first_result['array_output'])
+	stitched_result['array_output']['shape'] = shape
+
+	return stitched_result
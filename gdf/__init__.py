@@ -43,8 +43,9 @@ import calendar
 import collections
 import numexpr
 import logging
-import cPickle
 import itertools
+import json
+import psycopg2
 from pprint import pprint
 from math import floor
 from distutils.util import strtobool
@@ -60,7 +61,9 @@ logging.root.addHandler(console_handler)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO) # Initial logging level for this module
 
-from _database import Database, CachedResultSet
+from _database import Database, CachedResultSet, StreamingResultSet, ConnectionPool
+from _storage_config import StorageConfig
+from _cache_store import CacheStore
 from _arguments import CommandLineArgs
 from _config_file import ConfigFile
 from _gdfnetcdf import GDFNetCDF
@@ -90,28 +93,43 @@ class GDF(object):
                                     'const': None, 
                                     'help': 'Cache directory for GDF operation'
                                     },
+                       'fast_start': {'short_flag': '-f', 
+                                        'long_flag': '--fast_start', 
+                                        'default': False, 
+                                        'action': 'store_const', 
+                                        'const': True,
+                                        'help': 'Flag to defer database connection testing to first use'
+                                        },
                                 }
     MAX_UNITS_IN_MEMORY = 1000 #TODO: Do something better than this
     DECIMAL_PLACES = 6
+    CACHE_SCHEMA_VERSION = 2 # Increment whenever the structure of any cached object changes
+    
+    def _cache_object(self, cached_object, cache_name, ttl=None):
+        '''
+        Function to write an object to the cache store
+        '''
+        self._cache_store.put(cache_name, cached_object, ttl)
     
-    def _cache_object(self, cached_object, cache_filename):
+    def _get_cached_object(self, cache_name, max_age=None):
         '''
-        Function to write an object to a cached pickle file
+        Function to retrieve an object from the cache store
+        Will raise a KeyError if refresh is forced or the entry is missing, expired or invalid
         '''
-        cache_file = open(os.path.join(self.cache_dir, cache_filename), 'wb')
-        cPickle.dump(cached_object, cache_file, -1)
-        cache_file.close()
+        if self.refresh: raise KeyError('Refresh forced for %s' % cache_name)
+        return self._cache_store.get(cache_name, max_age)
     
-    def _get_cached_object(self, cache_filename):
+    def _get_or_create_cached_object(self, cache_name, create_function, max_age=None):
         '''
-        Function to retrieve an object from a cached pickle file
-        Will raise a general exception if refresh is forced
+        Function to retrieve an object from the cache store, or to create and cache it if required.
+        Concurrent processes sharing cache_dir will wait for one of them to create a missing entry.
         '''
-        if self.refresh: raise Exception('Refresh Forced')
-        cache_file = open(os.path.join(self.cache_dir, cache_filename), 'r')
-        cached_object = cPickle.load(cache_file)
-        cache_file.close()
-        return cached_object
+        if self.refresh:
+            cached_object = create_function()
+            self._cache_object(cached_object, cache_name)
+            return cached_object
+        
+        return self._cache_store.get_or_create(cache_name, create_function, max_age)
     
     def _get_command_line_params(self, arg_descriptors={}):
         '''
@@ -131,20 +149,29 @@ class GDF(object):
         
         return command_line_args_object.arguments
         
-    def _get_config(self, config_files_string=None):
+    def _get_config(self, config_files_string=None, configuration=None):
         '''
         Function to return a nested dict of config file entries
-        Parameter:
-            config_files_string - comma separated list of GDF config files
+        Parameters:
+            config_files_string - comma separated list (or list) of GDF config files
+            configuration - Optional nested dict of configuration sections to use instead of config files.
+                Keyed in the same way as config file sections, with global settings in an optional 'gdf' section
         Returns: dict {<db_ref>: {<param_name>: <param_value>,... },... }
         '''
         config_dict = collections.OrderedDict() # Need to preserve order of config files
         
-        # Use default config file if none provided
-        config_files_string = config_files_string or os.path.join(self._code_root, GDF.DEFAULT_CONFIG_FILE)
+        if configuration is not None:
+            for db_ref in configuration.keys():
+                config_dict[db_ref] = dict(configuration[db_ref])
+            config_files_string = [] # Don't read any config files
+        elif not config_files_string: # Use default config file if none provided
+            config_files_string = os.path.join(self._code_root, GDF.DEFAULT_CONFIG_FILE)
+        
+        if isinstance(config_files_string, basestring):
+            config_files_string = config_files_string.split(',')
         
-        # Set list of absolute config file paths from comma-delimited list
-        self._config_files = [os.path.abspath(config_file) for config_file in config_files_string.split(',')] 
+        # Set list of absolute config file paths
+        self._config_files = [os.path.abspath(config_file) for config_file in config_files_string] 
         log_multiline(logger.debug, self._config_files, 'self._config_files', '\t')
            
         for config_file in self._config_files:
@@ -158,40 +185,64 @@ class GDF(object):
                     config_dict[db_ref] = config_file_object.configuration[db_ref]
                     
         # Set variables from global config and remove global config from result dict
-        for key, value in config_dict['gdf'].items():
+        for key, value in config_dict.pop('gdf', {}).items():
             self.__setattr__(key, value)
             logger.debug('self.%s = %s', key, value)
-        del config_dict['gdf']
         
         log_multiline(logger.debug, config_dict, 'config_dict', '\t')
         return config_dict
     
-    def _get_dbs(self):
+    def _get_db_params(self):
         '''
-        Function to return an ordered dict of database objects keyed by db_ref
+        Function to return an ordered dict of plain connection parameter dicts keyed by db_ref for all valid configurations
         '''
-        database_dict = collections.OrderedDict()
+        db_params_dict = collections.OrderedDict()
         
-        # Create a database connection for every valid configuration
         for db_ref in self._configuration.keys():
             db_dict = self._configuration[db_ref]
             try:
-                host = db_dict['host']
-                port = db_dict['port']
-                dbname = db_dict['dbname']
-                user = db_dict['user']
-                password = db_dict['password']
+                db_params_dict[db_ref] = {'host': db_dict['host'],
+                                          'port': db_dict['port'],
+                                          'dbname': db_dict['dbname'],
+                                          'user': db_dict['user'],
+                                          'password': db_dict['password'],
+                                          # Optional connection pool settings
+                                          'pool_min_connections': int(db_dict.get('pool_min_connections') or 1),
+                                          'pool_max_connections': int(db_dict.get('pool_max_connections') or 4),
+                                          'pool_idle_timeout': int(db_dict.get('pool_idle_timeout') or 300),
+                                          # Optional number of records per batch for streaming queries
+                                          'itersize': int(db_dict.get('itersize') or 2000)
+                                          }
+            except Exception, e:
+                logger.warning('Invalid database configuration for %s: %s', db_ref, e.message)
                 
+        return db_params_dict
+    
+    def _get_dbs(self, db_params_dict=None, probe=True):
+        '''
+        Function to return an ordered dict of database objects keyed by db_ref
+        
+        Parameters:
+            db_params_dict: Ordered dict of connection parameter dicts keyed by db_ref as returned by _get_db_params.
+                Defaults to all configured databases
+            probe: Boolean flag indicating whether to test each database connection and omit unreachable databases.
+                No connections are made if False
+        '''
+        if db_params_dict is None:
+            db_params_dict = self._get_db_params()
+            
+        database_dict = collections.OrderedDict()
+        
+        # Create a database object for every valid configuration
+        for db_ref, db_params in db_params_dict.items():
+            try:
                 database = Database(db_ref=db_ref,
-                                    host=host, 
-                                    port=port, 
-                                    dbname=dbname, 
-                                    user=user, 
-                                    password=password, 
-                                    keep_connection=False, # Assume we don't want connections hanging around
-                                    autocommit=True)
+                                    keep_connection=False, # Queries use pooled connections instead
+                                    autocommit=True,
+                                    **db_params)
                 
-                database.submit_query('select 1 as test_field') # Test DB connection
+                if probe:
+                    database.submit_query('select 1 as test_field') # Test DB connection
                 
                 database_dict[db_ref] = database
             except Exception, e:
@@ -199,26 +250,112 @@ class GDF(object):
 
         log_multiline(logger.debug, database_dict, 'database_dict', '\t')
         return database_dict
+    
+    def _get_reachable_db_params(self):
+        '''
+        Function to return an ordered dict of connection parameter dicts keyed by db_ref for databases which accept connections
+        '''
+        db_params_dict = self._get_db_params()
+        database_dict = self._get_dbs(db_params_dict)
+        for database in database_dict.values():
+            database.close()
+            
+        return collections.OrderedDict([(db_ref, db_params) for db_ref, db_params in db_params_dict.items() 
+                                        if db_ref in database_dict])
+        
+    def _drop_database(self, db_ref, reason):
+        '''
+        Function to remove an unreachable database from the database dict after a deferred connection failure
+        '''
+        database = self._databases.pop(db_ref, None)
+        if database is not None:
+            logger.warning('Unable to connect to database for %s: %s', db_ref, reason)
+            database.close()
+        
+        # Don't trust cached connection parameters which include this database
+        if getattr(self, '_cache_store', None) is not None:
+            self._cache_store.invalidate('databases')
+            
+    def _get_checked_databases(self, db_refs=None):
+        '''
+        Function to return a dict of Database objects keyed by db_ref, testing the connections of any databases 
+        deferred in fast start mode on their first use. Databases which refuse connections are dropped
+        
+        Parameter:
+            db_refs: Optional list of db_refs of the required databases. Defaults to all databases
+        '''
+        def check_db_connection(database, result_dict):
+            '''
+            Function to test the connection to a single database. Only connection failures are recorded - 
+            any other error is raised
+            '''
+            try:
+                database.submit_query('select 1 as test_field')
+                result_dict[database.db_ref] = None
+            except psycopg2.OperationalError, e:
+                result_dict[database.db_ref] = e
+            
+        if db_refs is None:
+            db_refs = self._databases.keys()
+        
+        if getattr(self, '_unchecked_db_refs', None):
+            with self._database_lock:
+                unchecked_databases = {db_ref: self._databases[db_ref] for db_ref in db_refs 
+                                       if db_ref in self._unchecked_db_refs and db_ref in self._databases}
+                if unchecked_databases:
+                    check_dict = self._do_db_query(unchecked_databases, [check_db_connection])
+                    for db_ref, error in check_dict.items():
+                        if error is not None:
+                            self._drop_database(db_ref, error.message)
+                        self._unchecked_db_refs.discard(db_ref)
         
+        return collections.OrderedDict([(db_ref, database) for db_ref, database in self._databases.items() if db_ref in db_refs])
 
-    def __init__(self):
-        '''Constructor for class GDF
+    @classmethod
+    def from_command_line(cls, arg_descriptors=None):
+        '''
+        Function to return a GDF object configured from command line arguments. 
+        This should only be called from __main__ entry points because it parses sys.argv
+        
+        Parameter:
+            arg_descriptors: Optional dict of argument descriptors. Defaults to GDF.ARG_DESCRIPTORS
+        '''
+        command_line_params = CommandLineArgs(arg_descriptors or cls.ARG_DESCRIPTORS).arguments
+        
+        gdf = cls(config_files=command_line_params['config_files'],
+                  cache_dir=command_line_params['cache_dir'],
+                  refresh=command_line_params['refresh'],
+                  debug=command_line_params['debug'],
+                  fast_start=command_line_params['fast_start'])
+        gdf._command_line_params = command_line_params
+        return gdf
+
+    def __init__(self, config_files=None, configuration=None, cache_dir=None, refresh=False, debug=False, fast_start=False):
+        '''Constructor for class GDF. Command line arguments are not read - use GDF.from_command_line() for that.
+        
+        Parameters:
+            config_files: Optional comma separated string or list of GDF config file paths. Defaults to gdf_default.conf
+            configuration: Optional nested dict of configuration sections to use instead of config files, 
+                e.g. {'gdf': {'cache_dir': <cache_dir>}, <db_ref>: {'host': <host>, 'port': <port>, ...}, ...}
+            cache_dir: Optional cache directory overriding the configured value
+            refresh: Flag to force refreshing of cached config
+            debug: Debug mode flag
+            fast_start: Flag to defer database connection testing to first use
         '''
         self._config_files = [] # List of config files read
         
         self._code_root = os.path.abspath(os.path.dirname(__file__)) # Directory containing module code
         
-        # Create master configuration dict containing both command line and config_file parameters
-        self._command_line_params = self._get_command_line_params(GDF.ARG_DESCRIPTORS)
+        self._command_line_params = {} # Only set for objects created with from_command_line()
         
         self._debug = False
-        self.debug = self._command_line_params['debug']
+        self.debug = debug
                 
-        # Create master configuration dict containing both command line and config_file parameters
-        self._configuration = self._get_config(self._command_line_params['config_files'])       
+        # Create master configuration dict from config files or supplied configuration
+        self._configuration = self._get_config(config_files, configuration)       
         
-        self.cache_dir = self._command_line_params['cache_dir'] or self.cache_dir        
-        if not directory_writable(self.cache_dir):
+        self.cache_dir = cache_dir or getattr(self, 'cache_dir', None)
+        if not (self.cache_dir and directory_writable(self.cache_dir)):
             new_cache_dir = os.path.join(os.path.expanduser("~"), 'gdf', 'cache')
             logger.warning('Unable to access cache directory %s. Using %s instead.', self.cache_dir, new_cache_dir)
             self.cache_dir = new_cache_dir
@@ -226,36 +363,52 @@ class GDF(object):
                 raise Exception('Unable to write to cache directory %s', self.cache_dir)
                     
         # Convert self.refresh to Boolean
-        self.refresh = self.debug or strtobool(self.refresh)
+        self.refresh = refresh or self.debug or strtobool(str(getattr(self, 'refresh', False)))
         
-        # Force refresh if config has changed
-        try:
-            cached_config = self._get_cached_object('configuration.pkl')
-            self.refresh = self.refresh or (self._configuration != cached_config) 
-        except:
-            self.refresh = True
+        # Fast start defers database connection testing to first use
+        self.fast_start = fast_start or strtobool(str(getattr(self, 'fast_start', False)))
+        
+        # Optional maximum age in seconds for cached storage configuration
+        self.storage_config_ttl = getattr(self, 'storage_config_ttl', None)
+        if self.storage_config_ttl is not None:
+            self.storage_config_ttl = float(self.storage_config_ttl)
+        
+        self._cache_store = CacheStore(self.cache_dir, GDF.CACHE_SCHEMA_VERSION)
+        
+        # Discard all cached data if config has changed. Only the first process to notice the change does this
+        with self._cache_store.lock('configuration'):
+            try:
+                config_changed = (self._configuration != self._cache_store.get('configuration'))
+            except KeyError:
+                config_changed = True
+                
+            if config_changed:
+                self._cache_store.clear()
+                self._cache_store.put('configuration', self._configuration)
+                logger.info('Configuration changed. Discarded all cached data')
         
         if self.refresh:
-            self._cache_object(self._configuration, 'configuration.pkl')
             logger.info('Forcing refresh of all cached data')
         
-        # Create master database dict with Database objects keyed by db_ref
-        try:           
-            self._databases = self._get_cached_object('databases.pkl')
-            logger.info('Loaded cached database configuration %s', self._databases.keys())
-        except:
-            self._databases = self._get_dbs()
-            self._cache_object(self._databases, 'databases.pkl')      
+        # Create master database dict with Database objects keyed by db_ref. 
+        # Only plain connection parameters for reachable databases are cached
+        self._database_lock = threading.Lock()
+        if self.fast_start:
+            try:
+                self._databases = self._get_dbs(self._get_cached_object('databases'), probe=False)
+                logger.info('Loaded cached database configuration %s', self._databases.keys())
+            except KeyError:
+                # Unreachable databases will be dropped when first queried
+                self._databases = self._get_dbs(probe=False)
+                logger.info('Deferred connection to databases %s', self._databases.keys())
+            # Connections are tested on first use of each database
+            self._unchecked_db_refs = set(self._databases.keys())
+        else:
+            self._databases = self._get_dbs(self._get_or_create_cached_object('databases', self._get_reachable_db_params), probe=False)
             logger.info('Connected to databases %s', self._databases.keys())
         
-        # Read storage configuration from cache or databases
-        try:           
-            self._storage_config = self._get_cached_object('storage_config.pkl')
-            logger.info('Loaded cached storage configuration %s', self._storage_config.keys())
-        except:
-            self._storage_config = self._get_storage_config()
-            self._cache_object(self._storage_config, 'storage_config.pkl')
-            logger.info('Read storage configuration from databases %s', self._storage_config.keys())
+        # Storage configuration is read from cache or databases per storage type on first use
+        self._storage_config = StorageConfig(self)
             
         log_multiline(logger.debug, self.__dict__, 'GDF.__dict__', '\t')
 
@@ -387,9 +540,103 @@ class GDF(object):
         log_multiline(logger.debug, result_dict, 'result_dict', '\t')
         return result_dict
 
-    def _get_storage_config(self):
+    def _get_storage_type_index(self):
+        '''
+        Function to return an ordered dict of db_refs keyed by storage_type_tag for all storage types managed in databases.
+        This is much cheaper than _get_storage_config and is used to decide which database to query for a storage type.
+        Duplicate storage types are resolved in config file order as for _get_storage_config.
         '''
-        Function to return a dict with details of all storage unit types managed in databases keyed as follows:
+        def get_db_storage_types(database, result_dict):
+            '''
+            Function to return a list of storage_type_tags managed in a single database
+            
+            Parameters:
+                database: gdf.database object against which to run the query
+                result_dict: dict to contain the result
+            '''
+            try:
+                storage_type_filter_list = self._configuration[database.db_ref]['storage_types'].split(',')
+            except:
+                storage_type_filter_list = None
+            logger.debug('storage_type_filter_list = %s', storage_type_filter_list)
+            
+            SQL = '''-- Query to return all complete storage types for database %s
+select storage_type_tag
+from storage_type
+where exists (select 1 from storage_type_measurement_type where storage_type_measurement_type.storage_type_id = storage_type.storage_type_id)
+and exists (select 1 from storage_type_dimension where storage_type_dimension.storage_type_id = storage_type.storage_type_id)
+''' % database.db_ref
+
+            # Apply storage_type filter if configured
+            if storage_type_filter_list:
+                SQL += "and storage_type_tag in ('" + "', '".join(storage_type_filter_list) + "')"
+                
+            SQL += '''
+order by storage_type_tag;
+'''
+            try:
+                storage_type_results = database.submit_query(SQL)
+            except psycopg2.OperationalError, e:
+                # Allow for databases becoming unreachable after their connections were tested
+                result_dict[database.db_ref] = e
+                return
+            
+            result_dict[database.db_ref] = storage_type_results.field_arrays['storage_type_tag'].tolist()
+            # End of per-DB function
+
+        storage_type_dict = self._do_db_query(self.databases, [get_db_storage_types])
+        
+        for db_ref in storage_type_dict.keys():
+            if isinstance(storage_type_dict[db_ref], Exception):
+                self._drop_database(db_ref, storage_type_dict.pop(db_ref).message)
+        
+        # Filter out duplicate storage unit types. Only keep first definition
+        storage_type_index = collections.OrderedDict()
+        for db_ref in self._configuration.keys():
+            for storage_type in storage_type_dict.get(db_ref) or []:
+                if storage_type in storage_type_index:
+                    logger.warning('Ignored duplicate storage unit type "%s" in DB "%s"' % (storage_type, db_ref))
+                else:
+                    storage_type_index[storage_type] = db_ref
+        return storage_type_index
+
+    def _get_flag_definitions(self, db_ref):
+        '''
+        Function to return a dict of bit flag definitions keyed by storage_type_tag and measurement_type_tag, read from 
+        the JSON file named by the optional flag_definitions setting of the database configuration.
+        See analytics_utils.get_flag_mask for the structure of a flag definition
+        '''
+        flag_definitions_path = self._configuration.get(db_ref, {}).get('flag_definitions')
+        if not flag_definitions_path:
+            return {}
+        
+        try:
+            flag_definitions_file = open(os.path.expanduser(flag_definitions_path))
+            try:
+                return json.load(flag_definitions_file)
+            finally:
+                flag_definitions_file.close()
+        except (IOError, ValueError), e:
+            logger.warning('Unable to read flag definitions for %s from %s: %s', db_ref, flag_definitions_path, e)
+            return {}
+    
+    def _get_flag_definitions_mtime(self, db_ref):
+        '''
+        Function to return the modification time of the flag_definitions file for the specified database, or None if 
+        no file is configured or it cannot be read. Used to invalidate cached storage configurations when the file changes
+        '''
+        flag_definitions_path = self._configuration.get(db_ref, {}).get('flag_definitions')
+        if not flag_definitions_path:
+            return None
+        
+        try:
+            return os.path.getmtime(os.path.expanduser(flag_definitions_path))
+        except OSError:
+            return None
+    
+    def _get_storage_config(self, storage_types=None):
+        '''
+        Function to return a dict with details of storage unit types managed in databases keyed as follows:
           
         Returns: Dict keyed as follows:
           
@@ -400,6 +647,7 @@ class GDF(object):
                     <measurement_type_tag>: {
                         <measurement_type_attribute_name>: <measurement_type_attribute_value>,
                         ...
+                        'flag_definition': <optional bit flag definition from the flag_definitions file>
                         }
                     ...
                     }
@@ -419,6 +667,9 @@ class GDF(object):
                 }
             ...
             }
+            
+        Parameter:
+            storage_types: Optional list of storage_type_tags to retrieve. Defaults to all configured storage types
         '''
         def get_db_storage_config(database, result_dict):
             '''
@@ -433,10 +684,15 @@ class GDF(object):
             '''
             db_storage_config_dict = collections.OrderedDict()
             
-            try:
-                storage_type_filter_list = self._configuration[database.db_ref]['storage_types'].split(',')
-            except:
-                storage_type_filter_list = None
+            if storage_types is None:
+                try:
+                    storage_type_filter_list = self._configuration[database.db_ref]['storage_types'].split(',')
+                except:
+                    storage_type_filter_list = None
+            else:
+                # Only retrieve requested storage types managed by this database
+                storage_type_filter_list = [storage_type for storage_type in storage_types 
+                                            if self._storage_config.get_db_ref(storage_type) == database.db_ref]
             logger.debug('storage_type_filter_list = %s', storage_type_filter_list)
               
             SQL = '''-- Query to return all storage_type configuration info for database %s
@@ -504,6 +760,7 @@ left join property using(property_id)
 '''
 
             storage_config_results = database.submit_query(SQL)
+            flag_definitions = self._get_flag_definitions(database.db_ref)
             
             for record in storage_config_results.record_generator():
                 log_multiline(logger.debug, record, 'record', '\t')
@@ -534,7 +791,8 @@ left join property using(property_id)
                                                'datatype_name': record['datatype_name'],
                                                'numpy_datatype_name': record['numpy_datatype_name'],
                                                'gdal_datatype_name': record['gdal_datatype_name'],
-                                               'netcdf_datatype_name': record['netcdf_datatype_name']
+                                               'netcdf_datatype_name': record['netcdf_datatype_name'],
+                                               'flag_definition': flag_definitions.get(record['storage_type_tag'], {}).get(record['measurement_type_tag'])
                                                }
     
                     storage_type_dict['measurement_types'][record['measurement_type_tag']] = measurement_type_dict
@@ -612,24 +870,33 @@ join dimension using(dimension_id)
 group by 1,2,3
 order by 1,2           
 '''
-            min_max_results = database.submit_query(SQL)
-            for record in min_max_results.record_generator():
-                logger.debug('record = %s', record)
-                storage_type_dict = db_storage_config_dict.get(record['storage_type_tag'])
+            min_max_arrays = database.submit_query(SQL).field_arrays
+            # Iterate through the column arrays rather than building a dict for each record
+            for storage_type_tag, dimension_tag, min_index, max_index, min_value, max_value in zip(*[min_max_arrays[field_name].tolist() 
+                                                                                                    for field_name in ['storage_type_tag', 'dimension_tag', 
+                                                                                                                       'min_index', 'max_index', 
+                                                                                                                       'min_value', 'max_value']]):
+                storage_type_dict = db_storage_config_dict.get(storage_type_tag)
                 logger.debug('storage_type_dict = %s', storage_type_dict)
                 if storage_type_dict:
-                    dimension_dict = storage_type_dict['dimensions'].get(record['dimension_tag'])
+                    dimension_dict = storage_type_dict['dimensions'].get(dimension_tag)
                     if True: #dimension_dict:
-                        dimension_dict['min_index'] = record['min_index']
-                        dimension_dict['max_index'] = record['max_index']
-                        dimension_dict['min_value'] = record['min_value']
-                        dimension_dict['max_value'] = record['max_value']
+                        dimension_dict['min_index'] = min_index
+                        dimension_dict['max_index'] = max_index
+                        dimension_dict['min_value'] = min_value
+                        dimension_dict['max_value'] = max_value
                         
     #            log_multiline(logger.info, db_dict, 'db_dict', '\t')
             result_dict[database.db_ref] = db_storage_config_dict
             # End of per-DB function
 
-        storage_config_dict = self._do_db_query(self.databases, [get_db_storage_config])
+        if storage_types is None:
+            databases = self.databases
+        else:
+            db_refs = set([self._storage_config.get_db_ref(storage_type) for storage_type in storage_types])
+            databases = self._get_checked_databases(db_refs)
+            
+        storage_config_dict = self._do_db_query(databases, [get_db_storage_config])
         
         # Filter out duplicate storage unit types. Only keep first definition
         filtered_storage_config_dict = {}
@@ -727,7 +994,11 @@ order by 1,2
     
     @property
     def databases(self):
-        return self._databases
+        return self._get_checked_databases()
+    
+    @property
+    def cache_store(self):
+        return self._cache_store
 
     @property
     def storage_config(self):
@@ -922,16 +1193,12 @@ query_parameter = \
             logger.debug('update_storage_units_descriptor() called')
             logger.debug('storage_types = %s', storage_types)
             
-            for storage_config in self._storage_config.values():
+            for storage_type in (storage_types or self._storage_config.keys()):
                 # Disregard all storage types not in this DB
-                if storage_config['db_ref'] != database.db_ref:
+                if self._storage_config.get_db_ref(storage_type) != database.db_ref:
                     continue
                 
-                storage_type = storage_config['storage_type_tag']
-                
-                # Skip any storage_types if they are not in the specified list
-                if storage_types and (storage_type not in storage_types):
-                    continue
+                storage_config = self._storage_config[storage_type]
                 
                 logger.debug('storage_type = %s', storage_type)
                 
@@ -1014,7 +1281,8 @@ order by ''' + '_index, '.join(storage_type_dimensions) + '''_index, slice_index
 '''            
                 log_multiline(logger.debug, SQL , 'SQL', '\t')
     
-                slice_result_set = database.submit_query(SQL)
+                # Stream slice records from a server-side cursor - they are only needed once, in order
+                slice_result_set = database.stream_query(SQL)
                 
                 storage_units_descriptor = {} # Dict to hold all storage unit descriptors for this storage type
                 
@@ -1035,39 +1303,55 @@ order by ''' + '_index, '.join(storage_type_dimensions) + '''_index, slice_index
                 overall_slice_group_set = set()
                 
                 storage_index_tuple = None
-                # Iterate through all records once only
-                for record_dict in slice_result_set.record_generator({'slice_group_value': slice_grouping_function}):
-                    logger.debug('record_dict = %s', record_dict)
-                    new_storage_index_tuple = tuple([record_dict[dimension_tag.lower() + '_index'] 
-                                                 for dimension_tag in storage_type_dimensions])
+                # Iterate through all records once only, a batch of field arrays at a time
+                for field_arrays in slice_result_set.array_generator({'slice_group_value': slice_grouping_function}):
+                    index_arrays = [field_arrays[dimension_tag.lower() + '_index'] for dimension_tag in storage_type_dimensions]
+                    record_count = len(index_arrays[0])
                     
-                    if new_storage_index_tuple != storage_index_tuple: # Change in storage unit                        
-                        update_storage_units_descriptor(storage_index_tuple,
-                                                storage_type_dimensions,
-                                                regular_storage_type_dimensions,
-                                                fixed_storage_type_dimensions,
-                                                storage_min_dict,
-                                                overall_min_dict,
-                                                storage_max_dict,
-                                                overall_max_dict,
-                                                storage_shape_dict,
-                                                storage_slice_group_set,
-                                                overall_slice_group_set,
-                                                storage_units_descriptor
-                                                )
-                            
-                        # Re-initialise max & min dicts for new storage unit
-                        storage_min_dict = {dimension: sys.maxint for dimension in storage_type_dimensions}
-                        storage_max_dict = {dimension: -sys.maxint-1 for dimension in storage_type_dimensions}
-                        storage_slice_group_set = set()
-                        storage_index_tuple = new_storage_index_tuple
+                    # Find the records at which the storage unit changes (records are ordered by storage unit)
+                    unit_changes = np.zeros(record_count, dtype=np.bool)
+                    unit_changes[0] = tuple([index_array[0] for index_array in index_arrays]) != storage_index_tuple
+                    for index_array in index_arrays:
+                        unit_changes[1:] |= (index_array[1:] != index_array[:-1])
                     
-                    # Do the following for every record
-                    storage_slice_group_set.add(record_dict['slice_group_value'])
-                    # Update min & max values
-                    for dimension in regular_storage_type_dimensions:
-                        storage_min_dict[dimension] = min(storage_min_dict[dimension], record_dict['%s_min' % dimension.lower()])
-                        storage_max_dict[dimension] = max(storage_max_dict[dimension], record_dict['%s_max' % dimension.lower()])
+                    # Records of the first group continue the current storage unit unless it changes at the first record
+                    group_starts = np.union1d([0], np.flatnonzero(unit_changes))
+                    group_ends = np.append(group_starts[1:], record_count)
+                    
+                    # Reduce min & max values of all groups at once
+                    group_min_dict = {dimension: np.minimum.reduceat(field_arrays['%s_min' % dimension.lower()], group_starts).tolist() 
+                                      for dimension in regular_storage_type_dimensions}
+                    group_max_dict = {dimension: np.maximum.reduceat(field_arrays['%s_max' % dimension.lower()], group_starts).tolist() 
+                                      for dimension in regular_storage_type_dimensions}
+                    
+                    for group_index, (group_start, group_end) in enumerate(zip(group_starts, group_ends)):
+                        if unit_changes[group_start]: # Change in storage unit                        
+                            update_storage_units_descriptor(storage_index_tuple,
+                                                    storage_type_dimensions,
+                                                    regular_storage_type_dimensions,
+                                                    fixed_storage_type_dimensions,
+                                                    storage_min_dict,
+                                                    overall_min_dict,
+                                                    storage_max_dict,
+                                                    overall_max_dict,
+                                                    storage_shape_dict,
+                                                    storage_slice_group_set,
+                                                    overall_slice_group_set,
+                                                    storage_units_descriptor
+                                                    )
+                                
+                            # Re-initialise max & min dicts for new storage unit
+                            storage_min_dict = {dimension: sys.maxint for dimension in storage_type_dimensions}
+                            storage_max_dict = {dimension: -sys.maxint-1 for dimension in storage_type_dimensions}
+                            storage_slice_group_set = set()
+                            storage_index_tuple = tuple([index_array[group_start:group_start + 1].tolist()[0] for index_array in index_arrays])
+                            logger.debug('storage_index_tuple = %s', storage_index_tuple)
+                        
+                        storage_slice_group_set.update(field_arrays['slice_group_value'][group_start:group_end].tolist())
+                        # Update min & max values
+                        for dimension in regular_storage_type_dimensions:
+                            storage_min_dict[dimension] = min(storage_min_dict[dimension], group_min_dict[dimension][group_index])
+                            storage_max_dict[dimension] = max(storage_max_dict[dimension], group_max_dict[dimension][group_index])
                     
                 # All records processed - write last descriptor
                 update_storage_units_descriptor(storage_index_tuple,
@@ -1121,12 +1405,15 @@ order by ''' + '_index, '.join(storage_type_dimensions) + '''_index, slice_index
             dimension_range_dict = {}
 
         try:
-            storage_types = [storage_type.upper() for storage_type in query_parameter['storage_types'] if storage_type in self._storage_config.keys()]
+            storage_types = [storage_type.upper() for storage_type in query_parameter['storage_types'] if storage_type.upper() in self._storage_config]
         except KeyError:
             try:
                 storage_types = [query_parameter['storage_type'].upper()] # Check for single storage type
             except KeyError:
                 storage_types = self._storage_config.keys()
+                
+        # Read configurations for all required storage types together before starting per-DB threads
+        self._storage_config.load(storage_types)
             
         # Make self.solar_days_since_epoch the default grouping function for T
         #TODO: Make this more general for all irregular dimensions
@@ -1139,7 +1426,7 @@ order by ''' + '_index, '.join(storage_type_dimensions) + '''_index, slice_index
                 slice_grouping_function = self.solar_days_since_epoch
             
         
-        return self._do_db_query({db_ref: self.databases[db_ref] for db_ref in sorted(set([self._storage_config[storage_type]['db_ref'] for storage_type in storage_types]))},
+        return self._do_db_query(self._get_checked_databases(sorted(set([self._storage_config.get_db_ref(storage_type) for storage_type in storage_types]))),
                                  [get_db_descriptors, 
                                   dimension_range_dict, 
                                   'T', 
@@ -1451,7 +1738,30 @@ order by ''' + '_index, '.join(storage_type_dimensions) + '''_index, slice_index
         logger.debug('Result size = %s', tuple(len(result_array_indices[dimension]) for dimension in dimensions))
         
         return result_dict
-         
-         
-        
-        
+
+
+_shared_gdf = None # Process-wide GDF instance returned by get_shared_gdf()
+_shared_gdf_lock = threading.Lock()
+
+def get_shared_gdf():
+    '''
+    Function to return the process-wide GDF instance, creating it on first use.
+    Allows Analytics, ExecutionEngine and other clients in one process to share configuration, 
+    database connection pools and cached storage configuration
+    '''
+    global _shared_gdf
+    with _shared_gdf_lock:
+        if _shared_gdf is None:
+            _shared_gdf = GDF()
+        return _shared_gdf
+
+def set_shared_gdf(gdf):
+    '''
+    Function to set the process-wide GDF instance returned by get_shared_gdf(). 
+    
+    Parameter:
+        gdf: GDF object to share, or None to create a new instance on next use
+    '''
+    global _shared_gdf
+    with _shared_gdf_lock:
+        _shared_gdf = gdf
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+'''
+
+import os
+import errno
+import time
+import tempfile
+import logging
+import cPickle
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Locking is not available on this platform
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO) # Logging level for this module
+
+class CacheStore(object):
+    '''
+    Class CacheStore to manage named objects cached on disk in a directory which may be shared between processes.
+    Entries are written to a temporary file and atomically renamed into place so readers never see partial files.
+    Each entry has a header containing format and schema versions, creation time and optional expiry time.
+    '''
+    FORMAT_VERSION = 1 # Version of the on-disk entry layout
+    FILE_EXTENSION = '.cache'
+    LOCK_EXTENSION = '.lock'
+    
+    def __init__(self, cache_dir, schema_version=0, default_ttl=None):
+        '''Constructor for class CacheStore
+        
+        Parameters:
+            cache_dir: Directory in which to store cache entries. Must be writable
+            schema_version: Version of the cached object structures. Entries written with a different version are ignored
+            default_ttl: Default time to live in seconds for new entries. None means entries never expire
+        '''
+        self._cache_dir = cache_dir
+        self._schema_version = schema_version
+        self._default_ttl = default_ttl
+        
+    def _get_path(self, name, extension=None):
+        '''
+        Function to return the file path for the named entry
+        '''
+        return os.path.join(self._cache_dir, name + (extension or CacheStore.FILE_EXTENSION))
+    
+    def get(self, name, max_age=None):
+        '''
+        Function to return the named cached object. 
+        Raises KeyError if the entry is missing, unreadable, expired or written with a different version
+        
+        Parameters:
+            name: Name of cache entry
+            max_age: Optional maximum age in seconds of the entry
+        '''
+        try:
+            cache_file = open(self._get_path(name), 'rb')
+        except IOError:
+            raise KeyError(name)
+        
+        try:
+            unpickler = cPickle.Unpickler(cache_file)
+            header = unpickler.load()
+            
+            # Check header before reading object
+            if (not isinstance(header, dict) 
+                or header.get('format_version') != CacheStore.FORMAT_VERSION 
+                or header.get('schema_version') != self._schema_version):
+                logger.debug('Ignoring cache entry %s with incompatible version', name)
+                raise KeyError(name)
+            
+            now = time.time()
+            if header['expires'] is not None and now >= header['expires']:
+                logger.debug('Ignoring expired cache entry %s', name)
+                raise KeyError(name)
+            
+            if max_age is not None and now - header['created'] >= max_age:
+                logger.debug('Ignoring cache entry %s older than %ss', name, max_age)
+                raise KeyError(name)
+            
+            return unpickler.load()
+        except KeyError:
+            raise
+        except Exception, e:
+            logger.warning('Unable to read cache entry %s: %s', name, e)
+            raise KeyError(name)
+        finally:
+            cache_file.close()
+        
+    def put(self, name, cached_object, ttl=None):
+        '''
+        Function to atomically write an object to the named cache entry
+        
+        Parameters:
+            name: Name of cache entry
+            cached_object: Picklable object to cache
+            ttl: Optional time to live in seconds. Defaults to default_ttl for this store
+        '''
+        ttl = ttl if ttl is not None else self._default_ttl
+        created = time.time()
+        header = {'format_version': CacheStore.FORMAT_VERSION,
+                  'schema_version': self._schema_version,
+                  'created': created,
+                  'expires': created + ttl if ttl is not None else None
+                  }
+        
+        # Temporary file must be in the same directory (and filesystem) for rename to be atomic
+        temp_fd, temp_path = tempfile.mkstemp(prefix='.' + name + '.', dir=self._cache_dir)
+        try:
+            os.chmod(temp_path, 0644) # mkstemp creates files readable only by owner
+            temp_file = os.fdopen(temp_fd, 'wb')
+            try:
+                pickler = cPickle.Pickler(temp_file, cPickle.HIGHEST_PROTOCOL)
+                pickler.dump(header)
+                pickler.dump(cached_object)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            finally:
+                temp_file.close()
+                
+            os.rename(temp_path, self._get_path(name))
+            logger.debug('Wrote cache entry %s', name)
+        except:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        
+    def invalidate(self, name):
+        '''
+        Function to remove the named cache entry if it exists
+        '''
+        try:
+            os.remove(self._get_path(name))
+            logger.debug('Invalidated cache entry %s', name)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+    
+    def clear(self):
+        '''
+        Function to remove all cache entries
+        '''
+        for filename in os.listdir(self._cache_dir):
+            if filename.endswith(CacheStore.FILE_EXTENSION) and not filename.startswith('.'):
+                self.invalidate(filename[:-len(CacheStore.FILE_EXTENSION)])
+    
+    @contextmanager
+    def lock(self, name):
+        '''
+        Context manager to hold an exclusive inter-process lock for the named entry.
+        The entry itself is never locked so readers are not blocked.
+        '''
+        if fcntl is None:
+            yield
+            return
+        
+        lock_file = open(self._get_path(name, CacheStore.LOCK_EXTENSION), 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
+    
+    def get_or_create(self, name, create_function, max_age=None, ttl=None):
+        '''
+        Function to return the named cached object, calling create_function to create and cache it if required.
+        Only one process creates a missing entry at a time. Other processes wait and then read the new entry.
+        
+        Parameters:
+            name: Name of cache entry
+            create_function: Function taking no arguments which returns the object to cache
+            max_age: Optional maximum age in seconds of an existing entry
+            ttl: Optional time to live in seconds for a new entry
+        '''
+        try:
+            return self.get(name, max_age)
+        except KeyError:
+            pass
+        
+        with self.lock(name):
+            # Another process may have created the entry while we were waiting for the lock
+            try:
+                return self.get(name, max_age)
+            except KeyError:
+                pass
+            
+            cached_object = create_function()
+            self.put(name, cached_object, ttl)
+            return cached_object
+        
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+    
+    @property
+    def schema_version(self):
+        return self._schema_version
+    
+    @property
+    def default_ttl(self):
+        return self._default_ttl
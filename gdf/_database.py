@@ -34,7 +34,12 @@ Created on 12/03/2015
 '''
 
 import sys
+import time
+import threading
+import itertools
+import uuid
 import logging
+import numpy as np
 import psycopg2
 
 from _gdfutils import log_multiline
@@ -43,14 +48,47 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO) # Logging level for this module
 
 class CachedResultSet(object):
-    '''Class CachedResultSet to manage an in-memory cache of query results
+    '''Class CachedResultSet to manage an in-memory columnar cache of query results
     '''
+    FETCH_SIZE = 10000 # Number of records to retrieve from the cursor in each batch
+    
+    # numpy dtypes for PostgreSQL type OIDs which can be stored in typed arrays. All other types are stored as objects
+    NUMPY_DTYPES = {16: np.bool_, # bool
+                    20: np.int64, # int8
+                    21: np.int16, # int2
+                    23: np.int32, # int4
+                    26: np.int64, # oid
+                    700: np.float64, # float4 (psycopg2 returns double precision values)
+                    701: np.float64 # float8
+                    }
+    
+    @staticmethod
+    def _column_array(column_values, dtype=None):
+        '''Function to return a one-dimensional numpy array for a list of column values
+        Columns containing NULLs or values without a numeric representation are stored in object arrays
+        '''
+        if isinstance(column_values, np.ndarray) and column_values.ndim == 1:
+            return column_values
+        
+        column_values = list(column_values)
+        if None not in column_values:
+            if dtype is not None:
+                return np.array(column_values, dtype=dtype)
+            
+            column_array = np.array(column_values)
+            if column_array.ndim == 1 and column_array.dtype.kind in 'biuf':
+                return column_array
+            
+        column_array = np.empty(len(column_values), dtype=object)
+        column_array[:] = column_values
+        return column_array
+        
     def __init__(self, cursor): 
         '''Constructor for class CachedResultSet
         
         Parameter:
             cursor: psycopg2 cursor object through which the result set from a previously executed query will be retrieved 
-            Stores values in lists to avoid duplicating field names in dicts
+            Records are fetched in batches and stored as one numpy array per field to avoid per-record overhead
         '''
         if cursor.description is None: # No fields returned            
             self._field_names = []
@@ -59,15 +97,38 @@ class CachedResultSet(object):
         else:
             self._field_names = [field_descriptor[0] for field_descriptor in cursor.description]
             
-            self._result_dict = {field_name: [] for field_name in self._field_names}
+            column_lists = [[] for _field_name in self._field_names]
             
-            for record in cursor:
-                for field_index in range(len(record)):
-                    self._result_dict[self._field_names[field_index]].append(record[field_index])
+            records = cursor.fetchmany(CachedResultSet.FETCH_SIZE)
+            while records:
+                # Transpose each batch of records into columns
+                for field_index, column_values in enumerate(zip(*records)):
+                    column_lists[field_index].extend(column_values)
+                records = cursor.fetchmany(CachedResultSet.FETCH_SIZE)
+                    
+            self._result_dict = {self._field_names[field_index]: self._column_array(column_lists[field_index], 
+                                                                                    CachedResultSet.NUMPY_DTYPES.get(cursor.description[field_index][1])) 
+                                 for field_index in range(len(self._field_names))}
                     
-            self._record_count = len(self._result_dict[self._field_names[0]])
+            self._record_count = len(column_lists[0])
      
-    def record_generator(self, calculated_field_dict=None): 
+    def calculate_values(self, vectorised_field_dict):
+        '''
+        Function to return a dict of calculated field arrays computed from whole columns at once
+        
+        Parameter: vectorised_field_dict = {
+            <calculated_field_name>: <function_on_field_array_dict>,
+            <calculated_field_name>: <function_on_field_array_dict>,
+            ...
+            }
+            
+            where <function_on_field_array_dict> is a function which takes a dict of field arrays keyed by field name 
+            (as returned by the field_arrays property) and returns an array of values with one element per record
+        '''
+        return {field_name: self._column_array(vectorised_field_dict[field_name](self._result_dict)) 
+                for field_name in vectorised_field_dict.keys()}
+     
+    def record_generator(self, calculated_field_dict=None, vectorised_field_dict=None): 
         '''
         Generator function to return a complete dict for each record
         
@@ -78,10 +139,23 @@ class CachedResultSet(object):
             }
             
             where <function_on_record_dict> is a function which takes a record_dict and returns a single value
+            
+        Optional parameter: vectorised_field_dict as defined for calculate_values(). These fields are calculated 
+            for all records before iteration and are available to the functions in calculated_field_dict
         '''
         calculated_field_dict = calculated_field_dict or {}
-        for record_index in range(self._record_count):
-            record_fields = {field_name: self._result_dict[field_name][record_index] for field_name in self._field_names}
+        
+        field_names = list(self._field_names)
+        # Convert each column to a list of native Python values once rather than converting each element
+        column_lists = [self._result_dict[field_name].tolist() for field_name in field_names]
+        
+        if vectorised_field_dict:
+            for field_name, field_array in self.calculate_values(vectorised_field_dict).items():
+                field_names.append(field_name)
+                column_lists.append(field_array.tolist())
+        
+        for record_values in itertools.izip(*column_lists):
+            record_fields = dict(itertools.izip(field_names, record_values))
             calculated_fields = {field_name: calculated_field_dict[field_name](record_fields) for field_name in calculated_field_dict.keys()}
             record_fields.update(calculated_fields)   
             yield record_fields
@@ -90,8 +164,8 @@ class CachedResultSet(object):
         '''
         Function to add new calculated values to the result set.
         Parameter: value_dict = {
-            <field_name_string>: <field_value_list>,
-            <field_name_string>: <field_value_list>,
+            <field_name_string>: <field_value_list_or_array>,
+            <field_name_string>: <field_value_list_or_array>,
             ...
             }
             
@@ -99,16 +173,18 @@ class CachedResultSet(object):
         '''
         new_field_count = 0
         
-        for field_name in [field_name.lower() for field_name in value_dict.keys()]:
-            assert len(value_dict[field_name]) == self._record_count, 'Mismatched record count. Result set has $d but %s has %d.' % (self._record_count,
+        for field_name in value_dict.keys():
+            field_array = self._column_array(value_dict[field_name])
+            field_name = field_name.lower()
+            assert len(field_array) == self._record_count, 'Mismatched record count. Result set has %d but %s has %d.' % (self._record_count,
                                                                                                                field_name,
-                                                                                                               len(value_dict[field_name])
+                                                                                                               len(field_array)
                                                                                                                )
             if field_name not in self._field_names:
                 self._field_names.append(field_name)
                 new_field_count += 1
                 
-            self._result_dict[field_name] = value_dict[field_name]
+            self._result_dict[field_name] = field_array
         
         return new_field_count
     
@@ -127,9 +203,322 @@ class CachedResultSet(object):
 
     @property
     def field_values(self):
+        '''Dict of field value lists keyed by field name
+        '''
+        return {field_name: field_array.tolist() for field_name, field_array in self._result_dict.items()}
+
+    @property
+    def field_arrays(self):
+        '''Dict of field value numpy arrays keyed by field name
+        '''
         return self._result_dict
 
 
+class StreamingResultSet(object):
+    '''Class StreamingResultSet to retrieve query results incrementally through a server-side cursor
+    '''
+    def __init__(self, cursor, release_function=None): 
+        '''Constructor for class StreamingResultSet
+        
+        Parameters:
+            cursor: named (server-side) psycopg2 cursor object on which a query has been executed
+            release_function: Optional function taking no arguments to be called once the cursor has been closed,
+                e.g. to return the cursor's connection to a pool
+                
+            Records are fetched from the server in batches of cursor.itersize records. 
+            The result set can only be iterated through once.
+        '''
+        self._cursor = cursor
+        self._release_function = release_function
+        self._field_names = None
+        self._record_count = 0
+        self._consumed = False
+        
+    def record_generator(self, calculated_field_dict=None): 
+        '''
+        Generator function to return a complete dict for each record as it is retrieved
+        
+        Optional parameter: calculated_field_dict = {
+            <calculated_field_name>: <function_on_record_dict>,
+            <calculated_field_name>: <function_on_record_dict>,
+            ...
+            }
+            
+            where <function_on_record_dict> is a function which takes a record_dict and returns a single value
+        '''
+        assert not self._consumed, 'Streaming result set can only be iterated through once'
+        self._consumed = True
+        
+        calculated_field_dict = calculated_field_dict or {}
+        try:
+            for record in self._cursor:
+                if self._field_names is None: # Description is only available after the first fetch
+                    self._field_names = [field_descriptor[0] for field_descriptor in self._cursor.description]
+                    
+                record_fields = dict(itertools.izip(self._field_names, record))
+                calculated_fields = {field_name: calculated_field_dict[field_name](record_fields) for field_name in calculated_field_dict.keys()}
+                record_fields.update(calculated_fields)
+                self._record_count += 1
+                yield record_fields
+        finally:
+            self.close()
+            
+    def array_generator(self, calculated_field_dict=None):
+        '''
+        Generator function to return a dict of field value numpy arrays keyed by field name (as for the field_arrays 
+        property of CachedResultSet) for each batch of cursor.itersize records as it is retrieved
+        
+        Optional parameter: calculated_field_dict as defined for record_generator(). Calculated values are 
+            returned as arrays of the same length
+        '''
+        assert not self._consumed, 'Streaming result set can only be iterated through once'
+        self._consumed = True
+        
+        calculated_field_dict = calculated_field_dict or {}
+        try:
+            records = self._cursor.fetchmany(self._cursor.itersize)
+            while records:
+                if self._field_names is None: # Description is only available after the first fetch
+                    self._field_names = [field_descriptor[0] for field_descriptor in self._cursor.description]
+                    
+                field_arrays = {self._field_names[field_index]: CachedResultSet._column_array(column_values, 
+                                                                                               CachedResultSet.NUMPY_DTYPES.get(self._cursor.description[field_index][1]))
+                                for field_index, column_values in enumerate(zip(*records))}
+                
+                if calculated_field_dict:
+                    record_dicts = [dict(itertools.izip(self._field_names, record)) for record in records]
+                    for field_name, calculation_function in calculated_field_dict.items():
+                        field_arrays[field_name] = CachedResultSet._column_array([calculation_function(record_fields) for record_fields in record_dicts])
+                    
+                self._record_count += len(records)
+                yield field_arrays
+                
+                records = self._cursor.fetchmany(self._cursor.itersize)
+        finally:
+            self.close()
+            
+    def close(self):
+        '''
+        Function to close the server-side cursor and release its connection
+        '''
+        if self._cursor is None:
+            return
+        
+        try:
+            self._cursor.close()
+        except Exception, e:
+            logger.debug('Error closing streaming cursor: %s', e.message)
+        self._cursor = None
+        
+        if self._release_function:
+            self._release_function()
+            self._release_function = None
+            
+    def __del__(self):
+        self.close()
+
+    @property
+    def field_names(self):
+        '''List of field names. Only available once the first record has been retrieved
+        '''
+        return self._field_names
+
+    @property
+    def records_read(self):
+        return self._record_count
+
+
+class ConnectionPool(object):
+    '''Class ConnectionPool to manage a thread-safe pool of psycopg2 connections for a single database
+    '''
+    def __init__(self, connection_function, min_connections=1, max_connections=4, idle_timeout=300, health_check_interval=30, acquire_timeout=None):
+        '''Constructor for class ConnectionPool
+        
+        Parameters:
+            connection_function: Function taking no arguments which returns a new psycopg2 connection
+            min_connections: Minimum number of idle connections to retain regardless of idle_timeout
+            max_connections: Maximum number of connections (idle and in use) allowed at any one time
+            idle_timeout: Number of seconds after which surplus idle connections are closed (None for no timeout)
+            health_check_interval: Number of seconds a connection may be idle before it is tested with a trivial query on checkout
+            acquire_timeout: Number of seconds to wait for a free connection before raising an exception (None to wait indefinitely)
+        '''
+        assert max_connections >= 1, 'max_connections must be at least 1'
+        assert min_connections <= max_connections, 'min_connections must not exceed max_connections'
+        
+        self._connection_function = connection_function
+        self._min_connections = min_connections
+        self._max_connections = max_connections
+        self._idle_timeout = idle_timeout
+        self._health_check_interval = health_check_interval
+        self._acquire_timeout = acquire_timeout
+        
+        self._condition = threading.Condition(threading.Lock())
+        self._idle_connections = [] # List of (connection, release_time) tuples, most recently released last
+        self._in_use_count = 0
+        self._closed = False
+        
+    def _discard(self, connection):
+        '''Function to close a connection without raising an exception
+        '''
+        try:
+            connection.close()
+        except Exception, e:
+            logger.debug('Error closing pooled connection: %s', e.message)
+            
+    def _is_healthy(self, connection, idle_seconds):
+        '''Function to return True if a previously idle connection is still usable
+        '''
+        if connection.closed:
+            return False
+        
+        if self._health_check_interval is not None and idle_seconds >= self._health_check_interval:
+            try:
+                cursor = connection.cursor()
+                cursor.execute('select 1')
+                cursor.close()
+                if not connection.autocommit:
+                    connection.rollback()
+            except Exception, e:
+                logger.debug('Pooled connection failed health check: %s', e.message)
+                return False
+            
+        return True
+    
+    def _prune(self, now):
+        '''Function to close surplus connections which have been idle for longer than idle_timeout.
+        N.B: Must be called with self._condition held
+        '''
+        if self._idle_timeout is None:
+            return
+        
+        # Oldest idle connections are at the start of the list
+        while (len(self._idle_connections) > self._min_connections 
+               and now - self._idle_connections[0][1] > self._idle_timeout):
+            connection, _release_time = self._idle_connections.pop(0)
+            self._discard(connection)
+            logger.debug('Closed idle pooled connection')
+            
+    def acquire(self, autocommit=True):
+        '''Function to check out a healthy connection from the pool, creating a new one if required.
+        Blocks if max_connections are already in use.
+        
+        Parameter:
+            autocommit: Boolean flag indicating whether the returned connection should be in autocommit mode
+        '''
+        wait_start = time.time()
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        raise Exception('Connection pool has been closed')
+                    
+                    now = time.time()
+                    self._prune(now)
+                    
+                    # Reserve a slot, then check or create the connection outside the lock so that a slow 
+                    # connection doesn't block other threads
+                    if self._idle_connections:
+                        connection, release_time = self._idle_connections.pop() # Most recently used connection first
+                        idle_seconds = now - release_time
+                        self._in_use_count += 1
+                        break
+                    
+                    if self._in_use_count < self._max_connections:
+                        connection = None
+                        self._in_use_count += 1
+                        break
+                    
+                    if self._acquire_timeout is None:
+                        self._condition.wait()
+                    else:
+                        remaining_time = self._acquire_timeout - (now - wait_start)
+                        if remaining_time <= 0:
+                            raise Exception('Timed out waiting for a pooled database connection')
+                        self._condition.wait(remaining_time)
+                        
+            if connection is None or self._is_healthy(connection, idle_seconds):
+                break
+            
+            self._discard(connection)
+            with self._condition:
+                self._in_use_count -= 1
+                self._condition.notify()
+
+        if connection is None:
+            try:
+                connection = self._connection_function()
+            except:
+                with self._condition:
+                    self._in_use_count -= 1
+                    self._condition.notify()
+                raise
+            
+        set_autocommit(connection, autocommit)
+        return connection
+    
+    def release(self, connection):
+        '''Function to return a connection to the pool. Any open transaction is rolled back.
+        '''
+        if not connection.closed:
+            try:
+                if connection.status != psycopg2.extensions.STATUS_READY:
+                    connection.rollback()
+            except Exception, e:
+                logger.debug('Unable to reset pooled connection: %s', e.message)
+                self._discard(connection)
+        
+        with self._condition:
+            self._in_use_count -= 1
+            if self._closed or connection.closed:
+                self._discard(connection)
+            else:
+                now = time.time()
+                self._idle_connections.append((connection, now))
+                self._prune(now)
+            self._condition.notify()
+            
+    def close(self):
+        '''Function to close all idle connections. Connections currently in use will be closed on release.
+        '''
+        with self._condition:
+            self._closed = True
+            while self._idle_connections:
+                connection, _release_time = self._idle_connections.pop()
+                self._discard(connection)
+            self._condition.notify_all()
+            
+    @property
+    def min_connections(self):
+        return self._min_connections
+
+    @property
+    def max_connections(self):
+        return self._max_connections
+
+    @property
+    def idle_timeout(self):
+        return self._idle_timeout
+
+    @property
+    def idle_count(self):
+        return len(self._idle_connections)
+
+    @property
+    def in_use_count(self):
+        return self._in_use_count
+
+
+def set_autocommit(db_connection, autocommit):
+    '''Function to set the transaction mode of a connection
+    '''
+    if autocommit:
+        db_connection.autocommit = True
+        db_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    else:
+        db_connection.autocommit = False
+        db_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
+
+
 class Database(object):
     '''
     Class Database
@@ -145,15 +534,31 @@ class Database(object):
         if autocommit is None:
             autocommit = self._autocommit
         
-        if autocommit:
-            db_connection.autocommit = True
-            db_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-        else:
-            db_connection.autocommit = False
-            db_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
+        set_autocommit(db_connection, autocommit)
 
         return db_connection
     
+    def _get_pool(self):
+        '''Function to return the connection pool for this database, creating it on first use
+        '''
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ConnectionPool(self.create_connection, 
+                                            min_connections=self._pool_min_connections, 
+                                            max_connections=self._pool_max_connections, 
+                                            idle_timeout=self._pool_idle_timeout,
+                                            health_check_interval=self._pool_health_check_interval
+                                            )
+            return self._pool
+    
+    def _close_pool(self):
+        '''Function to close all pooled connections, e.g. when connection parameters change
+        '''
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.close()
+            self._pool = None
+    
     def execSQL(self, SQL, params=None, cursor=None):
         '''
         Function to return cursor with query results for specified SQL and parameters
@@ -161,9 +566,18 @@ class Database(object):
         Parameters:
             SQL: Query text
             params: Dict containing query parameters (optional)
-            cursor: cursor to return results. Defaults to self._default_cursor
+            cursor: cursor to return results. Defaults to self._default_cursor, or a cursor on a pooled connection
         '''
-        cursor = cursor or self._default_cursor or self.create_connection().cursor()
+        cursor = cursor or self._default_cursor
+        
+        if cursor is None:
+            # Client-side cursor results are fully retrieved by execute, so the connection can go straight back to the pool
+            pool = self._get_pool()
+            connection = pool.acquire(self._autocommit)
+            try:
+                return self.execSQL(SQL, params, cursor=connection.cursor())
+            finally:
+                pool.release(connection)
         
         log_multiline(logger.debug, cursor.mogrify(SQL, params), 'SQL', '\t')
         cursor.execute(SQL, params)
@@ -177,9 +591,17 @@ class Database(object):
         Parameters:
             SQL: Query text
             params: Dict containing query parameters (optional)
-            connection: DB connection to query. Defaults to self._default_connection
+            connection: DB connection to query. Defaults to self._default_connection, or a pooled connection
         '''
-        connection = connection or self._default_connection or self.create_connection()
+        connection = connection or self._default_connection
+        
+        if connection is None:
+            pool = self._get_pool()
+            connection = pool.acquire(self._autocommit)
+            try:
+                return self.submit_query(SQL, params, connection=connection)
+            finally:
+                pool.release(connection)
         
         log_multiline(logger.debug, SQL, 'SQL', '\t')
         log_multiline(logger.debug, params, 'params', '\t')
@@ -188,11 +610,36 @@ class Database(object):
         return CachedResultSet(self.execSQL(SQL, params, cursor=connection.cursor()))
         
     
+    def stream_query(self, SQL, params=None, itersize=None):
+        '''
+        Function to return StreamingResultSet object to retrieve query results incrementally through a server-side cursor
+        
+        Parameters:
+            SQL: Query text
+            params: Dict containing query parameters (optional)
+            itersize: Number of records to retrieve from the server in each batch. Defaults to self.itersize
+        '''
+        # Named cursors must be used within a transaction, so use a dedicated pooled connection
+        pool = self._get_pool()
+        connection = pool.acquire(autocommit=False)
+        try:
+            cursor = connection.cursor(name='gdf_stream_%s' % uuid.uuid4().hex)
+            cursor.itersize = itersize or self._itersize
+            
+            log_multiline(logger.debug, SQL, 'SQL', '\t')
+            log_multiline(logger.debug, params, 'params', '\t')
+            cursor.execute(SQL, params)
+        except:
+            pool.release(connection)
+            raise
+        
+        return StreamingResultSet(cursor, lambda: pool.release(connection))
+        
     def _close_default_connection(self):
-        '''Function to close default connection if required
+        '''Function to return default connection to the pool if required
         '''
         if self._default_connection:
-            self._default_connection.close()
+            self._get_pool().release(self._default_connection)
             
         self._default_connection = None
         self._default_cursor = None
@@ -203,10 +650,18 @@ class Database(object):
         self._close_default_connection()
         
         if self._keep_connection:
-            self._default_connection = self.create_connection()
+            self._default_connection = self._get_pool().acquire(self._autocommit)
             self._default_cursor = self._default_connection.cursor()
+            
+    def _reset_connections(self):
+        '''Function to discard all existing connections after a change of connection parameters
+        '''
+        self._close_default_connection()
+        self._close_pool()
+        self._setup_default_cursor()
     
-    def __init__(self, db_ref, host, port, dbname, user, password, keep_connection=True, autocommit=True):
+    def __init__(self, db_ref, host, port, dbname, user, password, keep_connection=True, autocommit=True,
+                 pool_min_connections=1, pool_max_connections=4, pool_idle_timeout=300, pool_health_check_interval=30, itersize=2000):
         '''
         Constructor for class Database.
         
@@ -216,6 +671,13 @@ class Database(object):
             dbname: PostgreSQL database database name
             user: PostgreSQL database user
             password: PostgreSQL database password for user
+            keep_connection: Boolean flag indicating whether a default connection should be held
+            autocommit: Boolean flag indicating whether connections should be in autocommit mode
+            pool_min_connections: Minimum number of idle pooled connections to retain
+            pool_max_connections: Maximum number of concurrent pooled connections
+            pool_idle_timeout: Seconds after which surplus idle pooled connections are closed
+            pool_health_check_interval: Seconds of idle time after which a pooled connection is tested before re-use
+            itersize: Default number of records per batch for streaming queries
         '''
         self._db_ref = db_ref
         self._host = host
@@ -225,6 +687,13 @@ class Database(object):
         self._password = password
         self._keep_connection = keep_connection
         self._autocommit = autocommit
+        self._pool_min_connections = pool_min_connections
+        self._pool_max_connections = pool_max_connections
+        self._pool_idle_timeout = pool_idle_timeout
+        self._pool_health_check_interval = pool_health_check_interval
+        self._itersize = itersize
+        self._pool = None
+        self._pool_lock = threading.Lock()
         self._default_connection = None
         self._default_cursor = None
         
@@ -232,6 +701,37 @@ class Database(object):
         
         log_multiline(logger.debug, self.__dict__, 'Database.__dict__', '\t')
     
+    def __getstate__(self):
+        '''Function to exclude live connections and locks from pickled state
+        '''
+        state = self.__dict__.copy()
+        for attribute_name in ['_pool', '_pool_lock', '_default_connection', '_default_cursor']:
+            del state[attribute_name]
+        return state
+    
+    def __setstate__(self, state):
+        '''Function to restore pickled state and re-establish default connection if required
+        '''
+        self.__dict__.update(state)
+        # Allow for objects pickled before connection pooling was introduced
+        self.__dict__.setdefault('_pool_min_connections', 1)
+        self.__dict__.setdefault('_pool_max_connections', 4)
+        self.__dict__.setdefault('_pool_idle_timeout', 300)
+        self.__dict__.setdefault('_pool_health_check_interval', 30)
+        self.__dict__.setdefault('_itersize', 2000)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._default_connection = None
+        self._default_cursor = None
+        
+        self._setup_default_cursor()
+    
+    def close(self):
+        '''
+        Close default connection and all pooled connections
+        '''
+        self._close_default_connection()
+        self._close_pool()
     
     def commit(self): 
         '''
@@ -270,7 +770,7 @@ class Database(object):
     def host(self, host):
         if self._host != host:
             self._host = host
-            self._setup_default_cursor()
+            self._reset_connections()
         
     @property
     def port(self):
@@ -280,7 +780,7 @@ class Database(object):
     def port(self, port):
         if self._port != port:
             self._port = port
-            self._setup_default_cursor()
+            self._reset_connections()
         
     @property
     def dbname(self):
@@ -290,7 +790,7 @@ class Database(object):
     def dbname(self, dbname):
         if self._dbname != dbname:
             self._dbname = dbname
-            self._setup_default_cursor()
+            self._reset_connections()
         
     @property
     def user(self):
@@ -300,7 +800,7 @@ class Database(object):
     def user(self, user):
         if self._user != user:
             self._user = user
-            self._setup_default_cursor()
+            self._reset_connections()
         
     @property
     def password(self):
@@ -310,7 +810,7 @@ class Database(object):
     def password(self, password):
         if self._password != password:
             self._password = password
-            self._setup_default_cursor()
+            self._reset_connections()
             
     @property
     def keep_connection(self):
@@ -339,3 +839,15 @@ class Database(object):
     @property
     def default_cursor(self):
         return self._default_cursor
+
+    @property
+    def itersize(self):
+        return self._itersize
+
+    @itersize.setter
+    def itersize(self, itersize):
+        self._itersize = itersize
+
+    @property
+    def pool(self):
+        return self._get_pool()
@@ -127,7 +127,7 @@ def log_multiline(log_function, log_text, title=None, prefix=''):
     if isinstance(log_text, str):
         logger.debug('log_text is type str')
         log_list = log_text.splitlines()
-    elif isinstance(log_text, list) and isinstance(log_text[0], str):
+    elif isinstance(log_text, list) and log_text and isinstance(log_text[0], str):
         logger.debug('log_text is type list with first element of type text')
         log_list = log_text
     else:
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+'''
+
+import threading
+import logging
+import collections
+
+from _gdfutils import log_multiline
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO) # Logging level for this module
+
+class StorageConfig(collections.Mapping):
+    '''
+    Class StorageConfig to provide a read-only dict of storage type configurations keyed by storage_type_tag.
+    Configurations are loaded from the databases (or the cache) per storage type on first use.
+    '''
+    def __init__(self, gdf, use_cache=True):
+        '''Constructor for class StorageConfig
+        
+        Parameters:
+            gdf: GDF object providing database access and caching for this storage configuration
+            use_cache: Boolean flag indicating whether configurations should be read from and written to the GDF cache
+        '''
+        self._gdf = gdf
+        self._use_cache = use_cache
+        self._lock = threading.RLock()
+        self._storage_type_index = None # Ordered dict of db_refs keyed by storage_type_tag
+        self._storage_config_dict = {} # Loaded configurations keyed by storage_type_tag
+        self._forced_refresh = False # Set when cached entries must be re-read from the databases
+
+    @staticmethod
+    def cache_name(storage_type):
+        '''
+        Function to return the cache entry name for the specified storage type
+        '''
+        return 'storage_config_%s' % storage_type
+    
+    def _load_cached(self, storage_type):
+        '''
+        Function to load the configuration for the specified storage type from the cache. Returns True if successful.
+        Cached entries are only valid if they were read with the current connection configuration and flag_definitions 
+        file for the database and are not older than the optional storage_config_ttl.
+        '''
+        if not self._use_cache or self._forced_refresh:
+            return False
+        
+        try:
+            cache_entry = self._gdf._get_cached_object(StorageConfig.cache_name(storage_type), 
+                                                       self._gdf.storage_config_ttl)
+        except KeyError:
+            return False
+        
+        db_ref = self._storage_type_index[storage_type]
+        if cache_entry['db_configuration'] != self._gdf.configuration.get(db_ref):
+            return False
+        
+        if cache_entry.get('flag_definitions_mtime') != self._gdf._get_flag_definitions_mtime(db_ref):
+            return False
+        
+        self._storage_config_dict[storage_type] = cache_entry['storage_config']
+        logger.debug('Loaded cached storage configuration for %s', storage_type)
+        return True
+    
+    def _read_storage_config(self, storage_types):
+        '''
+        Function to read configurations for the specified storage types from the databases and cache them
+        '''
+        # Take flag_definitions file times before reading so that a concurrent edit invalidates the new cache entries
+        flag_definitions_mtimes = dict([(db_ref, self._gdf._get_flag_definitions_mtime(db_ref)) 
+                                        for db_ref in set([self._get_index()[storage_type] for storage_type in storage_types])])
+        
+        storage_config_dict = self._gdf._get_storage_config(storage_types)
+        logger.info('Read storage configuration from databases %s', storage_config_dict.keys())
+        
+        for storage_type, storage_type_config in storage_config_dict.items():
+            self._storage_config_dict[storage_type] = storage_type_config
+            
+            if self._use_cache:
+                self._gdf._cache_object({'db_configuration': self._gdf.configuration.get(storage_type_config['db_ref']),
+                                         'flag_definitions_mtime': flag_definitions_mtimes.get(storage_type_config['db_ref']),
+                                         'storage_config': storage_type_config
+                                         }, StorageConfig.cache_name(storage_type))
+    
+    def _get_index(self):
+        '''
+        Function to return ordered dict of db_refs keyed by storage_type_tag, reading it from cache or databases if required
+        '''
+        # Avoid taking the lock once the index is loaded. Per-DB query threads call this while load() holds the lock
+        storage_type_index = self._storage_type_index
+        if storage_type_index is not None:
+            return storage_type_index
+        
+        with self._lock:
+            if self._storage_type_index is not None:
+                return self._storage_type_index
+            
+            if not self._use_cache:
+                self._storage_type_index = self._gdf._get_storage_type_index()
+            elif self._forced_refresh:
+                self._storage_type_index = self._gdf._get_storage_type_index()
+                self._gdf._cache_object(self._storage_type_index, 'storage_types')
+            else:
+                self._storage_type_index = self._gdf._get_or_create_cached_object('storage_types', 
+                                                                                  self._gdf._get_storage_type_index, 
+                                                                                  self._gdf.storage_config_ttl)
+            logger.debug('Storage types: %s', self._storage_type_index.keys())
+                
+            return self._storage_type_index
+        
+    def load(self, storage_types=None):
+        '''
+        Function to ensure that configurations for the specified storage types are loaded. Any configurations which 
+        cannot be read from the cache are retrieved from the databases together.
+        
+        Parameter:
+            storage_types: List of storage_type_tags to load. Defaults to all storage types
+        '''
+        with self._lock:
+            index = self._get_index()
+            uncached_storage_types = [storage_type for storage_type in (storage_types or index.keys()) 
+                                      if storage_type in index 
+                                      and storage_type not in self._storage_config_dict
+                                      and not self._load_cached(storage_type)]
+            if not uncached_storage_types:
+                return
+            
+            if not self._use_cache:
+                self._read_storage_config(uncached_storage_types)
+                return
+            
+            # Stop concurrent processes sharing the cache from all reading the same configurations
+            with self._gdf.cache_store.lock('storage_config'):
+                # Another process may have cached some of these while we were waiting for the lock
+                uncached_storage_types = [storage_type for storage_type in uncached_storage_types 
+                                          if not self._load_cached(storage_type)]
+                if uncached_storage_types:
+                    self._read_storage_config(uncached_storage_types)
+    
+    def refresh(self, storage_types=None):
+        '''
+        Function to re-read configurations for the specified storage types from the databases, bypassing the cache.
+        
+        Parameter:
+            storage_types: List of storage_type_tags to refresh. Defaults to all storage types, in which case the 
+                list of storage types is also re-read
+        '''
+        with self._lock:
+            self._forced_refresh = True
+            try:
+                if storage_types is None:
+                    self._storage_type_index = None
+                    self._storage_config_dict = {}
+                else:
+                    for storage_type in storage_types:
+                        self._storage_config_dict.pop(storage_type, None)
+                        
+                self.load(storage_types)
+            finally:
+                self._forced_refresh = False
+    
+    def get_db_ref(self, storage_type):
+        '''
+        Function to return the db_ref of the database managing the specified storage type without loading its configuration
+        '''
+        return self._get_index()[storage_type]
+    
+    def is_loaded(self, storage_type):
+        '''
+        Function to return True if the configuration for the specified storage type has been loaded
+        '''
+        return storage_type in self._storage_config_dict
+    
+    def __getitem__(self, storage_type):
+        storage_type_config = self._storage_config_dict.get(storage_type)
+        if storage_type_config is not None:
+            return storage_type_config
+        
+        with self._lock:
+            if storage_type not in self._storage_config_dict:
+                if storage_type not in self._get_index():
+                    raise KeyError(storage_type)
+                self.load([storage_type])
+                
+            return self._storage_config_dict[storage_type]
+    
+    def __iter__(self):
+        return iter(self._get_index())
+    
+    def __len__(self):
+        return len(self._get_index())
+    
+    def __contains__(self, storage_type):
+        return storage_type in self._get_index()
+    
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self._get_index().keys())
@@ -1,10 +1,34 @@
+import test_analytics_utils
 import test_arguments
+import test_bitmask
+import test_cache
+import test_cache_store
 import test_config_file
 import test_database
+import test_evaluate
+import test_expressions
 import test_gdf
+import test_masks
+import test_online
+import test_optimiser
+import test_reductions
+import test_scheduler
+import test_tiling
 
 # Run all tests
+test_analytics_utils.main()
 test_arguments.main()
+test_bitmask.main()
+test_cache.main()
+test_cache_store.main()
 test_config_file.main()
 test_database.main()
+test_evaluate.main()
+test_expressions.main()
 test_gdf.main()
+test_masks.main()
+test_online.main()
+test_optimiser.main()
+test_reductions.main()
+test_scheduler.main()
+test_tiling.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the analytics_utils PQA masking functions.
+'''
+
+
+import unittest
+import numpy as np
+from scipy import ndimage
+from analytics_utils import LANDSAT_PQA_FLAGS, get_pqa_mask, get_flag_mask, get_flag_overlap
+
+
+def legacy_get_pqa_mask(pqa_ndarray, good_pixel_masks=[32767,16383,2457], dilation=3):
+    '''
+    get_pqa_mask as it was before flag definitions were introduced, adapted from stacker.py
+    '''
+    pqa_mask = np.zeros(pqa_ndarray.shape, dtype=np.bool)
+    s = [[1,1,1],[1,1,1],[1,1,1]]
+    for i in range(len(pqa_ndarray)):
+        pqa_array = pqa_ndarray[i] | 64
+        for bit in [10, 11, 12, 13]:
+            flag = (pqa_array & (1 << bit)) >> bit
+            erode = ndimage.binary_erosion(flag, s, iterations=dilation, border_value=1)
+            dif = erode - flag
+            dif[dif < 0] = 1
+            pqa_array += (dif << bit)
+        for good_pixel_mask in good_pixel_masks:
+            pqa_mask[i][pqa_array == good_pixel_mask] = True
+    return pqa_mask
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestPQAMask(unittest.TestCase):
+    """Unit tests for PQA masking functions."""
+
+    MODULE = 'analytics_utils'
+    SUITE = 'TestPQAMask'
+
+    GOOD_PIXEL = 32767
+    SIZE = 41 # Pixels in each dimension of test time slices
+    
+    # Radius of the square masked around a single pixel failing the test of each bit with the default dilation.
+    # Bit 6 (band 62 saturation) and bit 14 (topographic shadow) are ignored. Bit 15 is a set spare bit
+    DILATIONS = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 7: 0, 8: 0, 9: 0, 
+                 10: 12, 11: 9, 12: 6, 13: 3, 15: 0}
+
+    def get_flagged_pixel(self, bit):
+        "Return time slice of good pixels with the flag for the given bit toggled in the centre pixel"
+        pqa_array = np.empty((1, self.SIZE, self.SIZE), dtype=np.int16)
+        pqa_array.view(np.uint16)[...] = self.GOOD_PIXEL
+        pqa_array.view(np.uint16)[0, self.SIZE / 2, self.SIZE / 2] ^= (1 << bit)
+        return pqa_array
+
+    def test_single_flagged_pixels(self):
+        "Test the mask around a single pixel flagged by each bit against the original get_pqa_mask"
+        for bit in range(16):
+            pqa_array = self.get_flagged_pixel(bit)
+            pqa_mask = get_pqa_mask(pqa_array)
+            
+            expected_mask = np.ones(pqa_array.shape, dtype=np.bool)
+            if bit in self.DILATIONS:
+                radius = self.DILATIONS[bit]
+                centre = self.SIZE / 2
+                expected_mask[0, centre - radius:centre + radius + 1, centre - radius:centre + radius + 1] = False
+            
+            assert (pqa_mask == legacy_get_pqa_mask(pqa_array)).all(), 'Mask for bit %d differs from original mask' % bit
+            assert (pqa_mask == expected_mask).all(), 'Mask for bit %d has %d bad pixels instead of %d' % (bit, 
+                (~pqa_mask).sum(), (~expected_mask).sum())
+
+    def test_legacy_mask(self):
+        "Test masks of overlapping clouds and cloud shadows against the original get_pqa_mask"
+        random_state = np.random.RandomState(0)
+        pqa_array = np.empty((4, self.SIZE, self.SIZE), dtype=np.int16)
+        pqa_array[...] = random_state.choice([self.GOOD_PIXEL, 16383], pqa_array.shape)
+        for _index in range(20):
+            t, y, x = random_state.randint(0, self.SIZE - 5, 3) % [len(pqa_array), self.SIZE, self.SIZE]
+            pqa_array[t, y:y + random_state.randint(1, 6), x:x + random_state.randint(1, 6)] &= ~(1 << random_state.randint(10, 14))
+        
+        for dilation in [1, 3]:
+            for good_pixel_masks in [None, [32767, 16383, 2457], [32767 & ~64]]:
+                pqa_mask = get_pqa_mask(pqa_array, good_pixel_masks, dilation)
+                legacy_mask = legacy_get_pqa_mask(pqa_array, good_pixel_masks or [32767, 16383, 2457], dilation)
+                assert (pqa_mask == legacy_mask).all(), 'Mask with dilation %d and good pixels %s differs from original mask' % (
+                    dilation, good_pixel_masks)
+        
+        assert (get_pqa_mask(pqa_array, num_threads=2) == get_pqa_mask(pqa_array)).all(), 'Threaded mask differs'
+        
+        try:
+            get_pqa_mask(pqa_array, dilation=0)
+            assert False, 'Dilation of 0 pixels should be rejected'
+        except ValueError:
+            pass
+
+    def test_overlap(self):
+        "Test the number of pixels around a pixel whose flags can affect its mask"
+        assert get_flag_overlap(LANDSAT_PQA_FLAGS) == 12, 'Carried dilations should reach 12 pixels'
+        
+        flag_definition = dict(LANDSAT_PQA_FLAGS, carry=False)
+        assert get_flag_overlap(flag_definition) == 3, 'Separate dilations should reach 3 pixels'
+        
+        pqa_array = self.get_flagged_pixel(10)
+        assert (~get_flag_mask(pqa_array, flag_definition)).sum() == 49, 'Separate dilation should mask 7 x 7 pixels'
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestPQAMask
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the execution_engine._bitmask.py module.
+'''
+
+
+import unittest
+import numpy as np
+from execution_engine._bitmask import BitMask
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestBitMask(unittest.TestCase):
+    """Unit tests for BitMask class."""
+
+    MODULE = 'execution_engine._bitmask'
+    SUITE = 'TestBitMask'
+    
+    # Row sizes which are and aren't multiples of 8 bits
+    TEST_SHAPES = [(3, 4, 6), (5, 3, 3), (2, 8), (13,)]
+
+    def get_test_array(self, shape, seed=0):
+        "Return random boolean array"
+        return np.random.RandomState(seed).rand(*shape) < 0.5
+
+    def test_pack(self):
+        "Test packing, unpacking and counting"
+        for shape in self.TEST_SHAPES:
+            array = self.get_test_array(shape)
+            mask = BitMask.from_array(array)
+            assert mask.shape == shape, 'Mask shape is incorrect'
+            assert np.array_equal(mask.to_array(), array), 'Unpacked mask differs for shape %s' % (shape,)
+            assert mask.count() == array.sum(), 'Count is incorrect for shape %s' % (shape,)
+            assert np.array_equal(BitMask(shape, mask.bits).to_array(), array), 'Mask from bits differs'
+            assert not BitMask(shape).to_array().any(), 'New mask should be all False'
+        
+        mask = BitMask((1000, 100))
+        assert mask.nbytes == 1000 * 13, 'Mask should use one bit per element plus row padding'
+
+    def test_rows(self):
+        "Test reading and writing rows along the first axis"
+        array = self.get_test_array((10, 5, 3))
+        mask = BitMask.from_array(array)
+        assert np.array_equal(mask[3], array[3]), 'Row differs'
+        assert np.array_equal(mask[2:7], array[2:7]), 'Rows differ'
+        
+        mask[4] = ~array[4]
+        mask[6:8] = ~array[6:8]
+        array[4] = ~array[4]
+        array[6:8] = ~array[6:8]
+        assert np.array_equal(mask.to_array(), array), 'Rows not written'
+        
+        chunks = list(mask.get_chunks(chunk_size=40))
+        assert chunks == [slice(0, 2), slice(2, 4), slice(4, 6), slice(6, 8), slice(8, 10)], 'Chunks are incorrect'
+        assert list(mask.get_chunks(chunk_size=1)) == [slice(index, index + 1) for index in range(10)], \
+            'Chunks should contain at least one row'
+
+    def test_operators(self):
+        "Test combining and inverting masks, including the padding of rows"
+        for shape in self.TEST_SHAPES:
+            array1 = self.get_test_array(shape, 1)
+            array2 = self.get_test_array(shape, 2)
+            mask1 = BitMask.from_array(array1)
+            mask2 = BitMask.from_array(array2)
+            
+            assert np.array_equal((mask1 & mask2).to_array(), array1 & array2), '& differs'
+            assert np.array_equal((mask1 | mask2).to_array(), array1 | array2), '| differs'
+            
+            inverse = ~mask1
+            assert np.array_equal(inverse.to_array(), ~array1), '~ differs'
+            assert inverse.count() == array1.size - array1.sum(), 'Count of inverse includes padding for shape %s' % (shape,)
+            assert (~BitMask(shape)).count() == array1.size, 'Count of inverted empty mask includes padding'
+            assert (inverse | mask1).count() == array1.size, 'Count of combined masks includes padding'
+            
+            mask1 &= mask2
+            assert np.array_equal(mask1.to_array(), array1 & array2), '&= differs'
+            mask1 |= inverse
+            assert np.array_equal(mask1.to_array(), (array1 & array2) | ~array1), '|= differs'
+        
+        self.assertRaises(ValueError, BitMask((2, 3)).__and__, BitMask((3, 2)))
+
+    def test_equal_fill(self):
+        "Test masks of equal values and filling arrays with a mask"
+        for shape in self.TEST_SHAPES:
+            array = np.random.RandomState(0).randint(0, 3, shape).astype(np.int16)
+            mask = BitMask.equal(array, 1)
+            assert np.array_equal(mask.to_array(), array == 1), 'Mask of equal values differs'
+            
+            filled_array = array.copy()
+            mask.fill(filled_array, -999)
+            assert np.array_equal(filled_array, np.where(array == 1, -999, array)), 'Array not filled where True'
+            
+            filled_array = array.astype(np.float32)
+            mask.fill(filled_array, np.nan, where=False)
+            assert np.array_equal(np.isnan(filled_array), array != 1), 'Array not filled where False'
+            
+        self.assertRaises(ValueError, BitMask((2, 3)).fill, np.zeros((3, 2)), 0)
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestBitMask
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the execution_engine._cache.py module.
+'''
+
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from execution_engine._cache import ResultCache, get_result_size
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestResultCache(unittest.TestCase):
+    """Unit tests for ResultCache class."""
+
+    MODULE = 'execution_engine._cache'
+    SUITE = 'TestResultCache'
+    
+    ARRAY_SIZE = 1000 # Number of float64 values in each test array
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def get_test_result(self, value):
+        "Return task result containing a float64 array filled with value"
+        return {'array_result': {'B40': np.ones(self.ARRAY_SIZE) * value}, 
+                'array_indices': {}}
+
+    def get_cache(self, result_count, read_only=False):
+        "Return cache with room for result_count test results in memory"
+        return ResultCache(memory_limit=result_count * self.ARRAY_SIZE * 8, temp_dir=self.temp_dir, min_spill_size=0, 
+                           read_only=read_only)
+
+    def test_memory_limit(self):
+        "Test that results beyond the memory limit are spilled, least recently used first"
+        cache = self.get_cache(2)
+        for key in ['a', 'b', 'c']:
+            cache[key] = self.get_test_result(ord(key))
+            
+        assert cache.memory_used == 2 * self.ARRAY_SIZE * 8, 'Memory used is incorrect'
+        assert isinstance(cache['a']['array_result']['B40'], np.memmap), 'Least recently used result not spilled'
+        assert get_result_size(cache['b']) and get_result_size(cache['c']), 'Recent results should be held in memory'
+        assert len(os.listdir(self.temp_dir)) == 1, 'Spill file not written'
+        
+        # 'a' was used most recently, so 'b' is spilled next
+        cache['d'] = self.get_test_result(ord('d'))
+        assert isinstance(cache['b']['array_result']['B40'], np.memmap), 'Least recently used result not spilled'
+        assert sorted(cache.keys()) == ['a', 'b', 'c', 'd'], 'Results missing'
+        for key in cache.keys():
+            assert (cache[key]['array_result']['B40'] == ord(key)).all(), 'Result %s differs' % key
+        
+        del cache['a']
+        cache.pop('b')
+        assert os.listdir(self.temp_dir) == [], 'Spill files not removed'
+        assert cache.memory_used == 2 * self.ARRAY_SIZE * 8, 'Memory used is incorrect'
+
+    def test_release(self):
+        "Test that released results are spilled first"
+        cache = self.get_cache(2)
+        cache['a'] = self.get_test_result(1)
+        cache['b'] = self.get_test_result(2)
+        cache.release('b')
+        cache['c'] = self.get_test_result(3)
+        
+        assert not isinstance(cache['a']['array_result']['B40'], np.memmap), 'Unreleased result spilled'
+        assert isinstance(cache['b']['array_result']['B40'], np.memmap), 'Released result not spilled'
+
+    def test_spilled_arrays(self):
+        "Test that spilled arrays are copy-on-write, or read-only if set"
+        cache = self.get_cache(0)
+        cache['a'] = self.get_test_result(1)
+        array = cache['a']['array_result']['B40']
+        assert isinstance(array, np.memmap), 'Result not spilled'
+        array[0] = 2
+        del array
+        assert (np.load(os.path.join(self.temp_dir, os.listdir(self.temp_dir)[0])) == 1).all(), 'Spill file modified'
+        
+        cache = self.get_cache(0, read_only=True)
+        cache['a'] = self.get_test_result(1)
+        array = cache['a']['array_result']['B40']
+        assert isinstance(array, np.memmap) and not array.flags.writeable, 'Spilled array should be read-only'
+        self.assertRaises(ValueError, array.__setitem__, 0, 2)
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestResultCache
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the gdf._cache_store.py module.
+'''
+
+
+import unittest
+import os
+import time
+import shutil
+import tempfile
+import cPickle
+import threading
+from gdf._cache_store import CacheStore
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestCacheStore(unittest.TestCase):
+    """Unit tests for CacheStore class."""
+
+    MODULE = 'gdf._cache_store'
+    SUITE = 'TestCacheStore'
+    
+    TEST_OBJECT = {'test_key': [1, 2.0, 'three']}
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_put_get(self):
+        "Test writing and reading a cache entry"
+        cache_store = CacheStore(self.cache_dir)
+        
+        self.assertRaises(KeyError, cache_store.get, 'test_entry')
+        
+        cache_store.put('test_entry', self.TEST_OBJECT)
+        assert cache_store.get('test_entry') == self.TEST_OBJECT, 'Cached object differs'
+        assert os.listdir(self.cache_dir) == ['test_entry' + CacheStore.FILE_EXTENSION], 'Temporary files not removed'
+        
+        cache_store.invalidate('test_entry')
+        self.assertRaises(KeyError, cache_store.get, 'test_entry')
+        cache_store.invalidate('test_entry') # Invalidating a missing entry should not fail
+
+    def test_versions(self):
+        "Test that entries with a different schema version or format are ignored"
+        CacheStore(self.cache_dir, schema_version=1).put('test_entry', self.TEST_OBJECT)
+        
+        self.assertRaises(KeyError, CacheStore(self.cache_dir, schema_version=2).get, 'test_entry')
+        assert CacheStore(self.cache_dir, schema_version=1).get('test_entry') == self.TEST_OBJECT, 'Cached object differs'
+        
+        # Plain pickle file as written by earlier versions
+        cache_file = open(os.path.join(self.cache_dir, 'old_entry' + CacheStore.FILE_EXTENSION), 'wb')
+        cPickle.dump(self.TEST_OBJECT, cache_file, -1)
+        cache_file.close()
+        self.assertRaises(KeyError, CacheStore(self.cache_dir).get, 'old_entry')
+        
+        # Truncated file
+        cache_file = open(os.path.join(self.cache_dir, 'bad_entry' + CacheStore.FILE_EXTENSION), 'wb')
+        cache_file.write('\x80\x02}q')
+        cache_file.close()
+        self.assertRaises(KeyError, CacheStore(self.cache_dir).get, 'bad_entry')
+
+    def test_expiry(self):
+        "Test entry time to live and maximum age"
+        cache_store = CacheStore(self.cache_dir)
+        
+        cache_store.put('test_entry', self.TEST_OBJECT, ttl=0)
+        self.assertRaises(KeyError, cache_store.get, 'test_entry')
+        
+        cache_store.put('test_entry', self.TEST_OBJECT, ttl=60)
+        assert cache_store.get('test_entry') == self.TEST_OBJECT, 'Cached object differs'
+        
+        time.sleep(0.01)
+        self.assertRaises(KeyError, cache_store.get, 'test_entry', 0.001)
+        assert cache_store.get('test_entry', 60) == self.TEST_OBJECT, 'Cached object differs'
+        
+    def test_get_or_create(self):
+        "Test that concurrent callers create a missing entry only once"
+        create_count = [0]
+        
+        def create_function():
+            create_count[0] += 1
+            time.sleep(0.1)
+            return self.TEST_OBJECT
+        
+        results = []
+        
+        def get_entry():
+            # Each thread has its own store and lock file handle like separate processes
+            results.append(CacheStore(self.cache_dir).get_or_create('test_entry', create_function))
+        
+        thread_list = [threading.Thread(target=get_entry) for _thread_index in range(4)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+        
+        assert create_count[0] == 1, 'Entry created %d times' % create_count[0]
+        assert results == [self.TEST_OBJECT] * 4, 'Cached objects differ'
+        
+    def test_clear(self):
+        "Test removal of all cache entries"
+        cache_store = CacheStore(self.cache_dir)
+        cache_store.put('test_entry1', self.TEST_OBJECT)
+        cache_store.put('test_entry2', self.TEST_OBJECT)
+        
+        cache_store.clear()
+        self.assertRaises(KeyError, cache_store.get, 'test_entry1')
+        self.assertRaises(KeyError, cache_store.get, 'test_entry2')
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestCacheStore
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
@@ -171,6 +171,117 @@ class TestDatabase(unittest.TestCase):
         assert first_record_dict['plus_one'] == 2, 'Second field value should be 2'
         assert first_record_dict['plus_two'] == 3, 'Third field value should be 3'
         
+    def test_vectorised_values(self):
+        "Test generator with vectorised calculated fields"
+        
+        def plus_one(field_array_dict):
+            return field_array_dict['test_field'] + 1
+        
+        test_db = Database(self.TEST_DB_REF,
+                           self.TEST_HOST, 
+                           self.TEST_PORT, 
+                           self.TEST_DBNAME, 
+                           self.TEST_USER, 
+                           self.TEST_PASSWORD
+                           )
+        
+        cached_result_set = test_db.submit_query('select generate_series(1, 1000) as test_field')
+        
+        assert cached_result_set.record_count == 1000, 'Query should return 1000 rows'
+        assert cached_result_set.field_arrays['test_field'].dtype.kind == 'i', 'Integer field should be stored in an integer array'
+        
+        calculated_values = cached_result_set.calculate_values({'plus_one': plus_one})
+        assert (calculated_values['plus_one'] == cached_result_set.field_arrays['test_field'] + 1).all(), 'Vectorised values incorrect'
+        
+        last_record_dict = list(cached_result_set.record_generator(vectorised_field_dict={'plus_one': plus_one}))[-1]
+        assert last_record_dict['test_field'] == 1000, 'Last field value should be 1000'
+        assert last_record_dict['plus_one'] == 1001, 'Last calculated value should be 1001'
+        assert type(last_record_dict['plus_one']) == int, 'Record values should be native Python types'
+
+    def test_stream_query(self):
+        "Test streaming query through server-side cursor"
+        test_db = Database(self.TEST_DB_REF,
+                           self.TEST_HOST, 
+                           self.TEST_PORT, 
+                           self.TEST_DBNAME, 
+                           self.TEST_USER, 
+                           self.TEST_PASSWORD,
+                           keep_connection=False,
+                           itersize=100
+                           )
+        
+        streaming_result_set = test_db.stream_query('select generate_series(1, 1000) as test_field')
+        
+        record_count = 0
+        for record_dict in streaming_result_set.record_generator({'plus_one': lambda record_dict: record_dict['test_field'] + 1}):
+            record_count += 1
+            assert record_dict['plus_one'] == record_dict['test_field'] + 1, 'Calculated field value incorrect'
+            
+        assert record_count == 1000, 'Streaming query should return 1000 rows'
+        assert streaming_result_set.field_names == ['test_field'], 'Field name should be "test_field"'
+        assert test_db.pool.in_use_count == 0, 'Streaming connection should be returned to pool when exhausted'
+        
+    def test_connection_pool(self):
+        "Test re-use of pooled connections"
+        test_db = Database(self.TEST_DB_REF,
+                           self.TEST_HOST, 
+                           self.TEST_PORT, 
+                           self.TEST_DBNAME, 
+                           self.TEST_USER, 
+                           self.TEST_PASSWORD,
+                           keep_connection=False,
+                           pool_max_connections=2
+                           )
+        
+        assert test_db.default_connection is None, 'No default connection should be held'
+        
+        test_db.submit_query(self.TEST_QUERY)
+        first_connection = test_db.pool.acquire()
+        test_db.pool.release(first_connection)
+        
+        test_db.submit_query(self.TEST_QUERY)
+        second_connection = test_db.pool.acquire()
+        assert second_connection is first_connection, 'Idle pooled connection should be re-used'
+        assert test_db.pool.in_use_count == 1, 'Exactly one pooled connection should be in use'
+        
+        third_connection = test_db.pool.acquire()
+        assert third_connection is not second_connection, 'Connection in use should not be handed out again'
+        
+        test_db.pool.release(second_connection)
+        test_db.pool.release(third_connection)
+        assert test_db.pool.idle_count == 2, 'Released connections should be idle in pool'
+        
+        test_db.close()
+        assert second_connection.closed and third_connection.closed, 'Closing database should close pooled connections'
+        
+    def test_pooled_transaction(self):
+        "Test transactional default connection drawn from pool"
+        test_db = Database(self.TEST_DB_REF,
+                           self.TEST_HOST, 
+                           self.TEST_PORT, 
+                           self.TEST_DBNAME, 
+                           self.TEST_USER, 
+                           self.TEST_PASSWORD,
+                           keep_connection=False
+                           )
+        
+        test_db.keep_connection = True
+        test_db.autocommit = False
+        
+        test_db.submit_query(self.TEST_QUERY)
+        assert not test_db.default_connection.autocommit, 'Default connection should not be in autocommit mode'
+        test_db.commit()
+        
+        test_db.autocommit = True
+        test_db.keep_connection = False
+        
+        assert test_db.default_connection is None, 'Default connection should have been returned to pool'
+        assert test_db.pool.in_use_count == 0, 'No pooled connections should be in use'
+        
+        pooled_connection = test_db.pool.acquire()
+        assert pooled_connection.autocommit, 'Pooled connection should be reset to autocommit mode'
+        test_db.pool.release(pooled_connection)
+        
 
 #
 # Define test suites
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the execution_engine._evaluate.py module.
+'''
+
+
+import unittest
+import numpy as np
+import numexpr as ne
+from execution_engine._bitmask import BitMask
+from execution_engine._evaluate import evaluate, get_no_data_expression, get_result_shape, get_result_type
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestEvaluate(unittest.TestCase):
+    """Unit tests for chunked band math evaluation."""
+
+    MODULE = 'execution_engine._evaluate'
+    SUITE = 'TestEvaluate'
+
+    def get_test_arrays(self, shape=(7, 5, 6)):
+        "Return dict of int16 B30 and B40 arrays with no data values"
+        random_state = np.random.RandomState(0)
+        arrays = {'B30': random_state.randint(1, 1000, shape).astype(np.int16),
+                  'B40': random_state.randint(1, 1000, shape).astype(np.int16)}
+        arrays['B30'][random_state.rand(*shape) < 0.2] = -999
+        arrays['B40'][random_state.rand(*shape) < 0.2] = -999
+        return arrays
+
+    def test_no_data_expression(self):
+        "Test propagation of no data values by the expression"
+        arrays = self.get_test_arrays()
+        function = '((B40 - B30) / (B40 + B30))'
+        expression, no_data_arrays = get_no_data_expression(function, arrays, -999)
+        assert sorted(no_data_arrays.keys()) == ['_no_data_0', '_no_data_1'], 'No data arrays should be renamed'
+        
+        local_dict = dict(arrays)
+        local_dict.update(no_data_arrays)
+        result = ne.evaluate(expression, local_dict=local_dict)
+        no_data = (arrays['B30'] == -999) | (arrays['B40'] == -999)
+        assert (result[no_data] == -999).all(), 'No data values not propagated'
+        assert np.allclose(result[~no_data], ne.evaluate(function, local_dict=arrays)[~no_data]), 'Valid values differ'
+        
+        assert get_no_data_expression(function, arrays, None) == (function, {}), 'None should propagate nothing'
+        assert get_no_data_expression(function, arrays, np.nan) == (function, {}), 'NaN should propagate nothing'
+
+    def test_result_shape_type(self):
+        "Test result shape and type of expressions over arrays and masks"
+        arrays = {'a': np.zeros((4, 3, 2), dtype=np.int16), 'b': np.zeros((3, 2), dtype=np.float32), 'c': np.zeros(1)}
+        masks = {'m': BitMask((4, 3, 2))}
+        assert get_result_shape('a + b', arrays) == (4, 3, 2), 'Broadcast shape is incorrect'
+        assert get_result_shape('b * 2', arrays) == (3, 2), 'Shape is incorrect'
+        assert get_result_shape('where(m, b, 0)', arrays, masks) == (4, 3, 2), 'Mask shape not used'
+        assert get_result_type('a + b', arrays) == np.float32, 'Result type is incorrect'
+        assert get_result_type('a * 2', arrays) == np.int32, 'Integer literals should be int32'
+        assert get_result_type('where(m, a, c)', arrays, masks) == np.float64, 'Result type with mask is incorrect'
+
+    def test_evaluate(self):
+        "Test that chunked evaluation matches evaluation of whole arrays"
+        arrays = self.get_test_arrays()
+        mask_array = np.random.RandomState(1).rand(*arrays['B30'].shape) < 0.5
+        masks = {'pqa_mask_0': BitMask.from_array(mask_array)}
+        expression = 'where(pqa_mask_0, (B40 - B30) / (B40 + B30), -999)'
+        local_dict = dict(arrays, pqa_mask_0=mask_array)
+        expected_result = ne.evaluate(expression, local_dict=local_dict)
+        
+        for chunk_size in [1, 30, 65, 10000]:
+            result = evaluate(expression, arrays, masks, chunk_size=chunk_size)
+            assert result.dtype == expected_result.dtype, 'Result type is incorrect'
+            assert np.array_equal(result, expected_result), 'Result with chunk size %d differs' % chunk_size
+        
+        # Broadcast arrays and output to existing array
+        arrays['scale'] = np.arange(30, dtype=np.float64).reshape(5, 6)
+        out = np.empty(arrays['B30'].shape, dtype=np.float32)
+        result = evaluate('B30 * scale', arrays, out=out, chunk_size=30)
+        assert result is out, 'Output array not used'
+        assert np.array_equal(out, (arrays['B30'] * arrays['scale']).astype(np.float32)), 'Broadcast result differs'
+        self.assertRaises(ValueError, evaluate, 'B30 * 2', arrays, out=np.empty((7, 5)))
+        
+        # Scalar results
+        assert evaluate('scale * 0 + 1', {'scale': np.float64(2)}) == 1, 'Scalar result differs'
+
+    def test_num_threads(self):
+        "Test that the numexpr thread setting is restored after evaluation"
+        arrays = self.get_test_arrays()
+        previous_threads = ne.set_num_threads(2)
+        try:
+            result = evaluate('B30 + B40', arrays, num_threads=1)
+            assert ne.set_num_threads(2) == 2, 'Number of numexpr threads not restored'
+            assert np.array_equal(result, arrays['B30'] + arrays['B40']), 'Result differs'
+        finally:
+            ne.set_num_threads(previous_threads)
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestEvaluate
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the analytics._expressions.py module.
+'''
+
+
+import unittest
+from analytics import Analytics
+from analytics._expressions import compile_expression
+
+
+class StubGDF(object):
+    """GDF stand-in describing int16 variables of any storage type."""
+    
+    def get_descriptor(self, query_parameter):
+        return {query_parameter['storage_type']: {'dimensions': ['T', 'Y', 'X'], 'result_shape': (5, 10, 10),
+                                                  'variables': dict((variable, {'numpy_datatype_name': 'int16', 'nodata_value': -999}) 
+                                                                    for variable in query_parameter['variables'])}}
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestExpressions(unittest.TestCase):
+    """Unit tests for compiled band math expressions."""
+
+    MODULE = 'analytics._expressions'
+    SUITE = 'TestExpressions'
+    
+    BANDS = ['B%d' % band for band in range(1, 13)]
+    TYPES = dict((band, 'int16') for band in BANDS)
+
+    def test_placeholders(self):
+        "Test that placeholders are replaced by the variables at their positions, so array1 never matches array10"
+        expression = compile_expression('array10 + array1 * array12 / array2', self.BANDS, self.TYPES)
+        assert expression.function == 'B10 + B1 * B12 / B2', 'Placeholders replaced incorrectly: %s' % expression.function
+        assert sorted(expression.variables) == ['B1', 'B10', 'B12', 'B2'], 'Variables are incorrect'
+        
+        expression = compile_expression('(array1 +\n array2) / 2', ['B1', 'B20'], {'B1': 'int16', 'B20': 'int16'})
+        assert expression.function == '(B1 +\n B20) / 2', 'Placeholders on several lines replaced incorrectly'
+        
+        expression = compile_expression('B1 + array1', ['B2'], {'B1': 'int16', 'B2': 'uint8'})
+        assert expression.function == 'B1 + B2', 'Variables of the inputs should be usable directly'
+        
+        expression = compile_expression('where(array1 > 0, array1, 0)', ['where1'], {'where1': 'int16'})
+        assert expression.function == 'where(where1 > 0, where1, 0)', 'Function names should not be replaced'
+
+    def test_validation(self):
+        "Test that expressions numexpr doesn't support or with unknown names are rejected"
+        for function in ['array13 + 1', 'array0 + 1', 'foo + array1', '__import__("os")', 'os.system(1)', 'array1.real',
+                         'array1 < array2 < 3', 'array1 and array2', 'lambda: 1', 'array1 +', 'array1[0]', 'array1 & 1.5', 
+                         'sqrt(array1, out=array2)']:
+            self.assertRaises(AssertionError, compile_expression, function, self.BANDS, self.TYPES)
+
+    def test_result_type_cost(self):
+        "Test result types and cost estimates"
+        assert compile_expression('array1 + array2', self.BANDS, self.TYPES).result_type == 'int32', \
+            'int16 sum should be int32'
+        # numexpr divides integers as Python 2 does
+        assert compile_expression('(array1 - array2) / (array1 + array2)', self.BANDS, self.TYPES).result_type == 'int32', \
+            'int16 division should be int32'
+        assert compile_expression('array1 / 2.0', self.BANDS, self.TYPES).result_type == 'float64', \
+            'Division by float should be float64'
+        assert compile_expression('array1 > 0', self.BANDS, self.TYPES).result_type == 'bool', 'Comparison should be bool'
+        assert compile_expression('array1 * 2', ['B1']).result_type == 'float64', 'Unknown types should be float64'
+        
+        expression = compile_expression('(array1 - array2) / (array1 + array2)', self.BANDS, self.TYPES)
+        assert expression.get_cost((2, 10)) == {'flops': 3 * 20, 'bytes': (2 + 2 + 4) * 20}, 'Cost is incorrect'
+        
+        assert compile_expression('array1 + 1', ['B1'], {'B1': 'int16'}) is compile_expression('array1 + 1', ['B1'], {'B1': 'int16'}), \
+            'Compiled expression should be cached'
+
+    def test_band_math_task(self):
+        "Test band math tasks of Analytics plans with more than ten inputs"
+        analytics = Analytics(gdf=StubGDF())
+        data = analytics.createArray('LS5TM', self.BANDS, {}, 'data')
+        task = analytics.applyBandMath(data, 'array10 + array1 * array12 / array2', 'result')
+        
+        assert task['result']['function'] == 'B10 + B1 * B12 / B2', 'Band math function is incorrect'
+        assert task['result']['array_output']['data_type'] == 'int32', 'Output data type is incorrect'
+        assert task['result']['cost'] == compile_expression('array10 + array1 * array12 / array2', self.BANDS, 
+                                                            self.TYPES).get_cost((5, 10, 10)), 'Cost is incorrect'
+        self.assertRaises(AssertionError, analytics.applyBandMath, data, 'array13 * 2', 'bad')
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestExpressions
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
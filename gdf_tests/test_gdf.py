@@ -38,6 +38,9 @@ Tests for the gdf._GDF.py module.
 
 import unittest
 import os
+import shutil
+import tempfile
+import copy
 from gdf import GDF
 
 
@@ -106,7 +109,44 @@ class TestGDF(unittest.TestCase):
         assert len(test_gdf.databases) > 0, 'At least one database must be set up'
         assert test_gdf.storage_config is not None, 'storage configuration dict not set'
         assert len(test_gdf.storage_config) > 0, 'storage configuration dict must contain at least one storage_type definition'
-        
+
+    def test_GDF_arguments(self):
+        "Test GDF constructor with explicit configuration"
+        default_gdf = GDF() # Test default configuration
+        assert default_gdf.config_files == [os.path.join(default_gdf._code_root, GDF.DEFAULT_CONFIG_FILE)], 'Default config path list is incorrect'
+        cache_dir = tempfile.mkdtemp()
+        try:
+            test_gdf = GDF(config_files=default_gdf.config_files, cache_dir=cache_dir, fast_start=True)
+            assert test_gdf.config_files == default_gdf.config_files, 'Config path list is incorrect'
+            assert test_gdf.cache_dir == cache_dir, 'Cache directory is incorrect'
+            assert test_gdf.fast_start, 'Fast start flag not set'
+            assert test_gdf.command_line_params == {}, 'Command line parameters should not be read'
+            
+            configuration = copy.deepcopy(default_gdf.configuration)
+            configuration.setdefault('gdf', {})['cache_dir'] = cache_dir
+            test_gdf = GDF(configuration=configuration)
+            assert test_gdf.config_files == [], 'No config files should be read'
+            assert test_gdf.cache_dir == cache_dir, 'Cache directory is incorrect'
+            assert test_gdf.configuration == default_gdf.configuration, 'Configuration differs from config file'
+            assert test_gdf.databases.keys() == default_gdf.databases.keys(), 'Databases differ from config file'
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_GDF_storage_config(self):
+        "Test lazy loading and refreshing of GDF storage configuration"
+        test_gdf = GDF() # Test default configuration
+
+        storage_type = test_gdf.storage_config.keys()[0]
+        assert test_gdf.storage_config.get_db_ref(storage_type) in test_gdf.databases, 'storage type db_ref not in databases'
+
+        storage_type_config = test_gdf.storage_config[storage_type]
+        assert test_gdf.storage_config.is_loaded(storage_type), 'storage type configuration not loaded on first use'
+        assert storage_type_config['storage_type_tag'] == storage_type, 'storage_type_tag is incorrect'
+        assert storage_type_config['db_ref'] == test_gdf.storage_config.get_db_ref(storage_type), 'db_ref is incorrect'
+
+        test_gdf.storage_config.refresh([storage_type])
+        assert test_gdf.storage_config[storage_type] == storage_type_config, 'Refreshed storage type configuration differs'
+
     def test_GDF_get_descriptor(self):
         "Test GDF get_descriptor function"
         #TODO: Define tests which check DB contents
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the execution_engine._masks.py module.
+'''
+
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from analytics_utils import get_pqa_mask
+from execution_engine._masks import MaskStore, compute_pqa_mask
+
+
+class StubGDF(object):
+    """GDF stand-in serving PQ data of 3 x 3 storage units of 40 x 40 pixels and 4 time slices."""
+    
+    X_INDICES = np.around(np.arange(120) * 0.01, 6)
+    Y_INDICES = np.around(-np.arange(1, 121) * 0.01, 6)
+    T_INDICES = np.array([100, 101, 102, 103]) # Solar days since epoch
+    
+    storage_config = {'LS5TMPQ': {'dimensions': {'X': {'dimension_origin': 0.0, 'dimension_extent': 0.4, 'dimension_element_size': 0.01},
+                                                 'Y': {'dimension_origin': -1.2, 'dimension_extent': 0.4, 'dimension_element_size': 0.01}}}}
+    
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.requests = []
+        
+        random_state = np.random.RandomState(1)
+        self.pqa_array = np.empty((4, 120, 120), dtype=np.int16)
+        self.pqa_array.fill(16383)
+        for _index in range(40): # Clouds and cloud shadows, including some across storage unit boundaries
+            t, y, x = random_state.randint(0, 4), random_state.randint(0, 115), random_state.randint(0, 115)
+            self.pqa_array[t, y:y + random_state.randint(1, 5), x:x + random_state.randint(1, 5)] = random_state.choice([15359, 14335, 11263, 7167])
+    
+    def get_data(self, data_request):
+        "Return PQ data within the request ranges. Upper bounds of X and Y are exclusive"
+        self.requests.append(data_request)
+        ranges = dict((dimension.upper(), dimension_dict['range']) for dimension, dimension_dict in data_request['dimensions'].items())
+        x_selection = np.where((self.X_INDICES >= ranges['X'][0]) & (self.X_INDICES < ranges['X'][1] - 1e-6))[0]
+        y_selection = np.where((self.Y_INDICES >= ranges['Y'][0]) & (self.Y_INDICES < ranges['Y'][1] - 1e-6))[0]
+        t_selection = np.where((self.T_INDICES * 86400 >= ranges['T'][0]) & (self.T_INDICES * 86400 <= ranges['T'][1]))[0]
+        if not (len(x_selection) and len(y_selection) and len(t_selection)):
+            return None
+        return {'arrays': {'PQ': self.pqa_array[np.ix_(t_selection, y_selection, x_selection)]},
+                'indices': {'T': self.T_INDICES[t_selection], 'Y': self.Y_INDICES[y_selection], 'X': self.X_INDICES[x_selection]},
+                'dimensions': ['T', 'Y', 'X']}
+        
+    def get_result(self, x_range, y_range):
+        "Return get_data task result for PQ data within the ranges"
+        data_response = self.get_data({'dimensions': {'X': {'range': x_range}, 'Y': {'range': y_range}, 'T': {'range': (0, 1e10)}}})
+        return {'array_result': data_response['arrays'], 
+                'array_indices': data_response['indices'], 
+                'array_dimensions': data_response['dimensions'],
+                'array_output': {'storage_type': 'LS5TMPQ', 
+                                 'dimensions': {'X': {'range': x_range}, 'Y': {'range': y_range}, 'T': {'range': (0, 1e10)}}}}
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestMaskStore(unittest.TestCase):
+    """Unit tests for MaskStore class."""
+
+    MODULE = 'execution_engine._masks'
+    SUITE = 'TestMaskStore'
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.gdf = StubGDF(self.cache_dir)
+        self.full_mask = get_pqa_mask(self.gdf.pqa_array)
+        
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        
+    def get_mask_files(self):
+        "Return list of stored mask file names"
+        return [filename for _dir_path, _dir_names, filenames in os.walk(self.cache_dir) for filename in filenames]
+
+    def test_stored_masks(self):
+        "Test that masks are computed once per storage unit and match masks of the whole array"
+        mask_store = MaskStore(self.gdf)
+        assert mask_store.mask_dir == os.path.join(self.cache_dir, 'pqa_masks'), 'Mask directory is incorrect'
+        
+        mask = mask_store.get_mask(self.gdf.get_result((0.0, 1.2), (-1.2, 0.0)))
+        assert np.array_equal(mask.to_array(), self.full_mask), 'Stored mask differs from mask of whole array'
+        assert len(self.get_mask_files()) == 9 * 4, 'Masks of each storage unit and time slice should be stored'
+        
+        del self.gdf.requests[:]
+        mask = MaskStore(self.gdf).get_mask(self.gdf.get_result((0.0, 1.2), (-1.2, 0.0)))
+        assert len(self.gdf.requests) == 1, 'Stored masks should not be recomputed'
+        assert np.array_equal(mask.to_array(), self.full_mask), 'Reloaded mask differs from mask of whole array'
+        
+        mask_store.clear('LS5TMPQ')
+        assert self.get_mask_files() == [], 'Stored masks not removed'
+
+    def test_partial_range(self):
+        "Test that masks of part of the storage units include the dilation of flags outside the request range"
+        mask_store = MaskStore(self.gdf)
+        mask_result = self.gdf.get_result((0.13, 0.77), (-0.9, -0.21))
+        mask = mask_store.get_mask(mask_result).to_array()
+        
+        x_selection = np.where((StubGDF.X_INDICES >= 0.13) & (StubGDF.X_INDICES < 0.77 - 1e-6))[0]
+        y_selection = np.where((StubGDF.Y_INDICES >= -0.9) & (StubGDF.Y_INDICES < -0.21 - 1e-6))[0]
+        expected_mask = self.full_mask[np.ix_(range(4), y_selection, x_selection)]
+        assert np.array_equal(mask, expected_mask), 'Mask differs from mask of whole array'
+        assert not np.array_equal(mask, get_pqa_mask(mask_result['array_result']['PQ'])), \
+            'Test data should have flags dilated into the request range'
+        
+        # Other dimension orders
+        transposed_result = dict(mask_result, array_result={'PQ': mask_result['array_result']['PQ'].transpose(2, 0, 1)},
+                                 array_dimensions=['X', 'T', 'Y'])
+        assert np.array_equal(mask_store.get_mask(transposed_result).to_array(), expected_mask.transpose(2, 0, 1)), \
+            'Transposed mask differs'
+
+    def test_unstored_masks(self):
+        "Test that masks are computed from the request without a mask directory"
+        mask_store = MaskStore(object())
+        assert mask_store.mask_dir is None, 'No mask directory should be set'
+        
+        mask_result = self.gdf.get_result((0.13, 0.77), (-0.9, -0.21))
+        del self.gdf.requests[:]
+        mask = mask_store.get_mask(mask_result)
+        assert self.gdf.requests == [], 'PQ data should not be read'
+        assert np.array_equal(mask.to_array(), get_pqa_mask(mask_result['array_result']['PQ'])), 'Mask differs'
+        assert np.array_equal(compute_pqa_mask(mask_result['array_result']['PQ']).to_array(), mask.to_array()), \
+            'compute_pqa_mask differs'
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestMaskStore
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the execution_engine._online.py module.
+'''
+
+
+import unittest
+import warnings
+import numpy as np
+from execution_engine._online import TIME_EPSILON, P2QuantileReducer, get_reducer, get_streaming_plan, get_time_chunks, \
+    set_time_range
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestOnlineReducers(unittest.TestCase):
+    """Unit tests for online reductions over T."""
+
+    MODULE = 'execution_engine._online'
+    SUITE = 'TestOnlineReducers'
+
+    CHUNK_SIZES = [1, 7, 3, 20, 9] # Uneven chunks of 40 time slices
+
+    def get_test_array(self, shape=(40, 6, 5), offset=0.0):
+        "Return random T x Y x X array with NaN values, including an element with no valid values"
+        random_state = np.random.RandomState(0)
+        array = random_state.normal(offset, 10.0, shape)
+        array[random_state.rand(*shape) < 0.3] = np.nan
+        array[:, 0, 0] = np.nan
+        array[:35, 1, 1] = np.nan # Valid values in last chunk only
+        return array
+
+    def reduce_chunks(self, reducer, array):
+        "Return result of reducer updated with successive chunks of array along axis 0"
+        chunk_start = 0
+        for chunk_size in self.CHUNK_SIZES:
+            reducer.update(array[chunk_start:chunk_start + chunk_size], 0)
+            chunk_start += chunk_size
+        return reducer.result()
+
+    def test_exact_reducers(self):
+        "Test exact online reducers against the NaN-aware numpy functions"
+        array = self.get_test_array()
+        expected_functions = {'min': np.nanmin, 'max': np.nanmax, 'mean': np.nanmean, 'std': np.nanstd, 
+                              'var': np.nanvar, 'sum': np.nansum, 'prod': np.nanprod,
+                              'ptp': lambda array, axis: np.nanmax(array, axis=axis) - np.nanmin(array, axis=axis),
+                              'count': lambda array, axis: np.sum(~np.isnan(array), axis=axis),
+                              'argmax': lambda array, axis: np.argmax(np.where(np.isnan(array), -np.inf, array), axis=axis),
+                              'argmin': lambda array, axis: np.argmin(np.where(np.isnan(array), np.inf, array), axis=axis)
+                              }
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for function_name, expected_function in expected_functions.items():
+                result = self.reduce_chunks(get_reducer(function_name), array)
+                expected_result = expected_function(array, axis=0)
+                if function_name.startswith('arg'):
+                    assert np.isnan(result[0, 0]), '%s of element without valid values should be NaN' % function_name
+                    result[0, 0] = expected_result[0, 0]
+                assert np.allclose(result, expected_result, equal_nan=True), '%s differs' % function_name
+        
+        zero_array = np.zeros((3, 2))
+        zero_array[0, 0] = np.nan
+        zero_array[1, 1] = 1.0
+        for function_name, expected_result in [('all', [False, False]), ('any', [False, True])]:
+            reducer = get_reducer(function_name)
+            reducer.update(zero_array[:1], 0)
+            reducer.update(zero_array[1:], 0)
+            assert reducer.result().tolist() == expected_result, '%s differs' % function_name
+
+    def test_moment_merge(self):
+        "Test that chunk variances are merged accurately for values with a large mean"
+        array = self.get_test_array(offset=1.0e9)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            expected_var = np.nanvar(array, axis=0)
+            expected_mean = np.nanmean(array, axis=0)
+        
+        var = self.reduce_chunks(get_reducer('var'), array)
+        assert np.allclose(var, expected_var, rtol=1e-6, equal_nan=True), 'Merged variance differs'
+        assert np.allclose(self.reduce_chunks(get_reducer('mean'), array), expected_mean, rtol=1e-12, equal_nan=True), \
+            'Merged mean differs'
+        assert np.isnan(var[0, 0]) and not np.isnan(var[1, 1]), 'Elements with no valid values should be NaN'
+
+    def test_p2_quantile(self):
+        "Test the P-square quantile estimate against exact quantiles"
+        random_state = np.random.RandomState(1)
+        array = random_state.normal(0.0, 1.0, (2000, 4, 3))
+        array[random_state.rand(*array.shape) < 0.2] = np.nan
+        array[:, 0, 0] = np.nan
+        array[3:, 0, 1] = np.nan # Too few values for the markers
+        
+        for quantile in [0.1, 0.5, 0.9]:
+            reducer = get_reducer('quantile', approximate=True, arguments=(quantile,))
+            assert isinstance(reducer, P2QuantileReducer), 'quantile should be approximate'
+            for chunk_start in range(0, len(array), 300):
+                reducer.update(array[chunk_start:chunk_start + 300], 0)
+            result = reducer.result()
+            
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                expected_result = np.nanpercentile(array, quantile * 100.0, axis=0)
+            assert np.isnan(result[0, 0]), 'Element without valid values should be NaN'
+            assert result[0, 1] == expected_result[0, 1], 'Quantile of fewer than five values should be exact'
+            error = np.abs(result - expected_result)[1:]
+            assert (error < 0.1).all(), 'Estimate of quantile %s is off by %s' % (quantile, error.max())
+        
+        assert get_reducer('median') is None, 'median should only be approximate'
+        assert get_reducer('median', approximate=True).quantile == 0.5, 'Approximate median not created'
+        assert get_reducer('percentile', approximate=True) is None, 'percentile without argument should fail'
+
+    def test_time_chunks(self):
+        "Test splitting of T ranges on storage unit boundaries"
+        # Storage units of 100 from origin 0
+        assert get_time_chunks((50, 250), 0, 100) == [(50, 100 - TIME_EPSILON), (100, 200 - TIME_EPSILON), (200, 250)], \
+            'Chunks within units are incorrect'
+        assert get_time_chunks((100, 200), 0, 100) == [(100, 200)], 'Range on unit boundaries should be one chunk'
+        assert get_time_chunks((100, 200.5), 0, 100) == [(100, 200 - TIME_EPSILON), (200, 200.5)], \
+            'Range just past a boundary should be two chunks'
+        assert get_time_chunks((120, 130), 0, 100) == [(120, 130)], 'Range within a unit should be one chunk'
+        assert get_time_chunks((-150, 150), 0, 100, units_per_chunk=2) == [(-150, 0 - TIME_EPSILON), (0, 150)], \
+            'Chunks of several units are incorrect'
+        assert get_time_chunks((5, 35), 10, 10) == [(5, 10 - TIME_EPSILON), (10, 20 - TIME_EPSILON), 
+                                                    (20, 30 - TIME_EPSILON), (30, 35)], 'Chunks from origin are incorrect'
+
+    def test_streaming_plan(self):
+        "Test splitting of plans into streamed inputs, reductions over T and remaining tasks"
+        plan = [{'data': {'array_input': [{'LS5TM': {'dimensions': {'t': {'range': (0, 100)}, 'x': {'range': (140, 141)}}}}], 
+                          'orig_function': 'get_data'}},
+                {'ndvi': {'array_input': ['data'], 'orig_function': 'bandmath'}},
+                {'mean': {'array_input': ['ndvi'], 'dimension': ['t'], 'orig_function': 'mean(array1)'}},
+                {'scaled': {'array_input': ['mean'], 'orig_function': 'bandmath'}}
+                ]
+        get_reduction = lambda task: ('mean', ()) if task.values()[0].get('dimension') else None
+        
+        input_plan, reduction_plan, output_plan = get_streaming_plan(plan, get_reduction)
+        assert [task.keys()[0] for task in input_plan] == ['data', 'ndvi'], 'Input tasks are incorrect'
+        assert [task.keys()[0] for task in reduction_plan] == ['mean'], 'Reduction tasks are incorrect'
+        assert [task.keys()[0] for task in output_plan] == ['scaled'], 'Output tasks are incorrect'
+        
+        # Full result of an input task is needed
+        assert get_streaming_plan(plan + [{'other': {'array_input': ['ndvi'], 'orig_function': 'bandmath'}}], 
+                                  get_reduction) is None, 'Plan using full input should not be streamed'
+        
+        time_plan = set_time_range(plan, (10, 20))
+        assert time_plan[0]['data']['array_input'][0]['LS5TM']['dimensions']['t']['range'] == (10, 20), 'T range not set'
+        assert time_plan[0]['data']['array_input'][0]['LS5TM']['dimensions']['x']['range'] == (140, 141), 'X range changed'
+        assert plan[0]['data']['array_input'][0]['LS5TM']['dimensions']['t']['range'] == (0, 100), 'Original plan modified'
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestOnlineReducers
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
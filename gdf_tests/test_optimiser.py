@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the execution_engine._optimiser.py module.
+'''
+
+
+import unittest
+import copy
+import numpy as np
+import numexpr as ne
+from execution_engine._optimiser import FUSED_FUNCTION, eliminate_common_tasks, fuse_plan, prune_plan, push_down_ranges, \
+    push_down_variables, share_reads
+from execution_engine._tiling import MASK_OVERLAP
+
+
+def get_data_task(name, variables, storage_type='LS5TM', ranges=None):
+    "Return get_data task reading variables"
+    dimensions = ranges or {'X': {'range': (140.0, 141.0)}, 'Y': {'range': (-36.0, -35.0)}, 'T': {'range': (0, 100)}}
+    return {name: {'array_input': [{variable: {'storage_type': storage_type, 'variable': variable, 
+                                               'dimensions': copy.deepcopy(dimensions), 'dimensions_order': ['T', 'Y', 'X'], 
+                                               'shape': (4, 4000, 4000)}} 
+                                   for variable in variables],
+                   'array_output': {'no_data_value': -999},
+                   'orig_function': 'get_data'}}
+
+def band_math_task(name, function, array_input, no_data_value=-999):
+    "Return band math task"
+    return {name: {'array_input': array_input, 'function': function, 'orig_function': function,
+                   'array_output': {'no_data_value': no_data_value, 'variable': name}}}
+
+def cloud_mask_task(name, array_input, array_mask, no_data_value=-999):
+    "Return cloud mask task"
+    return {name: {'array_input': [array_input], 'array_mask': array_mask, 'function': 'apply_cloud_mask', 
+                   'orig_function': 'apply_cloud_mask', 'array_output': {'no_data_value': no_data_value, 'variable': name}}}
+
+def reduction_task(name, function_name, array_input, no_data_value=-999):
+    "Return reduction over T"
+    return {name: {'array_input': [array_input], 'function': '%s(array1)' % function_name, 'dimension': ['T'],
+                   'orig_function': '%s(array1)' % function_name, 
+                   'array_output': {'no_data_value': no_data_value, 'variable': name}}}
+
+def get_reduction(task):
+    "Return (operator name, arguments) tuple of reduction tasks"
+    task_dict = task.values()[0]
+    if 'dimension' in task_dict:
+        return (task_dict['function'].split('(')[0], ())
+    return None
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestPlanFusion(unittest.TestCase):
+    """Unit tests for fusing chains of elementwise tasks."""
+
+    MODULE = 'execution_engine._optimiser'
+    SUITE = 'TestPlanFusion'
+
+    def get_test_arrays(self):
+        "Return dict of B30, B40 and PQA mask arrays with no data values"
+        random_state = np.random.RandomState(0)
+        arrays = {'B30': random_state.randint(0, 2000, 1000).astype(np.float32),
+                  'B40': random_state.randint(0, 2000, 1000).astype(np.float32),
+                  'pqa_mask_0': random_state.rand(1000) < 0.7}
+        arrays['B30'][random_state.rand(1000) < 0.1] = -999
+        arrays['B40'][random_state.rand(1000) < 0.1] = -999
+        arrays['B30'][:10] = 1000 # Values giving the no data value of band math
+        arrays['B40'][:10] = 1
+        return arrays
+
+    def execute_unfused(self, plan, arrays):
+        "Return dict of results of each task of a plan evaluated separately, as the ExecutionEngine does"
+        results = {}
+        for task in plan:
+            name, task_dict = task.items()[0]
+            if task_dict['orig_function'] == 'get_data':
+                results[name] = [variable.keys()[0] for variable in task_dict['array_input'] if variable.keys()[0] in arrays]
+                results.update((variable, arrays[variable]) for variable in results[name])
+                continue
+            
+            no_data_value = task_dict['array_output']['no_data_value']
+            first_input = task_dict['array_input'][0]
+            input_arrays = [results[variable] for variable in results[first_input]] if isinstance(results[first_input], list) \
+                else [results[first_input]]
+            if task_dict['orig_function'] == 'apply_cloud_mask':
+                results[name] = np.where(arrays['pqa_mask_0'], input_arrays[0], no_data_value)
+            else:
+                no_data = np.zeros(input_arrays[0].shape, dtype=np.bool)
+                for input_array in input_arrays:
+                    no_data |= (input_array == task_dict['array_output']['no_data_value'])
+                local_dict = dict((key, value) for key, value in results.items() if not isinstance(value, list))
+                results[name] = np.where(no_data, no_data_value, ne.evaluate(task_dict['function'], local_dict=local_dict))
+        return results
+
+    def execute_fused(self, task, arrays):
+        "Return result of a fused task"
+        local_dict = dict(arrays)
+        for mask_name in task.values()[0]['masks'].keys():
+            local_dict[mask_name] = arrays['pqa_mask_0']
+        return ne.evaluate(task.values()[0]['function'], local_dict=local_dict)
+
+    def test_fused_chain(self):
+        "Test that fusing band math and cloud masks propagates no data values as separate tasks do"
+        for no_data_value in [-999, -1]:
+            plan = [get_data_task('data', ['B30', 'B40']),
+                    get_data_task('pqa', ['PQ'], 'LS5TMPQ'),
+                    band_math_task('diff', '(B40 - B30)', ['data']),
+                    cloud_mask_task('masked', 'diff', 'pqa'),
+                    band_math_task('scaled', '(masked + 1)', ['masked'], no_data_value),
+                    band_math_task('ratio', '(scaled / 2)', ['scaled'], no_data_value)
+                    ]
+            fused_plan = fuse_plan(plan, get_reduction)
+            
+            assert [task.keys()[0] for task in fused_plan] == ['data', 'pqa', 'ratio'], 'Chain not fused'
+            fused_dict = fused_plan[2]['ratio']
+            assert fused_dict['orig_function'] == FUSED_FUNCTION, 'Fused task not marked'
+            assert fused_dict['fused_tasks'] == ['diff', 'masked', 'scaled', 'ratio'], 'Fused tasks are incorrect'
+            assert fused_dict['array_input'] == ['data', 'pqa'], 'Fused inputs are incorrect'
+            assert fused_dict['masks'].values() == ['pqa'], 'Mask not referenced'
+            assert fused_dict['index_input'] == 'data', 'Index input is incorrect'
+            
+            arrays = self.get_test_arrays()
+            expected_result = self.execute_unfused(plan, arrays)['ratio']
+            result = self.execute_fused(fused_plan[2], arrays)
+            assert (result == expected_result).all(), 'Fused result with no data value %s differs at %d elements' % (
+                no_data_value, (result != expected_result).sum())
+            if no_data_value == -999: # Only inputs with the same no data value propagate it
+                assert (result[:10] == no_data_value).all(), 'Computed no data values not propagated'
+
+    def test_fused_reduction(self):
+        "Test fusing of a chain into the reduction consuming it and tasks which can't be fused"
+        plan = [get_data_task('data', ['B30', 'B40']),
+                band_math_task('ndvi', '((B40 - B30) / (B40 + B30))', ['data']),
+                reduction_task('median', 'median', 'ndvi')
+                ]
+        fused_plan = fuse_plan(plan, get_reduction)
+        assert [task.keys()[0] for task in fused_plan] == ['data', 'median'], 'Reduction not fused'
+        fused_dict = fused_plan[1]['median']
+        assert fused_dict['fused_variable'] == 'ndvi' and fused_dict['reduction']['function'] == 'median(array1)', \
+            'Fused reduction is incorrect'
+        
+        # Results with several consumers are cached
+        plan.append(band_math_task('scaled', '(ndvi * 2)', ['ndvi']))
+        assert [task.keys()[0] for task in fuse_plan(plan, get_reduction)] == ['data', 'ndvi', 'median', 'scaled'], \
+            'Shared result should not be fused'
+        
+        # Inputs outside the plan are not described by it
+        plan = [band_math_task('scaled', '(ndvi * 2)', ['ndvi']), band_math_task('offset', '(scaled + 1)', ['scaled'])]
+        assert [task.keys()[0] for task in fuse_plan(plan, get_reduction)] == ['scaled', 'offset'], \
+            'Task using cached input should not be fused'
+        
+        
+class TestPlanRewriting(unittest.TestCase):
+    """Unit tests for pruning, common task elimination and shared reads."""
+
+    MODULE = 'execution_engine._optimiser'
+    SUITE = 'TestPlanRewriting'
+
+    def get_test_plan(self):
+        "Return plan computing NDVI twice from separate reads of the same storage type, and an unused task"
+        return [get_data_task('data1', ['B30', 'B40']),
+                get_data_task('data2', ['B40', 'B50']),
+                band_math_task('ndvi1', '((B40 - B30) / (B40 + B30))', ['data1']),
+                band_math_task('ndvi2', '((B40 - B30) / (B40 + B30))', ['data1']),
+                band_math_task('unused', '(B50 * 2)', ['data2']),
+                band_math_task('diff', '(ndvi1 - ndvi2)', ['ndvi1', 'ndvi2'])
+                ]
+
+    def test_prune_plan(self):
+        "Test removal of tasks not needed by the outputs"
+        plan = self.get_test_plan()
+        assert [task.keys()[0] for task in prune_plan(plan, ['diff'])] == ['data1', 'ndvi1', 'ndvi2', 'diff'], \
+            'Pruned plan is incorrect'
+        assert [task.keys()[0] for task in prune_plan(plan, ['ndvi1', 'unused'])] == ['data1', 'data2', 'ndvi1', 'unused'], \
+            'Pruned plan with several outputs is incorrect'
+        assert prune_plan(plan, ['missing']) == [], 'Unknown outputs should need no tasks'
+
+    def test_eliminate_common_tasks(self):
+        "Test that duplicate tasks are replaced by earlier identical tasks"
+        plan = self.get_test_plan()
+        optimised_plan = eliminate_common_tasks(plan)
+        
+        assert [task.keys()[0] for task in optimised_plan] == ['data1', 'data2', 'ndvi1', 'unused', 'diff'], \
+            'Duplicate task not removed'
+        diff_dict = optimised_plan[-1]['diff']
+        assert diff_dict['array_input'] == ['ndvi1', 'ndvi1'], 'Consumer inputs not replaced'
+        assert diff_dict['function'] == '(ndvi1 - ndvi1)', 'Consumer function not updated'
+        assert plan[-1]['diff']['function'] == '(ndvi1 - ndvi2)', 'Original plan modified'
+        
+        # Plan outputs are kept
+        optimised_plan = eliminate_common_tasks(plan[:4])
+        assert [task.keys()[0] for task in optimised_plan] == ['data1', 'data2', 'ndvi1', 'ndvi2'], 'Output removed'
+        
+        # Tasks with different output no data values differ
+        plan[3]['ndvi2']['array_output']['no_data_value'] = -1
+        assert len(eliminate_common_tasks(plan)) == len(plan), 'Tasks with different outputs should be kept'
+
+    def test_share_reads(self):
+        "Test that reads of the same storage type and dimensions are shared"
+        plan = self.get_test_plan() + [get_data_task('pqa', ['PQ'], 'LS5TMPQ')]
+        plan = share_reads(plan)
+        
+        shared_read = plan[0]['data1']['shared_read']
+        assert plan[1]['data2']['shared_read'] == shared_read, 'Read not shared'
+        assert shared_read['key'] == 'data1' and shared_read['tasks'] == 2, 'Shared read is incorrect'
+        assert shared_read['variables'] == ['B30', 'B40', 'B50'], 'Shared variables are incorrect'
+        assert shared_read['users'] == {'B30': 1, 'B40': 2, 'B50': 1}, 'Variable users are incorrect'
+        assert 'shared_read' not in plan[-1]['pqa'], 'Different storage type should not be shared'
+        
+        plan = self.get_test_plan()
+        plan[1]['data2']['array_input'][0]['B40']['dimensions']['T']['range'] = (0, 50)
+        plan = share_reads(plan)
+        assert 'shared_read' not in plan[0]['data1'], 'Different dimensions should not be shared'
+        
+        
+class TestPushDown(unittest.TestCase):
+    """Unit tests for restricting the ranges and variables read by get_data tasks."""
+
+    MODULE = 'execution_engine._optimiser'
+    SUITE = 'TestPushDown'
+
+    def get_read_range(self, plan, name, dimension):
+        "Return range read by first array of a get_data task"
+        return plan[[task.keys()[0] for task in plan].index(name)][name]['array_input'][0].values()[0]['dimensions'][dimension]['range']
+
+    def test_push_down_ranges(self):
+        "Test restriction of read ranges to the ranges required of the outputs"
+        plan = [get_data_task('data', ['B30', 'B40']),
+                band_math_task('ndvi', '((B40 - B30) / (B40 + B30))', ['data'])]
+        ranges = {'X': (140.2, 140.4), 'Y': (-35.9, -35.8), 'T': (10, 20)}
+        
+        optimised_plan = push_down_ranges(plan, ranges)
+        for dimension in ['X', 'Y', 'T']:
+            assert self.get_read_range(optimised_plan, 'data', dimension) == ranges[dimension], '%s range not restricted' % dimension
+        assert self.get_read_range(plan, 'data', 'X') == (140.0, 141.0), 'Original plan modified'
+        
+        # Ranges are limited to the ranges read
+        optimised_plan = push_down_ranges(plan, {'X': (139.0, 140.5)})
+        assert self.get_read_range(optimised_plan, 'data', 'X') == (140.0, 140.5), 'X range should be within read range'
+        
+        # Cloud masks need the pixels around the outputs
+        plan += [get_data_task('pqa', ['PQ'], 'LS5TMPQ'), cloud_mask_task('masked', 'ndvi', 'pqa')]
+        optimised_plan = push_down_ranges(plan, ranges)
+        overlap = MASK_OVERLAP * 0.00025
+        for name in ['data', 'pqa']:
+            x_range = self.get_read_range(optimised_plan, name, 'X')
+            assert np.allclose(x_range, (140.2 - overlap, 140.4 + overlap)), 'X range of %s not widened by mask overlap' % name
+            assert self.get_read_range(optimised_plan, name, 'T') == ranges['T'], 'T range should not be widened'
+        
+        # Reduced dimensions need all values
+        plan.append(reduction_task('median', 'median', 'masked'))
+        optimised_plan = push_down_ranges(plan, ranges)
+        assert self.get_read_range(optimised_plan, 'data', 'T') == (0, 100), 'Reduced T range should not be restricted'
+        
+        # Reads with different ranges are not restricted
+        plan[2]['pqa']['array_input'][0]['PQ']['dimensions']['Y']['range'] = (-36.0, -35.5)
+        optimised_plan = push_down_ranges(plan, ranges)
+        assert self.get_read_range(optimised_plan, 'data', 'Y') == (-36.0, -35.0), 'Different Y ranges should not be restricted'
+
+    def test_push_down_variables(self):
+        "Test removal of variables which no consumer uses"
+        plan = [get_data_task('data', ['B30', 'B40', 'B50']),
+                get_data_task('other', ['B30', 'B40']),
+                band_math_task('ndvi', '((B40 - B30) / (B40 + B30))', ['other', 'data'])]
+        
+        optimised_plan = push_down_variables(plan)
+        assert [variable.keys()[0] for variable in optimised_plan[0]['data']['array_input']] == ['B30', 'B40'], \
+            'Unused variable not removed'
+        assert [variable.keys()[0] for variable in optimised_plan[1]['other']['array_input']] == ['B30', 'B40'], \
+            'Variables of first input should be kept for no data propagation'
+        assert len(plan[0]['data']['array_input']) == 3, 'Original plan modified'
+        
+        # Whole results are used by reductions and cloud masks
+        plan.append(reduction_task('median', 'median', 'data'))
+        optimised_plan = push_down_variables(plan)
+        assert len(optimised_plan[0]['data']['array_input']) == 3, 'Variables used by reduction removed'
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestPlanFusion,
+                    TestPlanRewriting,
+                    TestPushDown
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the execution_engine._reductions.py module.
+'''
+
+
+import unittest
+import warnings
+import numpy as np
+from execution_engine._reductions import get_kernel, parse_reduction, reduce_array, to_nan_array
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestReductions(unittest.TestCase):
+    """Unit tests for reductions ignoring no data values."""
+
+    MODULE = 'execution_engine._reductions'
+    SUITE = 'TestReductions'
+
+    NO_DATA_VALUE = -999
+
+    def get_test_array(self, shape=(6, 5, 4), dtype=np.int16):
+        "Return random array with no data values, including an element with no valid values"
+        random_state = np.random.RandomState(0)
+        array = random_state.randint(0, 100, shape).astype(dtype)
+        array[random_state.rand(*shape) < 0.3] = self.NO_DATA_VALUE
+        array[:, 0, 0] = self.NO_DATA_VALUE
+        return array
+
+    def get_nan_array(self, array):
+        "Return float64 copy of array with NaN for no data values"
+        nan_array = array.astype(np.float64)
+        nan_array[array == self.NO_DATA_VALUE] = np.nan
+        return nan_array
+
+    def test_parse_reduction(self):
+        "Test parsing of reduction function calls"
+        assert parse_reduction('median(array1)') == ('median', ()), 'Function without arguments parsed incorrectly'
+        assert parse_reduction(' percentile( array1 , 10 ) ') == ('percentile', (10.0,)), 'Arguments parsed incorrectly'
+        assert parse_reduction('array1 * 2') is None, 'Expression should not be a reduction'
+        assert parse_reduction('percentile(array1, x)') is None, 'Non-numeric arguments should not be parsed'
+        
+        assert get_kernel('median') is not None, 'No median kernel'
+        assert get_kernel('median', (1.0,)) is None, 'Unexpected arguments should give no kernel'
+        assert get_kernel('unknown') is None, 'Unknown operator should give no kernel'
+        self.assertRaises(ValueError, get_kernel, 'percentile')
+
+    def test_to_nan_array(self):
+        "Test conversion of no data values to NaN"
+        array = self.get_test_array()
+        nan_array = to_nan_array(array, self.NO_DATA_VALUE)
+        assert nan_array.dtype == np.float64, 'Integer arrays should be converted to float64'
+        assert (np.isnan(nan_array) == (array == self.NO_DATA_VALUE)).all(), 'No data values not converted'
+        assert (array == self.get_test_array()).all(), 'Input array modified'
+        
+        float_array = array.astype(np.float32)
+        assert to_nan_array(float_array, self.NO_DATA_VALUE).dtype == np.float32, 'float32 arrays should stay float32'
+        assert to_nan_array(float_array, self.NO_DATA_VALUE, overwrite_input=True) is float_array, \
+            'float32 array should be converted in place'
+
+    def test_reduce_array(self):
+        "Test reductions over one and several axes against the NaN-aware numpy functions"
+        array = self.get_test_array()
+        nan_array = self.get_nan_array(array)
+        
+        expected_functions = {'min': np.nanmin, 'max': np.nanmax, 'mean': np.nanmean, 'std': np.nanstd, 
+                              'var': np.nanvar, 'sum': np.nansum, 'prod': np.nanprod, 'median': np.nanmedian,
+                              'ptp': lambda array, axis: np.nanmax(array, axis=axis) - np.nanmin(array, axis=axis)
+                              }
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for axes in [[0], [1, 2], [0, 2], [0, 1, 2]]:
+                for function_name, expected_function in expected_functions.items():
+                    result = reduce_array(array, axes, function_name, self.NO_DATA_VALUE)
+                    expected_result = expected_function(nan_array, axis=tuple(axes))
+                    assert np.allclose(result, expected_result, equal_nan=True), '%s over %s differs' % (function_name, axes)
+        
+    def test_special_kernels(self):
+        "Test reductions of elements without valid values"
+        array = self.get_test_array()
+        nan_array = self.get_nan_array(array)
+        
+        argmax = reduce_array(array, [0], 'argmax', self.NO_DATA_VALUE)
+        assert np.isnan(argmax[0, 0]), 'argmax of element without valid values should be NaN'
+        assert (argmax[~np.isnan(argmax)] == np.nanargmax(np.where(np.isnan(nan_array), -np.inf, nan_array), 
+                                                          axis=0)[~np.isnan(argmax)]).all(), 'argmax differs'
+        
+        assert reduce_array(array, [0], 'all', self.NO_DATA_VALUE)[0, 0], 'all of no valid values should be True'
+        assert not reduce_array(array, [0], 'any', self.NO_DATA_VALUE)[0, 0], 'any of no valid values should be False'
+        assert reduce_array(array, [0], 'sum', self.NO_DATA_VALUE)[0, 0] == 0, 'sum of no valid values should be 0'
+        
+    def test_quantiles(self):
+        "Test percentiles and quantiles of elements with different numbers of valid values against numpy"
+        for dtype in [np.int16, np.float32]:
+            array = self.get_test_array((20, 6, 5), dtype)
+            nan_array = self.get_nan_array(array)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                for axes in [[0], [0, 1], [0, 1, 2]]:
+                    for percentile in [0, 10, 25, 50, 90, 100]:
+                        result = reduce_array(array, axes, 'percentile', self.NO_DATA_VALUE, (percentile,))
+                        expected_result = np.nanpercentile(nan_array, percentile, axis=tuple(axes))
+                        assert np.allclose(result, expected_result, equal_nan=True, rtol=1e-6), \
+                            '%s percentile %s over %s differs' % (np.dtype(dtype).name, percentile, axes)
+                        
+                    result = reduce_array(array, axes, 'quantile', self.NO_DATA_VALUE, (0.25,))
+                    assert np.allclose(result, np.nanpercentile(nan_array, 25, axis=tuple(axes)), equal_nan=True, rtol=1e-6), \
+                        'quantile over %s differs' % axes
+        
+        # Without no data values
+        array = np.random.RandomState(1).rand(7, 3, 4)
+        assert np.allclose(reduce_array(array, [0], 'median', None), np.median(array, axis=0)), 'median differs'
+        
+        nan_array = to_nan_array(self.get_test_array(), self.NO_DATA_VALUE)
+        result = reduce_array(nan_array, [0], 'percentile', None, (50,), overwrite_input=True)
+        assert result.shape == (5, 4), 'Result shape is incorrect'
+        self.assertRaises(ValueError, get_kernel, 'percentile', (101,))
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestReductions
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
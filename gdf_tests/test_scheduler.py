@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the execution_engine._scheduler.py module.
+'''
+
+
+import unittest
+import time
+import threading
+from execution_engine._scheduler import PlanScheduler, get_plan_graph, get_task_dependencies
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestPlanScheduler(unittest.TestCase):
+    """Unit tests for plan scheduling."""
+
+    MODULE = 'execution_engine._scheduler'
+    SUITE = 'TestPlanScheduler'
+
+    # Two reads, a band math task using both, a masked reduction and an output using the band math result
+    TEST_PLAN = [{'data': {'array_input': [{'LS5TM': {'variables': {'B40': {}}}}], 'orig_function': 'get_data'}},
+                 {'pqa': {'array_input': [{'LS5TMPQ': {'variables': {'PQ': {}}}}], 'orig_function': 'get_data'}},
+                 {'ndvi': {'array_input': ['data', 'data'], 'orig_function': 'bandmath'}},
+                 {'masked': {'array_input': ['ndvi'], 'array_mask': 'pqa', 'orig_function': 'apply_cloud_mask'}},
+                 {'median': {'array_input': ['masked', 'cached'], 'orig_function': 'reduction'}}
+                 ]
+
+    def test_plan_graph(self):
+        "Test task dependencies and consumers"
+        assert get_task_dependencies(self.TEST_PLAN[0]) == [], 'get_data inputs are not tasks'
+        assert get_task_dependencies(self.TEST_PLAN[2]) == ['data'], 'Repeated inputs should be listed once'
+        assert get_task_dependencies(self.TEST_PLAN[3]) == ['ndvi', 'pqa'], 'Mask should be a dependency'
+        
+        dependencies, consumers = get_plan_graph(self.TEST_PLAN)
+        assert dependencies['median'] == ['masked'], 'Tasks outside the plan should be ignored'
+        assert consumers == {'data': ['ndvi'], 'pqa': ['masked'], 'ndvi': ['masked'], 'masked': ['median'], 'median': []}, \
+            'Consumers are incorrect'
+
+    def test_run(self):
+        "Test that tasks run after their dependencies and results are released after their last consumer"
+        lock = threading.Lock()
+        finished = []
+        released = []
+        
+        def execute_function(task):
+            name = task.keys()[0]
+            time.sleep(0.01)
+            with lock:
+                for dependency in get_task_dependencies(task):
+                    assert dependency in finished or dependency == 'cached', '%s ran before %s' % (name, dependency)
+                    assert dependency not in released, '%s released before %s ran' % (dependency, name)
+                finished.append(name)
+        
+        def release_function(name):
+            with lock:
+                released.append(name)
+        
+        PlanScheduler(self.TEST_PLAN, execute_function, num_workers=4, release_function=release_function).run()
+        assert sorted(finished) == sorted(task.keys()[0] for task in self.TEST_PLAN), 'Not all tasks were run'
+        assert sorted(released) == ['data', 'masked', 'ndvi', 'pqa'], 'Intermediates released incorrectly'
+
+    def test_errors(self):
+        "Test that task exceptions are raised and circular dependencies are detected"
+        executed = []
+        
+        def execute_function(task):
+            name = task.keys()[0]
+            executed.append(name)
+            if name == 'ndvi':
+                raise ValueError('Test error')
+            
+        scheduler = PlanScheduler(self.TEST_PLAN, execute_function, num_workers=1)
+        self.assertRaises(ValueError, scheduler.run)
+        assert 'masked' not in executed, 'Tasks should not start after an error'
+        
+        circular_plan = [{'a': {'array_input': ['b']}}, {'b': {'array_input': ['a']}}, {'c': {'array_input': []}}]
+        self.assertRaises(AssertionError, PlanScheduler(circular_plan, lambda task: None).run)
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestPlanScheduler
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
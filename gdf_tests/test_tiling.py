@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+#===============================================================================
+# Copyright (c)  2014 Geoscience Australia
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither Geoscience Australia nor the names of its contributors may be
+#       used to endorse or promote products derived from this software
+#       without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#===============================================================================
+
+'''
+Created on 19/10/2015
+
+@author: Alex Ip
+
+Tests for the execution_engine._tiling.py module.
+'''
+
+
+import unittest
+import numpy as np
+from execution_engine._tiling import MASK_OVERLAP, can_tile, crop_result, get_plan_extent, get_tiles, tile_plan, \
+    stitch_results
+
+
+#
+# Test cases
+#
+
+# pylint: disable=too-many-public-methods
+#
+# Disabled to avoid complaints about the unittest.TestCase class.
+#
+
+
+class TestTiling(unittest.TestCase):
+    """Unit tests for spatially tiled plans."""
+
+    MODULE = 'execution_engine._tiling'
+    SUITE = 'TestTiling'
+
+    # 1 degree of 4000 x 4000 pixels
+    TEST_PLAN = [{'data': {'array_input': [{'LS5TM': {'variables': {'B40': {}},
+                                                      'dimensions': {'X': {'range': (140.0, 141.0)},
+                                                                     'Y': {'range': (-36.0, -35.0)},
+                                                                     'T': {'range': (1288569600, 1296518400)}},
+                                                      'dimensions_order': ['T', 'Y', 'X'],
+                                                      'shape': (10, 4000, 4000)}}],
+                           'orig_function': 'get_data'}},
+                 {'median': {'array_input': ['data'], 'dimension': ['T'], 'orig_function': 'median(array1)'}}
+                 ]
+
+    def get_test_result(self, shape=(3, 10, 12)):
+        "Return result with T, Y (reversed) and X dimensions and distinct values"
+        return {'array_result': {'B40': np.arange(np.prod(shape), dtype=np.int16).reshape(shape)},
+                'array_indices': {'T': np.arange(shape[0]) * 86400.0,
+                                  'Y': -35.0 - np.arange(shape[1]) * 0.125,
+                                  'X': 140.0 + np.arange(shape[2]) * 0.125},
+                'array_dimensions': ['T', 'Y', 'X'],
+                'array_output': {'no_data_value': -999, 'shape': shape}
+                }
+
+    def test_plan_extent(self):
+        "Test which plans can be tiled and their extent"
+        assert can_tile(self.TEST_PLAN), 'Plan reducing over T should be tileable'
+        assert not can_tile(self.TEST_PLAN[:1] + [{'mean': {'array_input': ['data'], 'dimension': ['x'], 
+                                                            'orig_function': 'mean(array1)'}}]), \
+            'Plan reducing over X should not be tileable'
+        assert not can_tile(self.TEST_PLAN[1:]), 'Plan without data should not be tileable'
+        
+        assert get_plan_extent(self.TEST_PLAN) == {'X': (140.0, 141.0, 0.00025), 'Y': (-36.0, -35.0, 0.00025)}, \
+            'Plan extent is incorrect'
+        
+    def test_tiles(self):
+        "Test tile boundaries and overlap"
+        extent = get_plan_extent(self.TEST_PLAN)
+        tiles = get_tiles(extent, 1500, MASK_OVERLAP)
+        assert len(tiles) == 9, '4000 pixels should need 3 tiles in each dimension'
+        
+        x_tiles = [tile['X'] for tile in tiles[:3]]
+        assert [tile['Y'] for tile in tiles[:3]] == [tiles[0]['Y']] * 3, 'X should vary fastest'
+        assert x_tiles[0]['core'][0] == 140.0 and x_tiles[-1]['core'][1] == 141.0, 'Tiles should cover the extent'
+        assert [x_tile['last'] for x_tile in x_tiles] == [False, False, True], 'Only the last tile should be flagged'
+        for x_tile, next_x_tile in zip(x_tiles[:-1], x_tiles[1:]):
+            assert x_tile['core'][1] == next_x_tile['core'][0], 'Adjacent tiles should share boundaries'
+            self.assertAlmostEqual(x_tile['range'][1] - x_tile['core'][1], MASK_OVERLAP * 0.00025)
+        assert x_tiles[0]['range'][0] == 140.0 and x_tiles[-1]['range'][1] == 141.0, 'Overlap should be within the extent'
+        
+        tiled_plan = tile_plan(self.TEST_PLAN, tiles[4])
+        dimensions = tiled_plan[0]['data']['array_input'][0]['LS5TM']['dimensions']
+        assert dimensions['X']['range'] == tiles[4]['X']['range'] and dimensions['Y']['range'] == tiles[4]['Y']['range'], \
+            'Tile ranges not applied'
+        assert self.TEST_PLAN[0]['data']['array_input'][0]['LS5TM']['dimensions']['X']['range'] == (140.0, 141.0), \
+            'Original plan modified'
+
+    def test_crop_stitch(self):
+        "Test that results cropped to overlapping tiles stitch back together"
+        result = self.get_test_result()
+        extent = {'X': (140.0, 141.375, 0.125), 'Y': (-36.125, -35.0, 0.125)}
+        tiles = get_tiles(extent, 4, overlap=1)
+        
+        tile_results = [(tile, crop_result(result, dict((dimension, tile[dimension]['range']) for dimension in tile))) 
+                        for tile in tiles]
+        assert tile_results[0][1]['array_output']['shape'] == (3, 6, 6), 'Cropped shape is incorrect'
+        assert crop_result(result, {'X': (139.0, 142.0)})['array_result']['B40'] is result['array_result']['B40'], \
+            'Uncropped array should not be copied'
+        
+        stitched_result = stitch_results(tile_results)
+        assert stitched_result['array_output']['shape'] == (3, 10, 12), 'Stitched shape is incorrect'
+        assert (stitched_result['array_result']['B40'] == result['array_result']['B40']).all(), 'Stitched values differ'
+        for dimension in ['T', 'Y', 'X']:
+            assert np.allclose(stitched_result['array_indices'][dimension], result['array_indices'][dimension]), \
+                'Stitched %s indices differ' % dimension
+        
+        # Only the core of a tile is used
+        stitched_result = stitch_results(tile_results[:1])
+        assert (stitched_result['array_result']['B40'] == result['array_result']['B40'][:, 6:, :4]).all(), \
+            'Single tile values differ'
+        
+        # Values missing from all tiles
+        stitched_result = stitch_results([tile_results[0], tile_results[4]])
+        assert stitched_result['array_output']['shape'] == (3, 8, 8), 'Stitched shape is incorrect'
+        assert (stitched_result['array_result']['B40'][:, :4, :4] == -999).all(), 'Missing values should be no data'
+        assert (stitched_result['array_result']['B40'][:, 4:, :4] == result['array_result']['B40'][:, 6:, :4]).all(), \
+            'Stitched values differ'
+        
+        
+#
+# Define test suites
+#
+def test_suite():
+    """Returns a test suite of all the tests in this module."""
+
+    test_classes = [TestTiling
+                    ]
+
+    suite_list = map(unittest.defaultTestLoader.loadTestsFromTestCase,
+                     test_classes)
+
+    suite = unittest.TestSuite(suite_list)
+
+    return suite
+
+# Define main function
+def main():
+    unittest.TextTestRunner(verbosity=2).run(test_suite())
+    
+#
+# Run unit tests if in __main__
+#
+if __name__ == '__main__':
+    main()
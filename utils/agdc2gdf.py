@@ -47,6 +47,7 @@ import logging
 import errno
 import shutil
 from osgeo import gdal
+from psycopg2.extras import execute_values
 
 import gdf
 from gdf import Database
@@ -55,6 +56,7 @@ from gdf import CommandLineArgs
 from gdf import ConfigFile
 from gdf import GDF
 from gdf import GDFNetCDF
+from gdf import StorageConfig
 from gdf import dt2secs
 from gdf import make_dir
 from gdf import directory_writable
@@ -66,6 +68,9 @@ logger.setLevel(logging.INFO) # Logging level for this module
 
 class AGDC2GDF(GDF):
     DEFAULT_CONFIG_FILE = 'agdc2gdf_default.conf' # N.B: Assumed to reside in code root directory
+    # Tile record fields used to create and index storage units
+    DESCRIPTOR_FIELDS = ['tile_pathname', 'sensor_name', 'level_name', 'dataset_path', 'datetime_processed', 'xml_text', 
+                         'start_datetime', 'end_datetime', 'ul_x', 'ul_y', 'ur_x', 'ur_y', 'll_x', 'll_y', 'lr_x', 'lr_y']
     ARG_DESCRIPTORS = {'xmin': {'short_flag': '-x1', 
                                         'long_flag': '--xmin', 
                                         'default': None, 
@@ -205,8 +210,8 @@ class AGDC2GDF(GDF):
 
         self.agdc_level = self._command_line_params.get('level') or agdc2gdf_config_file_object.configuration['agdc']['level']
         
-        # Read GDF storage configuration from databases
-        self._storage_config = self._get_storage_config()
+        # Read GDF storage configuration from databases (never cached because this utility modifies the databases)
+        self._storage_config = StorageConfig(self, use_cache=False)
         self.storage_type_config = self._storage_config[self.storage_type]
         self.database = self._databases[self.storage_type_config['db_ref']]
         
@@ -250,7 +255,10 @@ class AGDC2GDF(GDF):
         log_multiline(logger.debug, self.__dict__, 'AGDC2GDF.__dict__', '\t')        
 
     def read_agdc(self, storage_indices):        
-        
+        '''
+        Function to return a generator yielding a dict for each AGDC tile in the specified storage unit as it is 
+        streamed from the AGDC database
+        '''
         SQL = '''-- Query to select all tiles in range with required dataset info
 select *
 from tile
@@ -293,10 +301,9 @@ order by end_datetime
 #        log_multiline(logger.debug, SQL, 'SQL', '\t')
 #        log_multiline(logger.debug, params, 'params', '\t')
 
-        tile_result_set = self.agdc_db.submit_query(SQL, params)
+        tile_result_set = self.agdc_db.stream_query(SQL, params)
 
-        # Return descriptor - this shouldn't be too big for one storage unit
-        return [record for record in tile_result_set.record_generator()]
+        return tile_result_set.record_generator()
     
     def create_netcdf(self, storage_indices, data_descriptor):
         '''
@@ -364,8 +371,22 @@ order by end_datetime
     def write_gdf_data(self, storage_indices, data_descriptor, storage_unit_path):
         '''
         Function to write records to database. Must occur in a single transaction
+        Each table is written with a single multi-row statement for the whole storage unit
         '''
 
+        def execute_batch(SQL, argslist, template, fetch=False):
+            '''
+            Function to execute a statement containing a single "values %s" clause for all rows in argslist in one round-trip
+            Returns list of result records if fetch is True
+            '''
+            log_multiline(logger.debug, SQL, 'SQL', '\t')
+            logger.debug('%d value rows', len(argslist))
+            
+            if self.dryrun or not argslist:
+                return []
+            
+            return execute_values(self.database.default_cursor, SQL, argslist, template=template, page_size=len(argslist), fetch=fetch)
+
         def get_storage_key(record, storage_unit_path):
             '''
             Function to write storage unit record if required and return storage unit ID (tuple containing storage_type_id & storage_id)
@@ -402,7 +423,8 @@ where storage_type_id =%(storage_type_id)s
                       'storage_location': self.get_storage_filename(self.storage_type, storage_indices)
                       }
             
-            log_multiline(logger.debug, self.database.default_cursor.mogrify(SQL, params), 'Mogrified SQL', '\t')
+            if logger.isEnabledFor(logging.DEBUG):
+                log_multiline(logger.debug, self.database.default_cursor.mogrify(SQL, params), 'Mogrified SQL', '\t')
             
             if self.dryrun:
                 return (None, None, None)
@@ -413,109 +435,143 @@ where storage_type_id =%(storage_type_id)s
                     storage_id_result.field_values['storage_id'][0],
                     storage_id_result.field_values['storage_version'][0])
             
-        def get_observation_key(record):
+        def get_observation_keys(observation_list):
             '''
-            Function to write observation (acquisition) record if required and return observation ID (tuple containing observation_type_id and observation_id)
+            Function to write observation (acquisition) records if required and return observation IDs 
+            (tuples containing observation_type_id and observation_id) in the same order as observation_list
+            
+            Parameter:
+                observation_list: List of unique (instrument_tag, observation_start_datetime, observation_end_datetime) tuples
             '''
-            SQL = '''-- Attempt to insert an observation record and return observation key
-insert into observation(
-    observation_type_id,
-    observation_id,
-    observation_start_datetime,
-    observation_end_datetime,
-    instrument_type_id,
-    instrument_id
-    )
-select
-    1, -- Optical Satellite
-    nextval('observation_id_seq'::regclass),
-    %(observation_start_datetime)s,
-    %(observation_end_datetime)s,
-    1, -- Passive Satellite-borne
-    (select instrument_id from instrument where instrument_tag = %(instrument_tag)s)
-where not exists (
-    select observation_id from observation
+            SQL = '''-- Insert any missing observation records and return keys for all observations
+with input_observation(observation_index, instrument_tag, observation_start_datetime, observation_end_datetime) as (
+    values %s
+),
+candidate_observation as (
+    select
+        observation_index,
+        instrument_id,
+        observation_start_datetime,
+        observation_end_datetime
+    from input_observation
+    join instrument using(instrument_tag)
+),
+existing_observation as (
+    select
+        observation_index,
+        observation_type_id,
+        observation_id
+    from candidate_observation
+    join observation using(instrument_id, observation_start_datetime, observation_end_datetime)
     where observation_type_id = 1 -- Optical Satellite
-    and instrument_type_id = 1 -- Passive Satellite-borne
-    and instrument_id = (select instrument_id from instrument where instrument_tag = %(instrument_tag)s)
-    and observation_start_datetime = %(observation_start_datetime)s
-    and observation_end_datetime = %(observation_end_datetime)s
-    );
-
-select observation_type_id, observation_id from observation
-where observation_type_id = 1 -- Optical Satellite
-    and instrument_type_id = 1 -- Passive Satellite-borne
-    and instrument_id = (select instrument_id from instrument where instrument_tag = %(instrument_tag)s)
-    and observation_start_datetime = %(observation_start_datetime)s
-    and observation_end_datetime = %(observation_end_datetime)s;
+        and instrument_type_id = 1 -- Passive Satellite-borne
+),
+new_observation as (
+    insert into observation(
+        observation_type_id,
+        observation_id,
+        observation_start_datetime,
+        observation_end_datetime,
+        instrument_type_id,
+        instrument_id
+        )
+    select
+        1, -- Optical Satellite
+        nextval('observation_id_seq'::regclass),
+        observation_start_datetime,
+        observation_end_datetime,
+        1, -- Passive Satellite-borne
+        instrument_id
+    from candidate_observation
+    where observation_index not in (select observation_index from existing_observation)
+    returning observation_type_id, observation_id, instrument_id, observation_start_datetime, observation_end_datetime
+)
+select observation_index, observation_type_id, observation_id from existing_observation
+union all
+select observation_index, observation_type_id, observation_id from new_observation
+join candidate_observation using(instrument_id, observation_start_datetime, observation_end_datetime);
 '''
-            params = {'instrument_tag': record['sensor_name'],
-                      'observation_start_datetime': record['start_datetime'],
-                      'observation_end_datetime': record['end_datetime']
-                      }
-            
-            log_multiline(logger.debug, self.database.default_cursor.mogrify(SQL, params), 'Mogrified SQL', '\t')
+            template = '(%s, %s::varchar, %s::timestamp with time zone, %s::timestamp with time zone)'
+            argslist = [(observation_index,) + observation_list[observation_index] for observation_index in range(len(observation_list))]
             
             if self.dryrun:
-                return (None, None)
+                execute_batch(SQL, argslist, template)
+                return [(None, None)] * len(observation_list)
             
-            observation_id_result = self.database.submit_query(SQL, params)
-            assert observation_id_result.record_count == 1, '%d records retrieved for observation_id query'
-            return (observation_id_result.field_values['observation_type_id'][0], 
-                    observation_id_result.field_values['observation_id'][0])
-           
+            observation_keys = [None] * len(observation_list)
+            for observation_index, observation_type_id, observation_id in execute_batch(SQL, argslist, template, fetch=True):
+                observation_keys[observation_index] = (observation_type_id, observation_id)
+                
+            assert None not in observation_keys, 'Unable to retrieve observation_id for %s' % observation_list[observation_keys.index(None)]
+            return observation_keys
         
-        def get_dataset_key(record, observation_key):
+        def get_dataset_keys(dataset_list):
             '''
-            Function to write observation (acquisition) record if required and return dataset ID (tuple containing dataset_type_id & dataset_id)
+            Function to write dataset records if required and return dataset IDs 
+            (tuples containing dataset_type_id & dataset_id) in the same order as dataset_list
+            
+            Parameter:
+                dataset_list: List of unique (dataset_type_tag, observation_type_id, observation_id, dataset_location, creation_datetime) tuples
             '''
-            SQL = '''-- Attempt to insert a dataset record and return dataset_id
-insert into dataset(
-    dataset_type_id,
-    dataset_id,
-    observation_type_id,
-    observation_id,
-    dataset_location,
-    creation_datetime
-    )
-select
-    (select dataset_type_id from dataset_type where dataset_type_tag = %(dataset_type_tag)s),
-    nextval('dataset_id_seq'::regclass),
-    %(observation_type_id)s,
-    %(observation_id)s,
-    %(dataset_location)s,
-    %(creation_datetime)s
-where not exists (
-    select dataset_id from dataset
-    where observation_type_id = %(observation_type_id)s
-        and observation_id = %(observation_id)s
-        and dataset_location = %(dataset_location)s
-    );
-
-select dataset_type_id, dataset_id from dataset
-where observation_type_id = %(observation_type_id)s
-    and observation_id = %(observation_id)s
-    and dataset_location = %(dataset_location)s
+            SQL = '''-- Insert any missing dataset records and return keys for all datasets
+with input_dataset(dataset_index, dataset_type_tag, observation_type_id, observation_id, dataset_location, creation_datetime) as (
+    values %s
+),
+existing_dataset as (
+    select
+        dataset_index,
+        dataset_type_id,
+        dataset_id
+    from input_dataset
+    join dataset using(observation_type_id, observation_id, dataset_location)
+),
+new_dataset as (
+    insert into dataset(
+        dataset_type_id,
+        dataset_id,
+        observation_type_id,
+        observation_id,
+        dataset_location,
+        creation_datetime
+        )
+    select
+        dataset_type_id,
+        nextval('dataset_id_seq'::regclass),
+        observation_type_id,
+        observation_id,
+        dataset_location,
+        creation_datetime
+    from input_dataset
+    join dataset_type using(dataset_type_tag)
+    where dataset_index not in (select dataset_index from existing_dataset)
+    returning dataset_type_id, dataset_id, observation_type_id, observation_id, dataset_location
+)
+select dataset_index, dataset_type_id, dataset_id from existing_dataset
+union all
+select dataset_index, dataset_type_id, dataset_id from new_dataset
+join input_dataset using(observation_type_id, observation_id, dataset_location);
 '''
-            params = {'dataset_type_tag': 'PQ' if record['level_name'] == 'PQA' else record['level_name'],
-                      'observation_type_id': observation_key[0],
-                      'observation_id': observation_key[1],
-                      'dataset_location': record['dataset_path'],
-                      'creation_datetime': record['datetime_processed'].replace(tzinfo=pytz.UTC) # Convert naiive time to UTC
-                      }
-            
-            log_multiline(logger.debug, self.database.default_cursor.mogrify(SQL, params), 'Mogrified SQL', '\t')
+            template = '(%s, %s::varchar, %s::bigint, %s::bigint, %s::varchar, %s::timestamp with time zone)'
+            argslist = [(dataset_index,) + dataset_list[dataset_index] for dataset_index in range(len(dataset_list))]
             
             if self.dryrun:
-                return -1
+                execute_batch(SQL, argslist, template)
+                return [(None, None)] * len(dataset_list)
             
-            dataset_id_result = self.database.submit_query(SQL, params)
-            assert dataset_id_result.record_count == 1, '%d records retrieved for dataset_id query'
-            return (dataset_id_result.field_values['dataset_type_id'][0], 
-                    dataset_id_result.field_values['dataset_id'][0])
-        
+            dataset_keys = [None] * len(dataset_list)
+            for dataset_index, dataset_type_id, dataset_id in execute_batch(SQL, argslist, template, fetch=True):
+                dataset_keys[dataset_index] = (dataset_type_id, dataset_id)
+                
+            assert None not in dataset_keys, 'Unable to retrieve dataset_id for %s' % (dataset_list[dataset_keys.index(None)],)
+            return dataset_keys
         
-        def set_dataset_metadata(record, dataset_key):
+        def set_dataset_metadata(metadata_list):
+            '''
+            Function to write dataset_metadata records if required
+            
+            Parameter:
+                metadata_list: List of (dataset_type_id, dataset_id, xml_text) tuples
+            '''
             SQL = '''-- Attempt to insert dataset_metadata records
 insert into dataset_metadata(
     dataset_type_id,
@@ -523,32 +579,28 @@ insert into dataset_metadata(
     metadata_xml
     )
 select
-  %(dataset_type_id)s,
-  %(dataset_id)s,
-  %(xml_text)s::xml
+    dataset_type_id,
+    dataset_id,
+    xml_text::xml
+from (
+    values %s
+    ) input_metadata(dataset_type_id, dataset_id, xml_text)
 where not exists (
     select * from dataset_metadata
-    where dataset_type_id = %(dataset_type_id)s
-        and dataset_id = %(dataset_id)s
+    where dataset_metadata.dataset_type_id = input_metadata.dataset_type_id
+        and dataset_metadata.dataset_id = input_metadata.dataset_id
         )
-    and xml_is_well_formed(%(xml_text)s)
+    and xml_is_well_formed(xml_text)
 '''
-            params = {'dataset_type_id': dataset_key[0],
-                      'dataset_id': dataset_key[1],
-                      'xml_text': record['xml_text']
-                      }
-        
-            log_multiline(logger.debug, self.database.default_cursor.mogrify(SQL, params), 'Mogrified SQL', '\t')
-            
-            if self.dryrun:
-                return
-            
-            self.database.submit_query(SQL, params)
+            execute_batch(SQL, metadata_list, '(%s::bigint, %s::bigint, %s::text)')
             
 
-        def set_dataset_dimensions(dataset_key, dimension_key, min_index_max_tuple):
+        def set_dataset_dimensions(dataset_dimension_list):
             '''
-            Function to write dataset_dimension record if required
+            Function to write dataset_dimension records if required
+            
+            Parameter:
+                dataset_dimension_list: List of (dataset_type_id, dataset_id, domain_id, dimension_id, min_value, max_value, indexing_value) tuples
             '''
             SQL = '''-- Attempt to insert dataset_dimension records
 insert into dataset_dimension(
@@ -560,44 +612,30 @@ insert into dataset_dimension(
     max_value,
     indexing_value
     )
-select
-  %(dataset_type_id)s,
-  %(dataset_id)s,
-  %(domain_id)s,
-  %(dimension_id)s,
-  %(min_value)s,
-  %(max_value)s,
-  %(indexing_value)s
+select *
+from (
+    values %s
+    ) input_dataset_dimension(dataset_type_id, dataset_id, domain_id, dimension_id, min_value, max_value, indexing_value)
 where not exists (
     select * from dataset_dimension
-    where dataset_type_id = %(dataset_type_id)s
-        and dataset_id = %(dataset_id)s
-        and domain_id = %(domain_id)s
-        and dimension_id = %(dimension_id)s
+    where dataset_dimension.dataset_type_id = input_dataset_dimension.dataset_type_id
+        and dataset_dimension.dataset_id = input_dataset_dimension.dataset_id
+        and dataset_dimension.domain_id = input_dataset_dimension.domain_id
+        and dataset_dimension.dimension_id = input_dataset_dimension.dimension_id
     );
 '''
-            params = {'dataset_type_id': dataset_key[0],
-                      'dataset_id': dataset_key[1],
-                      'domain_id': dimension_key[0],
-                      'dimension_id': dimension_key[1],
-                      'min_value': min_index_max_tuple[0],
-                      'indexing_value': min_index_max_tuple[1],
-                      'max_value': min_index_max_tuple[2]
-                      }
-            
-            log_multiline(logger.debug, self.database.default_cursor.mogrify(SQL, params), 'Mogrified SQL', '\t')
-            
-            if self.dryrun:
-                return
-            
-            self.database.submit_query(SQL, params)
+            execute_batch(SQL, dataset_dimension_list, 
+                          '(%s::bigint, %s::bigint, %s::bigint, %s::bigint, %s::double precision, %s::double precision, %s::double precision)')
         
         
-        def set_storage_dataset(storage_key, dataset_key):
+        def set_storage_datasets(storage_dataset_list):
             '''
-            Function to write storage_dataset record if required
+            Function to write storage_dataset records if required
+            
+            Parameter:
+                storage_dataset_list: List of (storage_type_id, storage_id, storage_version, dataset_type_id, dataset_id) tuples
             '''
-            SQL = '''-- Attempt to insert storage_dataset record
+            SQL = '''-- Attempt to insert storage_dataset records
 insert into storage_dataset(
     storage_type_id,
     storage_id,
@@ -605,41 +643,31 @@ insert into storage_dataset(
     dataset_type_id,
     dataset_id
     )
-select
-    %(storage_type_id)s,
-    %(storage_id)s,
-    %(storage_version)s,
-    %(dataset_type_id)s,
-    %(dataset_id)s
+select *
+from (
+    values %s
+    ) input_storage_dataset(storage_type_id, storage_id, storage_version, dataset_type_id, dataset_id)
 where not exists (
     select * from storage_dataset
-    where storage_type_id = %(storage_type_id)s
-        and storage_id = %(storage_id)s
-        and storage_version = %(storage_version)s
-        and dataset_type_id = %(dataset_type_id)s
-        and dataset_id = %(dataset_id)s
+    where storage_dataset.storage_type_id = input_storage_dataset.storage_type_id
+        and storage_dataset.storage_id = input_storage_dataset.storage_id
+        and storage_dataset.storage_version = input_storage_dataset.storage_version
+        and storage_dataset.dataset_type_id = input_storage_dataset.dataset_type_id
+        and storage_dataset.dataset_id = input_storage_dataset.dataset_id
     );
 '''
-            params = {'storage_type_id': storage_key[0],
-                      'storage_id': storage_key[1],
-                      'storage_version': storage_key[2],
-                      'dataset_type_id': dataset_key[0],
-                      'dataset_id': dataset_key[1],
-                      }
-            
-            log_multiline(logger.debug, self.database.default_cursor.mogrify(SQL, params), 'Mogrified SQL', '\t')
-            
-            if self.dryrun:
-                return
-            
-            self.database.submit_query(SQL, params)
+            execute_batch(SQL, storage_dataset_list, '(%s::bigint, %s::bigint, %s::integer, %s::bigint, %s::bigint)')
         
         
-        def set_storage_dimension(storage_key, dimension_key, min_index_max_tuple):
+        def set_storage_dimensions(storage_dimension_list):
             '''
-            Function to write storage_dimension record if required
+            Function to write storage_dimension records if required
+            
+            Parameter:
+                storage_dimension_list: List of (storage_type_id, storage_id, storage_version, domain_id, dimension_id, 
+                    storage_dimension_index, storage_dimension_min, storage_dimension_max) tuples
             '''
-            SQL = '''-- Attempt to insert storage_dimension record
+            SQL = '''-- Attempt to insert storage_dimension records
 insert into storage_dimension(
     storage_type_id,
     storage_id,
@@ -650,41 +678,22 @@ insert into storage_dimension(
     storage_dimension_min,
     storage_dimension_max
     )
-select
-    %(storage_type_id)s,
-    %(storage_id)s,
-    %(storage_version)s,
-    %(domain_id)s,
-    %(dimension_id)s,
-    %(storage_dimension_index)s,
-    %(storage_dimension_min)s,
-    %(storage_dimension_max)s
+select *
+from (
+    values %s
+    ) input_storage_dimension(storage_type_id, storage_id, storage_version, domain_id, dimension_id, 
+                              storage_dimension_index, storage_dimension_min, storage_dimension_max)
 where not exists (
     select * from storage_dimension
-    where storage_type_id = %(storage_type_id)s
-        and storage_id = %(storage_id)s
-        and storage_version = %(storage_version)s
-        and domain_id = %(domain_id)s
-        and dimension_id = %(dimension_id)s
+    where storage_dimension.storage_type_id = input_storage_dimension.storage_type_id
+        and storage_dimension.storage_id = input_storage_dimension.storage_id
+        and storage_dimension.storage_version = input_storage_dimension.storage_version
+        and storage_dimension.domain_id = input_storage_dimension.domain_id
+        and storage_dimension.dimension_id = input_storage_dimension.dimension_id
     );
 '''
-            params = {'storage_type_id': storage_key[0],
-                      'storage_id': storage_key[1],
-                      'storage_version': storage_key[2],
-                      'domain_id': dimension_key[0],
-                      'dimension_id': dimension_key[1],
-                      'storage_dimension_min': min_index_max_tuple[0],
-                      'storage_dimension_index': min_index_max_tuple[1],
-                      'storage_dimension_max': min_index_max_tuple[2]
-                      }
-
-            log_multiline(logger.debug, SQL, 'SQL', '\t')
-            log_multiline(logger.debug, self.database.default_cursor.mogrify(SQL, params), 'Mogrified SQL', '\t')
-            
-            if self.dryrun:
-                return
-            
-            self.database.submit_query(SQL, params)
+            execute_batch(SQL, storage_dimension_list, 
+                          '(%s::bigint, %s::bigint, %s::integer, %s::bigint, %s::bigint, %s::integer, %s::double precision, %s::double precision)')
         
         
         # Start of write_gdf_data(self, storage_indices, data_descriptor, storage_unit_path) definition
@@ -702,31 +711,72 @@ where not exists (
 
             # Set storage_dimension record for each dimension
             logger.debug('self.dimensions = %s', self.dimensions)
+            storage_dimension_list = []
             for dimension_index in range(len(self.dimensions)):
-                logger.debug('dimension_index = %d', dimension_index)
                 dimension = self.dimensions.keys()[dimension_index]
                 logger.debug('dimension = %s', dimension)
                 dimension_key = (self.dimensions[dimension]['domain_id'],
                                  self.dimensions[dimension]['dimension_id']
                                  )
-                logger.debug('dimension_key = %s', dimension_key)
 
-                min_index_max_tuple = (self.index2ordinate(self.storage_type, dimension, storage_indices[dimension_index]),
-                                       storage_indices[dimension_index], # Indexing value
-                                       self.index2ordinate(self.storage_type, dimension, storage_indices[dimension_index] + 1)
-                                       )
+                storage_dimension_list.append(storage_key + dimension_key + 
+                                              (storage_indices[dimension_index], # Indexing value
+                                               self.index2ordinate(self.storage_type, dimension, storage_indices[dimension_index]),
+                                               self.index2ordinate(self.storage_type, dimension, storage_indices[dimension_index] + 1)
+                                               )
+                                              )
 
-                set_storage_dimension(storage_key, dimension_key, min_index_max_tuple)
+            set_storage_dimensions(storage_dimension_list)
                 
-            # Process each tile record
+            # Write all observations for the storage unit at once
+            observation_list = []
+            observation_index_dict = {} # Index into observation_list keyed by observation tuple
+            record_observation_indices = []
             for record in data_descriptor:
-                observation_key = get_observation_key(record)
-                logger.debug('observation_key = %s', observation_key)
+                observation = (record['sensor_name'], record['start_datetime'], record['end_datetime'])
+                if observation not in observation_index_dict:
+                    observation_index_dict[observation] = len(observation_list)
+                    observation_list.append(observation)
+                record_observation_indices.append(observation_index_dict[observation])
+                
+            observation_keys = get_observation_keys(observation_list)
+            logger.debug('observation_keys = %s', observation_keys)
 
-                dataset_key = get_dataset_key(record, observation_key)
-                logger.debug('dataset_key = %s', dataset_key)
+            # Write all datasets for the storage unit at once
+            dataset_list = []
+            dataset_index_dict = {} # Index into dataset_list keyed by observation key and dataset location
+            record_dataset_indices = []
+            for record_index in range(len(data_descriptor)):
+                record = data_descriptor[record_index]
+                observation_key = observation_keys[record_observation_indices[record_index]]
+                # Datasets are identified by observation and location
+                dataset_identifier = (record_observation_indices[record_index], record['dataset_path'])
+                if dataset_identifier not in dataset_index_dict:
+                    dataset_index_dict[dataset_identifier] = len(dataset_list)
+                    dataset_list.append(('PQ' if record['level_name'] == 'PQA' else record['level_name'],) +
+                                        observation_key +
+                                        (record['dataset_path'],
+                                         record['datetime_processed'].replace(tzinfo=pytz.UTC) # Convert naiive time to UTC
+                                         )
+                                        )
+                record_dataset_indices.append(dataset_index_dict[dataset_identifier])
+                
+            dataset_keys = get_dataset_keys(dataset_list)
+            logger.debug('dataset_keys = %s', dataset_keys)
+            
+            # Build metadata, dataset_dimension and storage_dataset rows for every dataset
+            metadata_list = []
+            dataset_dimension_list = []
+            storage_dataset_list = []
+            processed_dataset_indices = set()
+            for record_index in range(len(data_descriptor)):
+                record = data_descriptor[record_index]
+                if record_dataset_indices[record_index] in processed_dataset_indices:
+                    continue # Rows for this dataset have already been created
+                processed_dataset_indices.add(record_dataset_indices[record_index])
+                dataset_key = dataset_keys[record_dataset_indices[record_index]]
                 
-                set_dataset_metadata(record, dataset_key)
+                metadata_list.append(dataset_key + (record['xml_text'],))
                 
                 # Set dataset_dimension record for each dimension
                 for dimension in self.dimensions:
@@ -735,26 +785,30 @@ where not exists (
                                      )
 
                     if dimension == 'X':
-                        min_index_max_tuple = (min(record['ul_x'], record['ll_x']),
-                                               None, # No indexing value for regular dimension
-                                               max(record['ur_x'], record['lr_x'])
+                        min_max_index_tuple = (min(record['ul_x'], record['ll_x']),
+                                               max(record['ur_x'], record['lr_x']),
+                                               None # No indexing value for regular dimension
                                                )
                     elif dimension == 'Y':
-                        min_index_max_tuple = (min(record['ll_y'], record['lr_y']),
-                                               None, # No indexing value for regular dimension
-                                               max(record['ul_y'], record['ur_y'])
+                        min_max_index_tuple = (min(record['ll_y'], record['lr_y']),
+                                               max(record['ul_y'], record['ur_y']),
+                                               None # No indexing value for regular dimension
                                                )
                     elif dimension == 'T':
                         min_value = dt2secs(record['start_datetime'])
                         max_value = dt2secs(record['end_datetime'])
-                        min_index_max_tuple = (min_value,
-                                               int((min_value + max_value) / 2.0 + 0.5),
-                                               max_value
+                        min_max_index_tuple = (min_value,
+                                               max_value,
+                                               int((min_value + max_value) / 2.0 + 0.5)
                                                )
                         
-                    set_dataset_dimensions(dataset_key, dimension_key, min_index_max_tuple)
+                    dataset_dimension_list.append(dataset_key + dimension_key + min_max_index_tuple)
+                
+                storage_dataset_list.append(storage_key + dataset_key)
                 
-                set_storage_dataset(storage_key, dataset_key)
+            set_dataset_metadata(metadata_list)
+            set_dataset_dimensions(dataset_dimension_list)
+            set_storage_datasets(storage_dataset_list)
                 
             self.database.commit() # Commit transaction    
         except Exception, caught_exception:
@@ -793,7 +847,9 @@ def main():
     # Do migration in storage unit batches
     for storage_indices in storage_indices_list:
         try:
-            data_descriptor = agdc2gdf.read_agdc(storage_indices) 
+            # Consume tile records as they are streamed, keeping only the fields needed to create and index the storage unit
+            data_descriptor = [{field_name: record[field_name] for field_name in AGDC2GDF.DESCRIPTOR_FIELDS} 
+                               for record in agdc2gdf.read_agdc(storage_indices)]
             if not data_descriptor:
                 logger.info('No tiles found for storage unit %s', storage_indices)
                 continue